@@ -0,0 +1,1384 @@
+"""Micro and throughput benchmarks for the streaming components.
+
+Usage: python Benchmark.py <benchmark> [options]
+Run `python Benchmark.py -h` for the list of benchmarks.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+from VideoStream import MJPEGScanner, VideoStream, DEFAULT_FRAME_RATE
+from RtpPacket import RtpPacket, RtpHeaderTemplate, PendingPacket, FRAGMENT_FLAG_PARITY, FRAGMENT_FLAG_RETRANSMIT
+from NetworkStats import (NetworkStats, LatencyHistogram, SlidingWindow, WINDOW_FIELDS, PACKETS_RECEIVED,
+                          BYTES_RECEIVED)
+from Reassembler import Reassembler
+from RtpReceiver import RtpReceiver
+from Transcoder import Image
+from Broadcast import LIVE_PREFIX
+
+
+# ----------------------------------------------------------------------
+# Synthetic video generation
+# ----------------------------------------------------------------------
+
+def _segment(marker, body):
+	"""Build a JPEG marker segment with its length field."""
+	return bytes([0xFF, marker]) + struct.pack('>H', len(body) + 2) + body
+
+
+def makeSyntheticJpeg(size, rng, width=1920, height=1080, thumbnail=True):
+	"""Build a structurally valid JPEG of roughly the given size.
+
+	The entropy-coded data is random (with FF byte stuffing), and an EXIF
+	APP1 segment carries an embedded thumbnail JPEG with its own SOI/EOI
+	markers, like real camera output.
+	"""
+	headers = bytearray(b'\xff\xd8')
+	headers += _segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+	if thumbnail:
+		thumb = (b'\xff\xd8' + _segment(0xDB, b'\x00' + bytes(64))
+		         + _segment(0xDA, b'\x01\x01\x00\x00\x3f\x00')
+		         + rng.randbytes(1024).replace(b'\xff', b'\xff\x00') + b'\xff\xd9')
+		headers += _segment(0xE1, b'Exif\x00\x00' + thumb)
+	headers += _segment(0xDB, b'\x00' + bytes(rng.randrange(1, 64) for _ in range(64)))
+	headers += _segment(0xC0, struct.pack('>BHHB', 8, height, width, 3)
+	                    + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01')
+	headers += _segment(0xC4, b'\x00' + bytes([0, 1, 5, 1, 1, 1, 1, 1, 1] + [0] * 7) + bytes(range(12)))
+	headers += _segment(0xDA, b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00')
+
+	entropySize = max(size - len(headers) - 2, 16)
+	entropy = rng.randbytes(entropySize).replace(b'\xff', b'\xff\x00')
+	return bytes(headers) + entropy[:entropySize].rstrip(b'\xff') + b'\xff\xd9'
+
+
+def writeSyntheticVideo(path, frames, frameSize, fileFormat='mjpeg', seed=1, **kwargs):
+	"""Write a synthetic MJPEG or custom-format (5-digit length prefix) video."""
+	rng = random.Random(seed)
+	with open(path, 'wb') as f:
+		for _ in range(frames):
+			jitter = rng.randrange(-frameSize // 10, frameSize // 10 + 1)
+			jpeg = makeSyntheticJpeg(frameSize + jitter, rng, **kwargs)
+			if fileFormat == 'custom':
+				f.write(b'%05d' % len(jpeg))
+			f.write(jpeg)
+	return path
+
+
+def writeDecodableVideo(path, frames, width, height, distinct=8, quality=85):
+	"""Write an MJPEG of real, decodable JPEGs (needs Pillow): `distinct` smooth noise textures, repeated."""
+	gradient = Image.linear_gradient('L').resize((width, height))
+	jpegs = []
+	for _ in range(distinct):
+		texture = Image.effect_noise((max(1, width // 24), max(1, height // 24)), 60).resize((width, height), Image.BICUBIC)
+		out = io.BytesIO()
+		Image.merge('RGB', [gradient, texture, gradient.transpose(Image.FLIP_LEFT_RIGHT)]).save(out, 'JPEG',
+		                                                                                         quality=quality)
+		jpegs.append(out.getvalue())
+	with open(path, 'wb') as f:
+		for i in range(frames):
+			f.write(jpegs[i % distinct])
+	return path
+
+
+# ----------------------------------------------------------------------
+# Reference implementations (before optimization)
+# ----------------------------------------------------------------------
+
+def legacyNextFrameMJPEG(file):
+	"""Byte-at-a-time MJPEG frame reader, as VideoStream originally parsed."""
+	frameData = bytearray()
+	byte1 = file.read(1)
+	if not byte1:
+		return None
+	if byte1[0] != 0xFF:
+		while True:
+			byte1 = file.read(1)
+			if not byte1:
+				return None
+			if byte1[0] == 0xFF:
+				break
+	byte2 = file.read(1)
+	if not byte2 or byte2[0] != 0xD8:
+		return None
+	frameData.extend(byte1)
+	frameData.extend(byte2)
+	while True:
+		byte = file.read(1)
+		if not byte:
+			if len(frameData) > 100:
+				break
+			return None
+		frameData.append(byte[0])
+		if len(frameData) >= 2 and frameData[-2] == 0xFF and frameData[-1] == 0xD9:
+			break
+		if len(frameData) > 5000000:
+			break
+	return bytes(frameData) if len(frameData) > 100 else None
+
+
+# ----------------------------------------------------------------------
+# Benchmarks
+# ----------------------------------------------------------------------
+
+def _timed(fn):
+	"""Run fn once and return (result, seconds)."""
+	start = time.perf_counter()
+	result = fn()
+	return result, time.perf_counter() - start
+
+
+def _residentBytes():
+	"""Resident set size of this process, or None where /proc is unavailable."""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, AttributeError):
+		return None
+
+
+def _openFileCount():
+	"""Number of open file descriptors, or None where /proc is unavailable."""
+	try:
+		return len(os.listdir('/proc/self/fd'))
+	except OSError:
+		return None
+
+
+def _fragmentAll(data, payloadSize):
+	"""Slice a frame into fragment payloads the way ServerWorker does."""
+	return [data[i:i + payloadSize] for i in range(0, len(data), payloadSize)]
+
+
+def benchMjpegScan(args):
+	"""MJPEG frame boundary scanning: block scanner vs byte-at-a-time parser."""
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		# Throughput is compared on thumbnail-free frames, which both parsers split correctly
+		plain = writeSyntheticVideo(os.path.join(tmp, 'plain.Mjpeg'), args.frames, args.frame_size,
+		                            thumbnail=False)
+		exif = writeSyntheticVideo(os.path.join(tmp, 'exif.Mjpeg'), args.frames, args.frame_size)
+		fileSize = os.path.getsize(plain)
+
+		def scan(path):
+			with open(path, 'rb') as f:
+				return sum(1 for _ in MJPEGScanner(f).frames())
+
+		def legacy(path):
+			count = 0
+			with open(path, 'rb') as f:
+				while legacyNextFrameMJPEG(f) is not None:
+					count += 1
+			return count
+
+		count, elapsed = _timed(lambda: scan(plain))
+		results['scanner'] = {'frames': count, 'seconds': elapsed,
+		                      'MBps': fileSize / elapsed / 1e6, 'fps': count / elapsed}
+
+		if not args.skip_legacy:
+			count, elapsed = _timed(lambda: legacy(plain))
+			results['legacy'] = {'frames': count, 'seconds': elapsed,
+			                     'MBps': fileSize / elapsed / 1e6, 'fps': count / elapsed}
+			results['speedup'] = results['legacy']['seconds'] / results['scanner']['seconds']
+
+		# Frames found in a file whose frames embed EXIF thumbnails
+		results['exif_frames'] = {'expected': args.frames, 'scanner': scan(exif)}
+		if not args.skip_legacy:
+			results['exif_frames']['legacy'] = legacy(exif)
+		results['file_bytes'] = fileSize
+	return results
+
+
+def benchMmapSource(args):
+	"""Frame source memory and copies: per-session file reads vs one shared mmap."""
+	from ServerWorker import ServerWorker
+	payloadSize = ServerWorker.MAX_PAYLOAD_SIZE
+
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		path = writeSyntheticVideo(os.path.join(tmp, 'bench.Mjpeg'), args.frames, args.frame_size)
+
+		for mode, useMmap in (('file', False), ('mmap', True)):
+			gc.collect()
+			rssBefore = _residentBytes()
+			fdsBefore = _openFileCount()
+			sessions = [VideoStream(path, useMmap=useMmap) for _ in range(args.sessions)]
+
+			# Throughput: every session reads and fragments the whole file
+			start = time.perf_counter()
+			frames = 0
+			for stream in sessions:
+				while True:
+					data = stream.nextFrame()
+					if data is None:
+						break
+					_fragmentAll(data, payloadSize)
+					frames += 1
+			elapsed = time.perf_counter() - start
+
+			# Copies: bytes allocated while reading and fragmenting one frame
+			for stream in sessions:
+				stream.reset()
+			tracemalloc.start()
+			allocated = 0
+			frameBytes = 0
+			inFlight = []
+			for stream in sessions:
+				before = tracemalloc.get_traced_memory()[0]
+				tracemalloc.reset_peak()
+				data = stream.nextFrame()
+				fragments = _fragmentAll(data, payloadSize)
+				allocated += tracemalloc.get_traced_memory()[1] - before
+				frameBytes += len(data)
+				# Every session keeps one frame in flight, as during a send
+				inFlight.append((data, fragments))
+			heldBytes = tracemalloc.get_traced_memory()[0]
+			tracemalloc.stop()
+
+			results[mode] = {
+				'sessions': args.sessions,
+				'frames_per_sec': frames / elapsed,
+				'alloc_bytes_per_frame': allocated / args.sessions,
+				'payload_copies_per_frame': allocated / frameBytes,
+				'heap_bytes_in_flight': heldBytes,
+				'open_files_delta': (_openFileCount() - fdsBefore) if fdsBefore is not None else None,
+				'rss_delta_bytes': (_residentBytes() - rssBefore) if rssBefore is not None else None,
+			}
+
+			del inFlight, data, fragments
+			for stream in sessions:
+				stream.close()
+			del sessions
+	return results
+
+
+# ----------------------------------------------------------------------
+# Server process helpers
+# ----------------------------------------------------------------------
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _freePort(kind=socket.SOCK_STREAM):
+	"""Return a currently unused local port."""
+	with socket.socket(socket.AF_INET, kind) as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+
+def startServer(port, extraArgs=()):
+	"""Start Server.py in a child process and wait until it accepts connections."""
+	proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'Server.py'), str(port)] + list(extraArgs),
+	                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=REPO_DIR)
+	deadline = time.monotonic() + 10
+	while time.monotonic() < deadline:
+		try:
+			socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+			return proc
+		except OSError:
+			time.sleep(0.05)
+	proc.kill()
+	raise RuntimeError("Server did not start")
+
+
+def stopServer(proc):
+	proc.terminate()
+	try:
+		proc.wait(5)
+	except subprocess.TimeoutExpired:
+		proc.kill()
+
+
+def processUsage(pid):
+	"""Return (cpu seconds, rss bytes, thread count) of a process from /proc, or Nones."""
+	try:
+		with open(f'/proc/{pid}/stat') as f:
+			fields = f.read().rsplit(')', 1)[1].split()
+		with open(f'/proc/{pid}/statm') as f:
+			rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+		ticks = os.sysconf('SC_CLK_TCK')
+		# Fields after the command name: utime=11, stime=12, num_threads=17 (0-based)
+		return (int(fields[11]) + int(fields[12])) / ticks, rss, int(fields[17])
+	except (OSError, ValueError, IndexError, AttributeError):
+		return None, None, None
+
+
+def rtspRequest(sock, method, filename, seq, session=None, rtpPort=None):
+	"""Send one RTSP request the way Client.py does and return the reply lines."""
+	request = f"{method} {filename} RTSP/1.0\nCSeq: {seq}"
+	if rtpPort is not None:
+		request += f"\nTransport: RTP/UDP; client_port= {rtpPort}"
+	else:
+		request += f"\nSession: {session}"
+	sock.send(request.encode())
+	return sock.recv(1024).decode().split('\n')
+
+
+class PacketSink:
+	"""UDP socket counting RTP packets and complete frames (marker bit) in a thread."""
+
+	def __init__(self):
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+		self.sock.bind(('127.0.0.1', 0))
+		self.sock.settimeout(0.2)
+		self.port = self.sock.getsockname()[1]
+		self.packets = 0
+		self.frames = 0
+		self.running = True
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	def _run(self):
+		while self.running:
+			try:
+				data = self.sock.recv(65536)
+			except socket.timeout:
+				continue
+			except OSError:
+				break
+			self.packets += 1
+			if data[1] & 0x80:
+				self.frames += 1
+
+	def close(self):
+		self.running = False
+		self.thread.join()
+		self.sock.close()
+
+
+def runSinkSessions(port, filename, count, duration, serverPid):
+	"""Play count sessions of a file into one PacketSink for duration seconds. Return rates and server usage."""
+	sink = PacketSink()
+	connections = []
+	try:
+		for _ in range(count):
+			conn = socket.create_connection(('127.0.0.1', port))
+			reply = rtspRequest(conn, 'SETUP', filename, 1, rtpPort=sink.port)
+			session = reply[2].split(' ')[1]
+			rtspRequest(conn, 'PLAY', filename, 2, session)
+			connections.append((conn, session))
+
+		cpuBefore = processUsage(serverPid)[0]
+		framesBefore = sink.frames
+		start = time.monotonic()
+		time.sleep(duration)
+		elapsed = time.monotonic() - start
+		frames = sink.frames - framesBefore
+		cpuAfter, rss, threads = processUsage(serverPid)
+
+		for seq, (conn, session) in enumerate(connections, 3):
+			try:
+				rtspRequest(conn, 'TEARDOWN', filename, seq, session)
+			except OSError:
+				pass
+	finally:
+		for conn, _ in connections:
+			conn.close()
+		sink.close()
+	return {
+		'fps_per_session': frames / elapsed / count,
+		'server_cpu_pct': ((cpuAfter - cpuBefore) / elapsed * 100) if cpuBefore is not None else None,
+		'server_rss_mb': rss / 1048576 if rss is not None else None,
+		'server_threads': threads,
+	}
+
+
+def benchSessionScaling(args):
+	"""Session-count scaling: thread-per-client vs event-loop server over loopback."""
+	counts = [int(c) for c in args.counts.split(',')]
+	modes = {'threaded': [], 'event-loop': ['--event-loop']}
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		video = writeSyntheticVideo(os.path.join(tmp, 'bench.Mjpeg'), args.frames, args.frame_size)
+		for mode, extraArgs in modes.items():
+			results[mode] = {}
+			for count in counts:
+				port = _freePort()
+				proc = startServer(port, extraArgs)
+				try:
+					results[mode][count] = runSinkSessions(port, video, count, args.duration, proc.pid)
+				finally:
+					stopServer(proc)
+	return results
+
+
+def benchSeek(args):
+	"""Time to first frame after PLAY with a Range at growing offsets, and media time covered per second with Scale."""
+	results = {'range': {}, 'scale': {}}
+	with tempfile.TemporaryDirectory() as tmp:
+		video = writeSyntheticVideo(os.path.join(tmp, 'bench.Mjpeg'), args.frames, args.frame_size)
+		port = _freePort()
+		proc = startServer(port)
+		try:
+			duration = args.frames / DEFAULT_FRAME_RATE
+			for share in (0.0, 0.25, 0.5, 0.9):
+				arrivals = []
+				receiver = RtpReceiver('127.0.0.1', port, _freePort(socket.SOCK_DGRAM), video,
+				                       onFrame=lambda frameNbr, data: arrivals.append((time.monotonic(), frameNbr)))
+				receiver.setup()
+				receiver.seek(share * duration)
+				start = time.monotonic()
+				receiver.play()
+				while not arrivals and time.monotonic() - start < 2.0:
+					time.sleep(0.001)
+				receiver.teardown()
+				results['range'][f"{share * duration:.0f}s"] = {
+					'first_frame_ms': (arrivals[0][0] - start) * 1000 if arrivals else None,
+					'first_frame': arrivals[0][1] if arrivals else None,
+				}
+
+			for scale in (1.0, 4.0, 8.0):
+				arrivals = []
+				receiver = RtpReceiver('127.0.0.1', port, _freePort(socket.SOCK_DGRAM), video,
+				                       onFrame=lambda frameNbr, data: arrivals.append(frameNbr))
+				receiver.setup()
+				receiver.scale = scale
+				receiver.play()
+				time.sleep(args.duration)
+				stats = receiver.getStats()
+				receiver.teardown()
+				results['scale'][f"{scale:g}x"] = {
+					'fps': stats['fps'],
+					'media_s_per_s': (arrivals[-1] - arrivals[0]) / DEFAULT_FRAME_RATE / args.duration if arrivals else 0,
+					'kbps': stats['bytes_received'] * 8 / 1000 / args.duration,
+				}
+		finally:
+			stopServer(proc)
+	return results
+
+
+def benchBroadcast(args):
+	"""Server CPU per viewer: one on-demand session per viewer vs one broadcast channel (live/) for all."""
+	counts = [int(c) for c in args.counts.split(',')]
+	width, height, frameSize = RESOLUTIONS[args.resolution]
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		video = writeSyntheticVideo(os.path.join(tmp, 'bench.Mjpeg'), args.frames, frameSize, width=width,
+		                            height=height)
+		for mode, filename in (('on-demand', video), ('broadcast', LIVE_PREFIX + video)):
+			results[mode] = {}
+			for count in counts:
+				port = _freePort()
+				proc = startServer(port, args.server_args.split())
+				try:
+					row = runSinkSessions(port, filename, count, args.duration, proc.pid)
+				finally:
+					stopServer(proc)
+				if row['server_cpu_pct'] is not None:
+					row['cpu_ms_per_viewer_s'] = row['server_cpu_pct'] * 10 / count
+				results[mode][count] = row
+	return results
+
+
+# ----------------------------------------------------------------------
+# End-to-end load test
+# ----------------------------------------------------------------------
+
+# Synthetic video profiles: (width, height, average frame size in bytes)
+RESOLUTIONS = {
+	'sd': (640, 480, 20000),
+	'720p': (1280, 720, 50000),
+	'1080p': (1920, 1080, 120000),
+}
+CUSTOM_MAX_FRAME = 99999  # 5-digit length prefix of the custom format
+
+
+class LoadReceiver(RtpReceiver):
+	"""RtpReceiver that also records frame latency and per-frame fragment counts.
+
+	Latency is measured against the server's drift-free schedule: frame n
+	is due at PLAY + (n - 1) / fps, so lateness from pacing lag, queuing or
+	reassembly all shows up.
+	"""
+
+	def __init__(self, *args, frameRate=DEFAULT_FRAME_RATE, **kwargs):
+		super().__init__(*args, onFrame=self.recordFrame, **kwargs)
+		self.interval = 1.0 / frameRate
+		self.playSent = None
+		self.latency = LatencyHistogram()  # ms
+		self.delivered = []
+		self.fragments = {}  # frame number -> [data fragments sent, data fragments received]
+
+	def play(self):
+		self.playSent = time.monotonic()
+		return super().play()
+
+	def processPacket(self, rtpPacket, size):
+		counts = self.fragments.get(rtpPacket.seqNum())
+		if counts is None:
+			counts = self.fragments[rtpPacket.seqNum()] = [rtpPacket.getTotalFragments(), 0]
+		# FEC parity and NACKed resends are not counted: the frame's total counts only its data fragments
+		if not rtpPacket.fragmentFields[4] & (FRAGMENT_FLAG_PARITY | FRAGMENT_FLAG_RETRANSMIT):
+			counts[1] += 1
+		super().processPacket(rtpPacket, size)
+
+	def recordFrame(self, frameNbr, data):
+		self.delivered.append(frameNbr)
+		self.latency.record((time.monotonic() - (self.playSent + (frameNbr - 1) * self.interval)) * 1000)
+
+	def getLoadStats(self):
+		"""Return delivery counts, leaving out the newest frame (possibly cut off by TEARDOWN)."""
+		if not self.fragments:
+			last = first = 0
+		else:
+			first, last = min(self.fragments), max(self.fragments)
+		fragmented = [counts for frameNbr, counts in self.fragments.items() if counts[0] > 1 and frameNbr < last]
+		return {
+			'fps': self.getStats()['fps'],
+			'frames_received': sum(1 for frameNbr in self.delivered if frameNbr < last),
+			'frames_expected': last - first,
+			'fragments_received': sum(counts[1] for counts in fragmented),
+			'fragments_expected': sum(counts[0] for counts in fragmented),
+			'latency': self.latency,
+		}
+
+
+def _runLoadClients(port, video, count, seconds):
+	"""Run count LoadReceivers against the server for seconds (in a worker process)."""
+	receivers = [LoadReceiver('127.0.0.1', port, _freePort(socket.SOCK_DGRAM), video) for _ in range(count)]
+	started = []
+	for receiver in receivers:
+		try:
+			if receiver.setup() and receiver.play():
+				started.append(receiver)
+		except OSError as e:
+			print(f"[Benchmark] Receiver failed to start: {e}")
+	time.sleep(seconds)
+	for receiver in receivers:
+		receiver.stopListening(wait=False)
+	for receiver in receivers:
+		receiver.teardown()
+	return [receiver.getLoadStats() for receiver in started]
+
+
+def runLoad(port, video, count, duration, warmup, clientProcs, serverPid):
+	"""Drive count sessions for warmup + duration seconds. Return aggregated results."""
+	procs = max(1, min(clientProcs, count))
+	shares = [count // procs + (1 if i < count % procs else 0) for i in range(procs)]
+	with multiprocessing.Pool(procs) as pool:
+		pending = pool.starmap_async(_runLoadClients, [(port, video, share, warmup + duration) for share in shares])
+		time.sleep(warmup)
+		cpuBefore = processUsage(serverPid)[0]
+		time.sleep(duration)
+		cpuAfter, rss, threads = processUsage(serverPid)
+		sessions = [session for share in pending.get() for session in share]
+
+	latency = LatencyHistogram()
+	for session in sessions:
+		latency.merge(session['latency'])
+	framesExpected = sum(session['frames_expected'] for session in sessions)
+	framesReceived = sum(session['frames_received'] for session in sessions)
+	fragmentsExpected = sum(session['fragments_expected'] for session in sessions)
+	fragmentsReceived = sum(session['fragments_received'] for session in sessions)
+	fps = [session['fps'] for session in sessions]
+	if fragmentsReceived > fragmentsExpected:
+		# Each data fragment is sent once: more means parity or resent packets were counted
+		raise RuntimeError(f"Received {fragmentsReceived} fragments of {fragmentsExpected} sent")
+	return {
+		'sessions_started': len(sessions),
+		'fps_per_session': (sum(fps) / len(fps)) if fps else 0,
+		'min_fps': min(fps) if fps else 0,
+		'frame_loss_pct': (100 - framesReceived / framesExpected * 100) if framesExpected else 0,
+		'fragment_loss_pct': (100 - fragmentsReceived / fragmentsExpected * 100) if fragmentsExpected else 0,
+		'latency_p50_ms': latency.percentile(50) if latency.count else None,
+		'latency_p95_ms': latency.percentile(95) if latency.count else None,
+		'latency_p99_ms': latency.percentile(99) if latency.count else None,
+		'latency_max_ms': latency.max,
+		'server_cpu_pct': ((cpuAfter - cpuBefore) / duration * 100) if cpuBefore is not None else None,
+		'server_rss_mb': rss / 1048576 if rss is not None else None,
+		'server_threads': threads,
+	}
+
+
+def benchLoad(args):
+	"""End-to-end load test: N headless receivers per video profile against a local server."""
+	counts = [int(c) for c in args.counts.split(',')]
+	serverArgs = args.server_args.split()
+	# Enough frames that no stream ends during the measurement
+	frames = int((args.warmup + args.duration + 5) * DEFAULT_FRAME_RATE)
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		for fileFormat in args.formats.split(','):
+			for resolution in args.resolutions.split(','):
+				width, height, frameSize = RESOLUTIONS[resolution]
+				name = f"{fileFormat}-{resolution}"
+				if fileFormat == 'custom' and frameSize * 11 // 10 > CUSTOM_MAX_FRAME:
+					results[name] = {'skipped': f"custom format frames are limited to {CUSTOM_MAX_FRAME} bytes"}
+					continue
+
+				video = writeSyntheticVideo(os.path.join(tmp, f"{name}.{'Mjpeg' if fileFormat == 'mjpeg' else 'bin'}"),
+				                            frames, frameSize, fileFormat, width=width, height=height)
+				results[name] = {}
+				for count in counts:
+					port = _freePort()
+					proc = startServer(port, serverArgs)
+					try:
+						results[name][count] = runLoad(port, video, count, args.duration, args.warmup,
+						                               args.client_procs, proc.pid)
+					finally:
+						stopServer(proc)
+	return results
+
+
+class LossyReceiver(LoadReceiver):
+	"""LoadReceiver dropping incoming packets at random, to measure loss recovery."""
+
+	def __init__(self, *args, loss=0.0, nack=True, seed=1, **kwargs):
+		self.SEND_NACKS = nack
+		super().__init__(*args, **kwargs)
+		self.loss = loss
+		self.rng = random.Random(seed)
+		self.dropped = 0
+
+	def handlePacket(self, data):
+		if self.rng.random() < self.loss:
+			self.dropped += 1
+			return
+		super().handlePacket(data)
+
+	def getLoadStats(self):
+		stats = super().getLoadStats()
+		received = self.getStats()
+		stats.update({
+			'packets_dropped': self.dropped,
+			'packets_received': received['packets_received'],
+			'nacks_sent': received['nacks_sent'],
+			'retransmits_received': received['retransmits_received'],
+			'recovered': received['reassembly']['recovered'],
+			'fec_received': received['fec_packets_received'],
+			'fec_recovered': received['fec_recovered'],
+		})
+		return stats
+
+
+def runRecovery(port, video, count, seconds, loss, nack):
+	"""Run count LossyReceivers for seconds. Return their summed delivery counters."""
+	receivers = [LossyReceiver('127.0.0.1', port, _freePort(socket.SOCK_DGRAM), video, loss=loss, nack=nack, seed=i)
+	             for i in range(count)]
+	for receiver in receivers:
+		receiver.setup() and receiver.play()
+	time.sleep(seconds)
+	for receiver in receivers:
+		receiver.stopListening(wait=False)
+	for receiver in receivers:
+		receiver.teardown()
+	sessions = [receiver.getLoadStats() for receiver in receivers]
+	total = {key: sum(session[key] for session in sessions)
+	         for key in ('frames_received', 'frames_expected', 'packets_dropped', 'packets_received', 'nacks_sent',
+	                     'retransmits_received', 'recovered', 'fec_received', 'fec_recovered')}
+	delivered = total['frames_received'] / total['frames_expected'] * 100 if total['frames_expected'] else 0
+	latency = LatencyHistogram()
+	for session in sessions:
+		latency.merge(session['latency'])
+	return {
+		'frames_delivered_pct': delivered,
+		'frames_recovered': total['recovered'],
+		'packet_loss_pct': total['packets_dropped'] / (total['packets_dropped'] + total['packets_received']) * 100
+		if total['packets_received'] else 0,
+		'fragments_nacked': total['nacks_sent'],
+		'retransmits_received': total['retransmits_received'],
+		'fragments_fec_recovered': total['fec_recovered'],
+		'overhead_pct': (total['retransmits_received'] + total['fec_received']) / total['packets_received'] * 100
+		if total['packets_received'] else 0,
+		'latency_p50_ms': latency.percentile(50),
+		'latency_p99_ms': latency.percentile(99),
+	}
+
+
+def benchRecovery(args):
+	"""Frame delivery under simulated random packet loss, per recovery mode (none, nack, fec, fec+nack)."""
+	width, height, frameSize = RESOLUTIONS[args.resolution]
+	frames = int((args.duration + 5) * DEFAULT_FRAME_RATE) * len(args.loss.split(','))
+	modes = {
+		'none': (['--no-retransmit'], False),
+		'nack': ([], True),
+		'fec': (['--no-retransmit', '--fec', str(args.fec_group)], False),
+		'fec+nack': (['--fec', str(args.fec_group)], True),
+	}
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		video = writeSyntheticVideo(os.path.join(tmp, 'recovery.Mjpeg'), frames, frameSize, width=width, height=height)
+		for mode in args.modes.split(','):
+			serverArgs, nack = modes[mode]
+			port = _freePort()
+			proc = startServer(port, serverArgs)
+			try:
+				for loss in args.loss.split(','):
+					results.setdefault(f"loss {float(loss) * 100:g}%", {})[mode] = runRecovery(
+						port, video, args.count, args.duration, float(loss), nack)
+			finally:
+				stopServer(proc)
+	return results
+
+
+def benchTranscode(args):
+	"""Per-session bitrate and fps per rendition, with many viewers sharing one transcode per frame (needs Pillow)."""
+	if Image is None:
+		return {'skipped': 'Pillow is not installed'}
+	width, height, _ = RESOLUTIONS[args.resolution]
+	frames = int((args.duration + 5) * DEFAULT_FRAME_RATE)
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		video = writeDecodableVideo(os.path.join(tmp, 'transcode.Mjpeg'), frames, width, height)
+		for rendition in args.renditions.split(','):
+			port, metricsPort = _freePort(), _freePort()
+			proc = startServer(port, ['--metrics-port', str(metricsPort), '--transcode-workers', str(args.workers)])
+			receivers = [LoadReceiver('127.0.0.1', port, _freePort(socket.SOCK_DGRAM), video)
+			             for _ in range(args.viewers)]
+			try:
+				for receiver in receivers:
+					receiver.rendition = rendition
+					receiver.setup() and receiver.play()
+				time.sleep(args.duration)
+				snapshot = _fetchJson(f'http://127.0.0.1:{metricsPort}/metrics.json')
+				cpu = processUsage(proc.pid)[0]
+				for receiver in receivers:
+					receiver.stopListening(wait=False)
+				for receiver in receivers:
+					receiver.teardown()
+			finally:
+				stopServer(proc)
+			sessions = snapshot['sessions']
+			served = sum(session['rendition_frames'] for session in sessions)
+			missed = sum(session['rendition_misses'] for session in sessions)
+			transcoder = snapshot['transcoder'] or {}
+			stats = [receiver.getStats() for receiver in receivers]
+			results[rendition] = {
+				'fps_per_session': sum(s['fps'] for s in stats) / len(stats),
+				'kbps_per_session': sum(s['bandwidth_received_kbps'] for s in stats) / len(stats),
+				'rendition_ready_pct': served / (served + missed) * 100 if served + missed else None,
+				'transcodes': transcoder.get('transcoded', 0),
+				'frames_per_transcode': served / transcoder['transcoded'] if transcoder.get('transcoded') else None,
+				'server_cpu_s': cpu,
+			}
+	return results
+
+
+BOTTLENECK_QUEUE = 64 * 1024  # Bytes a simulated bottleneck queues before dropping
+
+
+class ThrottledReceiver(LoadReceiver):
+	"""LoadReceiver behind a simulated bottleneck: packets beyond a byte rate (plus a small queue) are dropped."""
+
+	def __init__(self, *args, rate=0, queue=BOTTLENECK_QUEUE, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.rate = rate  # Bytes per second
+		self.queue = queue
+		self.tokens = queue
+		self.lastArrival = None
+		self.dropped = 0
+
+	def handlePacket(self, data):
+		now = time.monotonic()
+		if self.lastArrival is not None:
+			self.tokens = min(self.queue, self.tokens + (now - self.lastArrival) * self.rate)
+		self.lastArrival = now
+		if self.tokens < len(data):
+			self.dropped += 1
+			return
+		self.tokens -= len(data)
+		super().handlePacket(data)
+
+
+def _fetchJson(url):
+	with urllib.request.urlopen(url, timeout=5) as reply:
+		return json.loads(reply.read())
+
+
+def runAdapt(port, metricsPort, video, seconds, rate):
+	"""Play one ThrottledReceiver for seconds. Return its delivery and the server's sent/skipped counts."""
+	receiver = ThrottledReceiver('127.0.0.1', port, _freePort(socket.SOCK_DGRAM), video, rate=rate)
+	receiver.setup() and receiver.play()
+	time.sleep(seconds)
+	# Read the session before TEARDOWN unregisters it
+	session = _fetchJson(f'http://127.0.0.1:{metricsPort}/metrics.json')['sessions'][0]
+	receiver.stopListening(wait=False)
+	receiver.teardown()
+	stats = receiver.getStats()
+	started = stats['frames_received'] + stats['frames_lost']
+	return {
+		'fps_delivered': stats['fps'],
+		'frames_sent': session['frames_sent'],
+		'frames_skipped': session['frames_skipped'],
+		'keep_ratio': session['keep_ratio'],
+		'frames_completed_pct': stats['frames_received'] / started * 100 if started else 0,
+		'packets_dropped': receiver.dropped,
+		'latency_p50_ms': receiver.latency.percentile(50),
+		'latency_p99_ms': receiver.latency.percentile(99),
+	}
+
+
+def benchAdapt(args):
+	"""Delivered frame rate behind a bandwidth bottleneck, fixed rate vs frame thinning on receiver reports."""
+	width, height, frameSize = RESOLUTIONS[args.resolution]
+	frames = int((args.duration + 5) * DEFAULT_FRAME_RATE) * len(args.capacity.split(','))
+	modes = {'fixed': ['--no-adapt'], 'adaptive': []}
+	streamRate = frameSize * DEFAULT_FRAME_RATE
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		video = writeSyntheticVideo(os.path.join(tmp, 'adapt.Mjpeg'), frames, frameSize, width=width, height=height)
+		for mode, serverArgs in modes.items():
+			port, metricsPort = _freePort(), _freePort()
+			proc = startServer(port, serverArgs + ['--metrics-port', str(metricsPort)])
+			try:
+				for capacity in args.capacity.split(','):
+					results.setdefault(f"capacity {float(capacity) * 100:g}%", {})[mode] = runAdapt(
+						port, metricsPort, video, args.duration, float(capacity) * streamRate)
+			finally:
+				stopServer(proc)
+	return results
+
+
+class LegacyRtpPacket:
+	"""RtpPacket as it was before the struct-based codec, for comparison."""
+	header = bytearray(12)
+
+	def __init__(self):
+		self.fragmentHeader = None
+
+	def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload,
+	           fragment_id=0, total_fragments=1, fragment_index=0):
+		timestamp = int(time.time())
+		self.header = bytearray(12)
+		self.header[0] = (version << 6) | (padding << 5) | (extension << 4) | cc
+		self.header[1] = (marker << 7) | pt
+		self.header[2] = (seqnum >> 8) & 0xFF
+		self.header[3] = seqnum & 0xFF
+		self.header[4] = (timestamp >> 24) & 0xFF
+		self.header[5] = (timestamp >> 16) & 0xFF
+		self.header[6] = (timestamp >> 8) & 0xFF
+		self.header[7] = timestamp & 0xFF
+		self.header[8] = (ssrc >> 24) & 0xFF
+		self.header[9] = (ssrc >> 16) & 0xFF
+		self.header[10] = (ssrc >> 8) & 0xFF
+		self.header[11] = ssrc & 0xFF
+		if total_fragments > 1:
+			self.fragmentHeader = bytearray(4)
+			self.fragmentHeader[0] = (fragment_id >> 8) & 0xFF
+			self.fragmentHeader[1] = fragment_id & 0xFF
+			self.fragmentHeader[2] = total_fragments & 0xFF
+			self.fragmentHeader[3] = fragment_index & 0xFF
+		else:
+			self.fragmentHeader = None
+		self.payload = payload
+
+	def decode(self, byteStream):
+		self.header = bytearray(byteStream[:12])
+		remainingData = byteStream[12:]
+		if len(remainingData) >= 4:
+			potential_frag_id = (remainingData[0] << 8) | remainingData[1]
+			potential_total = remainingData[2]
+			potential_index = remainingData[3]
+			if potential_total > 1 and potential_index < potential_total and potential_frag_id < 100000:
+				self.fragmentHeader = bytearray(remainingData[:4])
+				self.payload = remainingData[4:]
+			else:
+				self.fragmentHeader = None
+				self.payload = remainingData
+		else:
+			self.fragmentHeader = None
+			self.payload = remainingData
+
+	def seqNum(self):
+		return int(self.header[2] << 8 | self.header[3])
+
+	def timestamp(self):
+		return int(self.header[4] << 24 | self.header[5] << 16 | self.header[6] << 8 | self.header[7])
+
+	def getPayload(self):
+		return self.payload
+
+	def getPacket(self):
+		if self.fragmentHeader:
+			return self.header + self.fragmentHeader + self.payload
+		return self.header + self.payload
+
+	def getFragmentId(self):
+		if self.fragmentHeader:
+			return (self.fragmentHeader[0] << 8) | self.fragmentHeader[1]
+		return 0
+
+	def getTotalFragments(self):
+		if self.fragmentHeader:
+			return self.fragmentHeader[2]
+		return 1
+
+	def getFragmentIndex(self):
+		if self.fragmentHeader:
+			return self.fragmentHeader[3]
+		return 0
+
+
+def legacySendFrame(sock, address, data, frameNumber, fragmentId, payloadSize, stats):
+	"""Fragment and send a frame the way ServerWorker originally did (without its 1ms sleeps)."""
+	totalFragments = (len(data) + payloadSize - 1) // payloadSize
+	for i in range(totalFragments):
+		start = i * payloadSize
+		end = min(start + payloadSize, len(data))
+		fragmentData = data[start:end]
+		marker = 1 if (i == totalFragments - 1) else 0
+		rtpPacket = LegacyRtpPacket()
+		rtpPacket.encode(2, 0, 0, 0, frameNumber, marker, 26, 0, fragmentData, fragmentId, totalFragments, i)
+		packet = rtpPacket.getPacket()
+		sock.sendto(packet, address)
+		stats.recordPacketSent(len(packet))
+		stats.recordFragmentSent()
+	return totalFragments
+
+
+def _loopbackWorker(sink, useSendmsg):
+	"""Build a ServerWorker sending RTP to sink without an RTSP connection."""
+	from ServerWorker import ServerWorker
+	worker = ServerWorker({'rtspSocket': (None, ('127.0.0.1', 0)), 'rtpPort': sink.getsockname()[1]})
+	worker.openRtpSocket()
+	worker.USE_SENDMSG = useSendmsg
+	return worker
+
+
+def benchSendPath(args):
+	"""Packet send path on loopback: concatenating RtpPacket vs scatter-gather sendmsg."""
+	from ServerWorker import ServerWorker
+	payloadSize = ServerWorker.MAX_PAYLOAD_SIZE
+	rng = random.Random(1)
+	frame = rng.randbytes(args.frame_size)
+
+	# Nobody reads the sink: the kernel drops what overflows, sends still complete
+	sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	sink.bind(('127.0.0.1', 0))
+	results = {}
+
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	stats = NetworkStats()
+	start = time.perf_counter()
+	packets = 0
+	for n in range(args.frames):
+		packets += legacySendFrame(sock, sink.getsockname(), frame, n, n, payloadSize, stats)
+	elapsed = time.perf_counter() - start
+	sock.close()
+	results['legacy'] = {'packets_per_sec': packets / elapsed, 'MBps': args.frames * len(frame) / elapsed / 1e6}
+
+	modes = [('send', False)]
+	if hasattr(socket.socket, 'sendmsg'):
+		modes.append(('sendmsg', True))
+	for name, useSendmsg in modes:
+		worker = _loopbackWorker(sink, useSendmsg)
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			start = time.perf_counter()
+			packets = 0
+			for n in range(args.frames):
+				for packet in worker.fragmentFrame(frame, n, int(time.time())):
+					worker.sendPacket(packet)
+					packets += 1
+			elapsed = time.perf_counter() - start
+		worker.clientInfo['rtpSocket'].close()
+		results[name] = {'packets_per_sec': packets / elapsed, 'MBps': args.frames * len(frame) / elapsed / 1e6}
+
+	sink.close()
+	for name, _ in modes:
+		results[name]['speedup'] = results[name]['packets_per_sec'] / results['legacy']['packets_per_sec']
+	return results
+
+
+def _packetsPerSecond(fn, count):
+	"""Call fn() count times. Return calls per second (best of 3)."""
+	best = 0.0
+	for _ in range(3):
+		start = time.perf_counter()
+		for _ in range(count):
+			fn()
+		best = max(best, count / (time.perf_counter() - start))
+	return best
+
+
+def benchRtpCodec(args):
+	"""RTP packet encode/decode in packets per second: legacy class vs struct codec."""
+	payload = random.Random(1).randbytes(args.payload_size)
+	count = args.packets
+	results = {}
+
+	def legacyEncode():
+		packet = LegacyRtpPacket()
+		packet.encode(2, 0, 0, 0, 1234, 0, 26, 0, payload, 77, 100, 42)
+		return packet.getPacket()
+
+	def structEncode():
+		packet = RtpPacket()
+		packet.encode(2, 0, 0, 0, 1234, 0, 26, 0, payload, 77, 100, 42, timestamp=5678)
+		return packet.getPacket()
+
+	template = RtpHeaderTemplate()
+	pending = PendingPacket(memoryview(payload), 1234, 5678, 77, 100, 42, len(payload))
+
+	def templateEncode():
+		return template.writePacket(pending)
+
+	legacyWire = bytes(legacyEncode())
+	wire = bytes(structEncode())
+
+	def legacyDecode():
+		packet = LegacyRtpPacket()
+		packet.decode(legacyWire)
+		return packet.seqNum(), packet.timestamp(), packet.getFragmentIndex(), packet.getPayload()
+
+	def structDecode():
+		packet = RtpPacket()
+		packet.decode(wire)
+		return packet.seqNum(), packet.timestamp(), packet.getFragmentIndex(), packet.getPayload()
+
+	results['encode'] = {
+		'legacy': _packetsPerSecond(legacyEncode, count),
+		'struct': _packetsPerSecond(structEncode, count),
+		'template': _packetsPerSecond(templateEncode, count),
+	}
+	results['decode'] = {
+		'legacy': _packetsPerSecond(legacyDecode, count),
+		'struct': _packetsPerSecond(structDecode, count),
+	}
+	results['encode']['template_speedup'] = results['encode']['template'] / results['encode']['legacy']
+	results['decode']['speedup'] = results['decode']['struct'] / results['decode']['legacy']
+	return results
+
+
+class LegacyReassembler:
+	"""Dict-of-dicts fragment reassembly as Client originally did it (without display)."""
+
+	def __init__(self, stats):
+		self.stats = stats
+		self.fragmentBuffer = {}
+		self.fragmentMetadata = {}
+
+	def pushPacket(self, rtpPacket):
+		fragmentId = rtpPacket.getFragmentId()
+		totalFragments = rtpPacket.getTotalFragments()
+		if fragmentId not in self.fragmentBuffer:
+			self.fragmentBuffer[fragmentId] = {}
+			self.fragmentMetadata[fragmentId] = (totalFragments, rtpPacket.seqNum())
+		self.fragmentBuffer[fragmentId][rtpPacket.getFragmentIndex()] = rtpPacket.getPayload()
+		if len(self.fragmentBuffer[fragmentId]) != totalFragments:
+			return None
+
+		completeFrame = bytearray()
+		for i in range(totalFragments):
+			completeFrame.extend(self.fragmentBuffer[fragmentId][i])
+		del self.fragmentBuffer[fragmentId]
+		del self.fragmentMetadata[fragmentId]
+		for fid in [fid for fid in self.fragmentBuffer.keys() if fragmentId - fid > 10]:
+			self.stats.recordFrameLost()
+			del self.fragmentBuffer[fid]
+			del self.fragmentMetadata[fid]
+		return rtpPacket.seqNum(), bytes(completeFrame)
+
+	def bufferedBytes(self):
+		return sum(len(p) for fragments in self.fragmentBuffer.values() for p in fragments.values())
+
+
+def lossyFragmentStream(frames, frameSize, loss, window, seed=1):
+	"""Decoded fragment packets of synthetic frames, with random loss and reordering.
+
+	Each packet is dropped with probability loss, and packets are shuffled
+	within consecutive windows of the given size. Returns (packets, frames sent
+	intact).
+	"""
+	from ServerWorker import ServerWorker
+	rng = random.Random(seed)
+	payloadSize = ServerWorker.MAX_PAYLOAD_SIZE
+	template = RtpHeaderTemplate()
+	wire = []
+	intact = 0
+	for n in range(1, frames + 1):
+		data = rng.randbytes(rng.randrange(frameSize // 2, frameSize * 3 // 2))
+		fragments = _fragmentAll(data, payloadSize)
+		kept = [i for i in range(len(fragments)) if rng.random() >= loss]
+		intact += len(kept) == len(fragments)
+		for i in kept:
+			pending = PendingPacket(fragments[i], n, n, n & 0xFFFF, len(fragments), i, payloadSize)
+			wire.append(bytes(template.writePacket(pending)) + fragments[i])
+
+	for start in range(0, len(wire), window):
+		chunk = wire[start:start + window]
+		rng.shuffle(chunk)
+		wire[start:start + window] = chunk
+
+	packets = []
+	for data in wire:
+		packet = RtpPacket()
+		packet.decode(data)
+		packets.append(packet)
+	return packets, intact
+
+
+def benchReassembly(args):
+	"""Fragment reassembly of a shuffled, lossy stream: dict-of-dicts vs the bounded slot-list engine."""
+	packets, intact = lossyFragmentStream(args.frames, args.frame_size, args.loss, args.window)
+	results = {'stream': {'packets': len(packets), 'frames': args.frames, 'frames_intact': intact}}
+
+	engines = {
+		'legacy': lambda stats: LegacyReassembler(stats),
+		'bounded': lambda stats: Reassembler(stats=stats),
+	}
+	for name, factory in engines.items():
+		# Timed passes (best of 3)
+		elapsed = float('inf')
+		for _ in range(3):
+			engine = factory(NetworkStats())
+			completed = []
+			start = time.perf_counter()
+			for packet in packets:
+				result = engine.pushPacket(packet)
+				if result is not None:
+					completed.append(result[0])
+			elapsed = min(elapsed, time.perf_counter() - start)
+
+		# Frames the client would display: newer than every frame before them
+		displayed = 0
+		newest = 0
+		for frameNumber in completed:
+			if frameNumber > newest:
+				newest = frameNumber
+				displayed += 1
+
+		# Untimed pass sampling the memory held by partial frames
+		engine = factory(NetworkStats())
+		peak = 0
+		for i, packet in enumerate(packets):
+			engine.pushPacket(packet)
+			if i % 64 == 0:
+				peak = max(peak, engine.bufferedBytes())
+
+		results[name] = {
+			'packets_per_sec': len(packets) / elapsed,
+			'frames_completed': len(completed),
+			'frames_displayable': displayed,
+			'peak_buffered_kb': peak / 1024,
+			'leftover_kb': engine.bufferedBytes() / 1024,
+		}
+	results['bounded']['speedup'] = results['bounded']['packets_per_sec'] / results['legacy']['packets_per_sec']
+	return results
+
+
+class LockedNetworkStats:
+	"""The previous receive-side recording: a lock and clock reads per call, one call per counter."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.packets = self.bytes = self.fragments = 0
+		self.latency = LatencyHistogram()
+		self.jitter = 0.0
+		self.lastTransit = None
+		self.window = SlidingWindow(WINDOW_FIELDS)
+
+	def recordPacketReceived(self, packetSize, timestamp=None):
+		with self.lock:
+			now = time.time()
+			self.packets += 1
+			self.bytes += packetSize
+			self.window.add(now, PACKETS_RECEIVED)
+			self.window.add(now, BYTES_RECEIVED, packetSize)
+			if timestamp:
+				transit = time.time() - timestamp
+				self.latency.record(transit * 1000)
+				if self.lastTransit is not None:
+					self.jitter += (abs(transit - self.lastTransit) - self.jitter) / 16
+				self.lastTransit = transit
+
+	def recordFragmentReceived(self):
+		with self.lock:
+			self.fragments += 1
+
+	def getStats(self):
+		with self.lock:
+			return {'packets': self.packets, 'p50': self.latency.percentile(50)}
+
+
+def _recordLoop(record, packets, timestamp):
+	for _ in range(packets):
+		record(1400, timestamp)
+
+
+def benchStatsRecord(args):
+	"""Per-packet stats recording: locked call per counter vs one lock-free sharded record() call."""
+	timestamp = time.time()
+	engines = {
+		'locked': lambda stats: lambda size, ts: (stats.recordPacketReceived(size, ts), stats.recordFragmentReceived()),
+		'sharded': lambda stats: lambda size, ts: stats.recordReceived(size, True, ts),
+	}
+	factories = {'locked': LockedNetworkStats, 'sharded': NetworkStats}
+	results = {}
+	for name, engine in engines.items():
+		row = {}
+		# Single thread, best of 3
+		elapsed = float('inf')
+		for _ in range(3):
+			record = engine(factories[name]())
+			start = time.perf_counter()
+			_recordLoop(record, args.packets, timestamp)
+			elapsed = min(elapsed, time.perf_counter() - start)
+		row['ns_per_packet'] = elapsed / args.packets * 1e9
+
+		# Several recording threads plus a reader polling getStats(), as a GUI or metrics endpoint would
+		stats = factories[name]()
+		record = engine(stats)
+		done = threading.Event()
+		reads = 0
+
+		def reader():
+			nonlocal reads
+			while not done.is_set():
+				stats.getStats()
+				reads += 1
+				time.sleep(args.read_interval)
+
+		readerThread = threading.Thread(target=reader, daemon=True)
+		writers = [threading.Thread(target=_recordLoop, args=(record, args.packets, timestamp))
+		           for _ in range(args.threads)]
+		readerThread.start()
+		start = time.perf_counter()
+		for writer in writers:
+			writer.start()
+		for writer in writers:
+			writer.join()
+		elapsed = time.perf_counter() - start
+		done.set()
+		readerThread.join()
+		row[f'ns_per_packet_{args.threads}_threads'] = elapsed / (args.packets * args.threads) * 1e9
+		row['stats_reads'] = reads
+		row['packets_counted'] = stats.getStats()['packets' if name == 'locked' else 'packets_received']
+		results[name] = row
+	results['sharded']['speedup'] = results['locked']['ns_per_packet'] / results['sharded']['ns_per_packet']
+	return results
+
+
+BENCHMARKS = {
+	'mjpeg': (benchMjpegScan, [
+		(('--frames',), {'type': int, 'default': 50}),
+		(('--frame-size',), {'type': int, 'default': 200000}),
+		(('--skip-legacy',), {'action': 'store_true'}),
+	]),
+	'mmap': (benchMmapSource, [
+		(('--sessions',), {'type': int, 'default': 50}),
+		(('--frames',), {'type': int, 'default': 100}),
+		(('--frame-size',), {'type': int, 'default': 200000}),
+	]),
+	'codec': (benchRtpCodec, [
+		(('--packets',), {'type': int, 'default': 200000}),
+		(('--payload-size',), {'type': int, 'default': 1384}),
+	]),
+	'send': (benchSendPath, [
+		(('--frames',), {'type': int, 'default': 500}),
+		(('--frame-size',), {'type': int, 'default': 150000}),
+	]),
+	'reassembly': (benchReassembly, [
+		(('--frames',), {'type': int, 'default': 2000}),
+		(('--frame-size',), {'type': int, 'default': 50000}),
+		(('--loss',), {'type': float, 'default': 0.01}),
+		(('--window',), {'type': int, 'default': 64}),
+	]),
+	'load': (benchLoad, [
+		(('--counts',), {'default': '1,10,50'}),
+		(('--resolutions',), {'default': 'sd,720p,1080p'}),
+		(('--formats',), {'default': 'mjpeg,custom'}),
+		(('--duration',), {'type': float, 'default': 5.0}),
+		(('--warmup',), {'type': float, 'default': 1.0}),
+		(('--client-procs',), {'type': int, 'default': os.cpu_count() or 1}),
+		(('--server-args',), {'default': '', 'help': 'extra Server.py options, e.g. --server-args="--event-loop --mmap"'}),
+	]),
+	'recovery': (benchRecovery, [
+		(('--loss',), {'default': '0.01,0.03', 'help': 'comma-separated packet loss rates'}),
+		(('--modes',), {'default': 'none,nack,fec,fec+nack'}),
+		(('--fec-group',), {'type': int, 'default': 10, 'help': 'data fragments per parity packet in the fec modes'}),
+		(('--resolution',), {'default': '720p', 'choices': sorted(RESOLUTIONS)}),
+		(('--count',), {'type': int, 'default': 2}),
+		(('--duration',), {'type': float, 'default': 5.0}),
+	]),
+	'adapt': (benchAdapt, [
+		(('--capacity',), {'default': '0.5,0.8', 'help': 'comma-separated bottleneck rates as a share of the stream bitrate'}),
+		(('--resolution',), {'default': '720p', 'choices': sorted(RESOLUTIONS)}),
+		(('--duration',), {'type': float, 'default': 10.0}),
+	]),
+	'transcode': (benchTranscode, [
+		(('--renditions',), {'default': 'full,high,medium,low'}),
+		(('--resolution',), {'default': '1080p', 'choices': sorted(RESOLUTIONS)}),
+		(('--viewers',), {'type': int, 'default': 4}),
+		(('--workers',), {'type': int, 'default': 2, 'help': 'transcode processes of the server'}),
+		(('--duration',), {'type': float, 'default': 6.0}),
+	]),
+	'seek': (benchSeek, [
+		(('--frames',), {'type': int, 'default': 15000, 'help': 'length of the synthetic video (5 min at 50 fps)'}),
+		(('--frame-size',), {'type': int, 'default': 4000}),
+		(('--duration',), {'type': float, 'default': 3.0, 'help': 'seconds played at each scale'}),
+	]),
+	'broadcast': (benchBroadcast, [
+		(('--counts',), {'default': '1,10,30'}),
+		(('--resolution',), {'default': '720p', 'choices': sorted(RESOLUTIONS)}),
+		(('--frames',), {'type': int, 'default': 250}),
+		(('--duration',), {'type': float, 'default': 4.0}),
+		(('--server-args',), {'default': '', 'help': 'extra Server.py options, e.g. --server-args="--event-loop"'}),
+	]),
+	'stats': (benchStatsRecord, [
+		(('--packets',), {'type': int, 'default': 200000}),
+		(('--threads',), {'type': int, 'default': 4}),
+		(('--read-interval',), {'type': float, 'default': 0.01}),
+	]),
+	'sessions': (benchSessionScaling, [
+		(('--counts',), {'default': '10,100,300'}),
+		(('--duration',), {'type': float, 'default': 3.0}),
+		(('--frames',), {'type': int, 'default': 1000}),
+		(('--frame-size',), {'type': int, 'default': 1000}),
+	]),
+}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--json', action='store_true', help='print machine-readable results')
+	sub = parser.add_subparsers(dest='benchmark', required=True)
+	for name, (fn, options) in BENCHMARKS.items():
+		p = sub.add_parser(name, help=fn.__doc__)
+		for flags, kwargs in options:
+			p.add_argument(*flags, **kwargs)
+
+	args = parser.parse_args(argv)
+	fn = BENCHMARKS[args.benchmark][0]
+	results = fn(args)
+
+	if args.json:
+		print(json.dumps({'benchmark': args.benchmark, 'results': results}, indent=2))
+	else:
+		print(f"[Benchmark] {args.benchmark}: {fn.__doc__}")
+		printResults(results)
+
+
+def _format(value):
+	if isinstance(value, float):
+		return f"{value:.2f}"
+	return str(value)
+
+
+def printResults(results, indent=1):
+	"""Print nested benchmark results, one line per innermost dictionary."""
+	for key, value in results.items():
+		if isinstance(value, dict) and any(isinstance(v, dict) for v in value.values()):
+			print("  " * indent + f"{key}:")
+			printResults(value, indent + 1)
+		elif isinstance(value, dict):
+			print("  " * indent + f"{key}: " + ', '.join(f"{k}={_format(v)}" for k, v in value.items()))
+		else:
+			print("  " * indent + f"{key}: {_format(value)}")
+
+
+if __name__ == "__main__":
+	main()
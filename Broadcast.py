@@ -0,0 +1,178 @@
+import threading
+from time import monotonic
+
+from VideoStream import VideoStream
+from RtpPacket import (MAX_FRAGMENTS, PendingPacket, SharedPacket, RtpHeaderTemplate, mediaTimestamp,
+                       fragmentPackets, DEFAULT_FRAME_RATE)
+from Retransmit import RetransmitBuffer
+from Fec import protectFragments
+from FrameCache import sharedCache
+from Pacer import PacedStream, sharedPacer, sharedReader
+from MetricsServer import sharedRegistry
+
+LIVE_PREFIX = 'live/'  # RTSP file names under this prefix are broadcast channels of the file after it
+
+
+def isLive(filename):
+	"""Check if an RTSP file name asks for a broadcast channel."""
+	return filename.startswith(LIVE_PREFIX)
+
+
+class Channel:
+	"""One file played in lockstep to every subscribed session.
+
+	A single producer reads each frame once, packetizes it (fragments,
+	FEC parity, retransmit buffer) and writes every RTP header once into
+	SharedPackets. The channel is the PacedStream's session: each paced
+	packet is fanned out to the subscribers, whose only per-packet work is
+	patching their sequence number and SSRC into a copy of the header and
+	sending it. Fragment ids are the channel's, so NACKs from any
+	subscriber are served from the one retransmit buffer.
+
+	The channel's frame counter gives the RTP sequence numbers (and media
+	timestamps); a subscriber's sequence numbers count from its first
+	frame and carry on across PAUSE. The file loops, and the producer
+	only runs while some session is PLAYING. Subscribers are an immutable
+	tuple, replaced under the lock, so the fan-out never locks.
+	"""
+
+	def __init__(self, filename, fragmentSize, frameRate=DEFAULT_FRAME_RATE, bitrate=0, fecGroup=0,
+	             retransmitDeadline=None, useMmap=False):
+		self.filename = filename
+		self.videoStream = VideoStream(filename, useMmap=useMmap, cache=sharedCache)
+		self.frameRate = frameRate
+		self.bitrate = bitrate
+		self.fragmentSize = fragmentSize
+		self.fecGroup = fecGroup
+		self.retransmitBuffer = RetransmitBuffer(deadline=retransmitDeadline) if retransmitDeadline else None
+		self.headerTemplate = RtpHeaderTemplate()
+		self.lock = threading.Lock()
+		self.subscribers = ()
+		self.sessions = 0  # Sessions set up on the channel (playing or not)
+		self.pacedStream = None
+		self.frameIndex = 0  # Frames produced, the channel's sequence number
+		self.fragmentId = 0
+		self.loops = 0
+
+	def subscribe(self, worker, schedule):
+		"""Start sending the channel to a session from the next frame; start the producer if idle."""
+		with self.lock:
+			# Next frame gets the sequence number after the last one the session saw
+			worker.seqBase = self.frameIndex - worker.lastSeq
+			self.subscribers += (worker,)
+			start = self.pacedStream is None
+			if start:
+				self.pacedStream = PacedStream(self, self.frameRate, self.bitrate, reader=sharedReader)
+		if start:
+			schedule(self.pacedStream)
+		print(f"[Broadcast] {self.filename}: {len(self.subscribers)} viewers")
+
+	def unsubscribe(self, worker):
+		"""Stop sending to a session; stop the producer when nobody is left. Return False if not subscribed."""
+		with self.lock:
+			if worker not in self.subscribers:
+				return False
+			worker.lastSeq = self.frameIndex - worker.seqBase
+			self.subscribers = tuple(w for w in self.subscribers if w is not worker)
+			if not self.subscribers:
+				# Under the lock, so a producer started by the next subscriber never reads alongside this one
+				self.pacedStream.cancel()
+				self.pacedStream.finishReading()
+				self.pacedStream = None
+		print(f"[Broadcast] {self.filename}: {len(self.subscribers)} viewers")
+		return True
+
+	def nextFramePackets(self, late=0):
+		"""Read and packetize the next frame once for all subscribers. Return SharedPackets."""
+		frame = self.prepareFrame(late)
+		return self.framePackets(frame) if frame is not None else []
+
+	def prepareFrame(self, late=0):
+		"""Read the next frame (on a reader thread, ahead of its deadline), dropping `late` frames first.
+
+		Return (frames dropped, data), or None if the file is empty.
+		"""
+		if late:
+			# Frames the pacing clock missed in a stall are dropped to stay live
+			videoStream = self.videoStream
+			videoStream.seek(min(videoStream.frameNbr() + late, videoStream.getTotalFrames()) + 1)
+		data = self.videoStream.nextFrame()
+		if not data:
+			# A live channel never ends: loop the file
+			self.videoStream.reset()
+			self.loops += 1
+			data = self.videoStream.nextFrame()
+		return (late, data) if data else None
+
+	def framePackets(self, frame):
+		"""Packetize a frame once for all subscribers (pacing thread). Return SharedPackets."""
+		late, data = frame
+		with self.lock:
+			# Dropped frames keep their place in the sequence and media clock
+			self.frameIndex += late + 1
+			frameIndex = self.frameIndex
+		timestamp = mediaTimestamp(frameIndex, self.frameRate)
+
+		if len(data) > self.fragmentSize:
+			if (len(data) + self.fragmentSize - 1) // self.fragmentSize > MAX_FRAGMENTS:
+				print(f"[Broadcast] Frame {self.videoStream.frameNbr()} too large: {len(data)} bytes")
+				return []
+			self.fragmentId = (self.fragmentId + 1) & 0xFFFF
+			packets = fragmentPackets(data, frameIndex, timestamp, self.fragmentId, self.fragmentSize)
+			if self.retransmitBuffer is not None:
+				self.retransmitBuffer.addFrame(self.fragmentId, packets, monotonic())
+			if self.fecGroup:
+				packets = protectFragments(packets, self.fecGroup)
+		else:
+			packets = [PendingPacket(data, frameIndex, timestamp)]
+		return [SharedPacket(bytes(self.headerTemplate.writePacket(packet)), packet) for packet in packets]
+
+	def sendPacket(self, packet):
+		"""Send one packet to every subscriber."""
+		for worker in self.subscribers:
+			worker.sendSharedPacket(packet)
+
+
+class ChannelRegistry:
+	"""Broadcast channels of this server process, opened by the first session set up on a file.
+
+	Channel producers are paced by the shared pacer thread unless a
+	scheduler is set (the event-loop server paces them with loop timers).
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.channels = {}  # file name -> Channel
+		self.scheduler = sharedPacer.add
+
+	def open(self, filename, **options):
+		"""Return the channel of a file, opening it for the first session. Raises IOError if it cannot be read."""
+		with self.lock:
+			channel = self.channels.get(filename)
+			if channel is None:
+				channel = self.channels[filename] = Channel(filename, **options)
+			channel.sessions += 1
+			return channel
+
+	def close(self, channel):
+		"""Release a session's share of a channel; the last one closes its file."""
+		with self.lock:
+			channel.sessions -= 1
+			if channel.sessions > 0:
+				return
+			self.channels.pop(channel.filename, None)
+		channel.videoStream.close()
+		print(f"[Broadcast] {channel.filename}: closed after {channel.frameIndex} frames ({channel.loops} loops)")
+
+	def subscribe(self, channel, worker):
+		channel.subscribe(worker, self.scheduler)
+
+	def viewers(self):
+		with self.lock:
+			return sum(len(channel.subscribers) for channel in self.channels.values())
+
+
+# Channels shared by every session of the server process
+sharedChannels = ChannelRegistry()
+sharedRegistry.addGauge('broadcast_channels', lambda: len(sharedChannels.channels), 'Broadcast channels open')
+sharedRegistry.addGauge('broadcast_viewers', sharedChannels.viewers, 'Sessions playing a broadcast channel')
@@ -1,25 +1,44 @@
 from tkinter import *
 import tkinter.messagebox
 from PIL import Image, ImageTk
-import socket, threading, sys, traceback, os
+import threading, os, io
 import time
 
-from RtpPacket import RtpPacket
-from NetworkStats import NetworkStats
+from RtpReceiver import RtpReceiver
+from FramePipeline import FramePipeline
+from Playout import PlayoutClock, DEFAULT_PLAYOUT_DELAY, DEFAULT_PLAYOUT_FRAMES
+from Transcoder import FULL, RENDITIONS
+from RtpPacket import DEFAULT_FRAME_RATE
 
 CACHE_FILE_NAME = "cache-"
 CACHE_FILE_EXT = ".jpg"
 
+DISPLAY_POLL_MS = 10  # How often the Tk thread picks up the latest decoded frame
+SPEEDS = ('1x', '2x', '4x', '8x')  # Fast-forward choices (RTSP Scale)
+
 class Client:
-	INIT = 0
-	READY = 1
-	PLAYING = 2
-	state = INIT
+	"""Tk front end: RTSP/RTP receive is done by an RtpReceiver, display by a FramePipeline."""
+	
+	# Debug/snapshot: also write every received frame to cache-<session>.jpg
+	SAVE_FRAMES = False
+	
+	# Display scaling: resampling filter (speed vs quality) and JPEG draft
+	# decoding at a reduced DCT scale when the window is smaller than the video
+	RESAMPLE_FILTERS = {
+		'nearest': Image.NEAREST,
+		'bilinear': Image.BILINEAR,
+		'bicubic': Image.BICUBIC,
+		'lanczos': Image.LANCZOS,
+	}
+	RESAMPLE = 'lanczos'
+	DRAFT_DECODE = True
+	
+	# Playout: frames are presented on their media clock this long (seconds)
+	# after the earliest arrival seen, absorbing network jitter (0 = on arrival)
+	PLAYOUT_DELAY = DEFAULT_PLAYOUT_DELAY
 	
-	SETUP = 0
-	PLAY = 1
-	PAUSE = 2
-	TEARDOWN = 3
+	# JPEG rendition asked for at SETUP (None = the server's default); switchable from the menu
+	RENDITION = None
 	
 	# Initiation..
 	def __init__(self, master, serveraddr, serverport, rtpport, filename):
@@ -32,24 +51,31 @@ class Client:
 		self.master.resizable(True, True)
 		
 		self.createWidgets()
-		self.serverAddr = serveraddr
-		self.serverPort = int(serverport)
-		self.rtpPort = int(rtpport)
-		self.fileName = filename
-		self.rtspSeq = 0
-		self.sessionId = 0
-		self.requestSent = -1
-		self.teardownAcked = 0
-		self.connectToServer()
-		self.frameNbr = 0
 		
-		# Fragment reassembly buffers
-		self.fragmentBuffer = {}  # {fragment_id: {fragment_index: data}}
-		self.fragmentMetadata = {}  # {fragment_id: (total_fragments, frame_number)}
+		# Decode and scale frames off the receive thread; Tk is only touched from pollDisplay
+		# (the playout buffer holds at least the target delay's worth of frames at 60 fps)
+		self.pipeline = FramePipeline(self.decodeFrame,
+		                              playoutFrames=max(DEFAULT_PLAYOUT_FRAMES, int(self.PLAYOUT_DELAY * 60) + 4))
+		self.playoutClock = PlayoutClock(self.PLAYOUT_DELAY)
+		
+		# Session control, packet receive, reassembly and statistics
+		self.receiver = RtpReceiver(serveraddr, serverport, rtpport, filename,
+		                            onFrame=self.onFrame, verbose=True)
+		self.stats = self.receiver.stats
+		self.receiver.rendition = self.RENDITION
+		if self.PLAYOUT_DELAY > 0:
+			# A retransmission arriving after the frame's playout time cannot help
+			self.receiver.nackDeadline = self.PLAYOUT_DELAY
+		self.connectToServer()
 		
-		# Network statistics
-		self.stats = NetworkStats()
+		self.cacheLock = threading.Lock()
+		self.displaySize = (0, 0)
+		self.scaleCache = (None, None, None)  # (source size, display size, target size)
+		self.photo = None
+		self.photoKey = None  # (mode, size) of self.photo
+		self.master.after(DISPLAY_POLL_MS, self.pollDisplay)
 		self.lastStatsUpdate = time.time()
+		self.seeking = False  # Seek bar held: do not move it under the mouse
 		
 	def createWidgets(self):
 		"""Build GUI."""
@@ -77,13 +103,31 @@ class Client:
 		self.teardown["command"] =  self.exitClient
 		self.teardown.grid(row=1, column=3, padx=2, pady=2)
 		
+		# Create rendition menu (switches quality mid-stream)
+		self.renditionVar = StringVar(self.master, value=self.RENDITION or FULL)
+		self.renditionMenu = OptionMenu(self.master, self.renditionVar, FULL, *RENDITIONS,
+		                                command=self.changeRendition)
+		self.renditionMenu.grid(row=1, column=4, padx=2, pady=2)
+		
 		# Create a label to display the movie with better sizing for HD
 		self.label = Label(self.master, bg="black")
-		self.label.grid(row=0, column=0, columnspan=4, sticky=W+E+N+S, padx=5, pady=5)
+		self.label.grid(row=0, column=0, columnspan=5, sticky=W+E+N+S, padx=5, pady=5)
+		self.label.bind("<Configure>", self.onLabelResize)
+		
+		# Create seek bar (enabled once SETUP gives the duration) and fast-forward menu
+		self.seekVar = DoubleVar(self.master, value=0.0)
+		self.seekBar = Scale(self.master, variable=self.seekVar, from_=0.0, to=0.0, resolution=0.1, orient=HORIZONTAL,
+		                     showvalue=True, state=DISABLED)
+		self.seekBar.grid(row=2, column=0, columnspan=4, sticky=W+E, padx=5)
+		self.seekBar.bind("<ButtonPress-1>", self.onSeekPress)
+		self.seekBar.bind("<ButtonRelease-1>", self.seekMovie)
+		self.speedVar = StringVar(self.master, value=SPEEDS[0])
+		self.speedMenu = OptionMenu(self.master, self.speedVar, *SPEEDS, command=self.changeSpeed)
+		self.speedMenu.grid(row=2, column=4, padx=2, pady=2)
 		
 		# Create a label to display network statistics
 		self.statsLabel = Label(self.master, text="Network Stats: Not started", bg="lightgray", anchor=W, font=('Arial', 10))
-		self.statsLabel.grid(row=2, column=0, columnspan=4, sticky=W+E, padx=5, pady=2)
+		self.statsLabel.grid(row=3, column=0, columnspan=5, sticky=W+E, padx=5, pady=2)
 		
 		# Configure grid weights for resizing
 		self.master.grid_rowconfigure(0, weight=1)
@@ -94,310 +138,178 @@ class Client:
 	
 	def setupMovie(self):
 		"""Setup button handler."""
-		if self.state == self.INIT:
-			self.sendRtspRequest(self.SETUP)
+		if self.receiver.state == RtpReceiver.INIT:
+			try:
+				self.receiver.setup()
+			except OSError:
+				tkinter.messagebox.showwarning('Unable to Bind', 'Unable to bind PORT=%d' %self.receiver.rtpPort)
+			if self.receiver.duration:
+				self.seekBar.configure(to=self.receiver.duration, state=NORMAL)
 	
 	def exitClient(self):
 		"""Teardown button handler."""
-		self.sendRtspRequest(self.TEARDOWN)		
+		self.receiver.teardown()
+		self.pipeline.stop()
 		self.master.destroy() # Close the gui window
-		os.remove(CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT) # Delete the cache image from video
+		cachename = CACHE_FILE_NAME + str(self.receiver.sessionId) + CACHE_FILE_EXT
+		if self.SAVE_FRAMES and os.path.exists(cachename):
+			os.remove(cachename) # Delete the cache image from video
 
 	def pauseMovie(self):
 		"""Pause button handler."""
-		if self.state == self.PLAYING:
-			self.sendRtspRequest(self.PAUSE)
+		if self.receiver.state == RtpReceiver.PLAYING:
+			self.receiver.pause()
 	
 	def playMovie(self):
 		"""Play button handler."""
-		if self.state == self.READY:
-			# Create a new thread to listen for RTP packets
-			threading.Thread(target=self.listenRtp).start()
-			self.playEvent = threading.Event()
-			self.playEvent.clear()
-			self.sendRtspRequest(self.PLAY)
+		if self.receiver.state == RtpReceiver.READY:
+			self.pipeline.start()
+			# Arrivals after a pause are later against the media clock: anchor again
+			self.playoutClock.reset()
+			self.receiver.play()
 	
-	def listenRtp(self):		
-		"""Listen for RTP packets with fragment reassembly support."""
-		while True:
-			try:
-				data = self.rtpSocket.recv(65536)  # Increased buffer for HD
-				if data:
-					rtpPacket = RtpPacket()
-					rtpPacket.decode(data)
-					
-					currFrameNbr = rtpPacket.seqNum()
-					timestamp = rtpPacket.timestamp()
-					
-					# Record packet statistics
-					self.stats.recordPacketReceived(len(data), timestamp)
-					
-					# Check if this is a fragmented packet
-					if rtpPacket.isFragmented():
-						# Handle fragmented frame
-						self.handleFragmentedPacket(rtpPacket, currFrameNbr)
-					else:
-						# Handle complete frame
-						if currFrameNbr > self.frameNbr:  # Discard late packets
-							self.frameNbr = currFrameNbr
-							self.stats.recordFrameReceived()
-							self.updateMovie(self.writeFrame(rtpPacket.getPayload()))
-							print(f"[Client] Frame {currFrameNbr} received (complete)")
-						else:
-							print(f"[Client] Discarded late packet: {currFrameNbr}")
-							self.stats.recordPacketLost()
-					
-					# Update statistics display every second
-					if time.time() - self.lastStatsUpdate > 1.0:
-						self.updateStatsDisplay()
-						self.lastStatsUpdate = time.time()
-						
-			except:
-				# Stop listening upon requesting PAUSE or TEARDOWN
-				if self.playEvent.isSet(): 
-					break
-				
-				# Upon receiving ACK for TEARDOWN request,
-				# close the RTP socket
-				if self.teardownAcked == 1:
-					self.rtpSocket.shutdown(socket.SHUT_RDWR)
-					self.rtpSocket.close()
-					break
-		
-		# Print final statistics
-		print("\n[Client] Playback stopped. Final statistics:")
-		self.stats.printStats()
+	def changeRendition(self, rendition):
+		"""Rendition menu handler."""
+		if not self.receiver.setRendition(rendition):
+			tkinter.messagebox.showwarning('Rendition Unavailable', 'The server cannot send the %s rendition' %rendition)
+			self.renditionVar.set(self.receiver.rendition or FULL)
 	
-	def handleFragmentedPacket(self, rtpPacket, frameNbr):
-		"""Handle fragmented RTP packets and reassemble frames."""
-		fragmentId = rtpPacket.getFragmentId()
-		totalFragments = rtpPacket.getTotalFragments()
-		fragmentIndex = rtpPacket.getFragmentIndex()
-		
-		self.stats.recordFragmentReceived()
-		
-		print(f"[Client] Received fragment {fragmentIndex+1}/{totalFragments} for frame {frameNbr} (frag_id: {fragmentId})")
-		
-		# Initialize buffer for this fragment ID if needed
-		if fragmentId not in self.fragmentBuffer:
-			self.fragmentBuffer[fragmentId] = {}
-			self.fragmentMetadata[fragmentId] = (totalFragments, frameNbr)
-		
-		# Store the fragment
-		self.fragmentBuffer[fragmentId][fragmentIndex] = rtpPacket.getPayload()
-		
-		# Check if we have all fragments
-		if len(self.fragmentBuffer[fragmentId]) == totalFragments:
-			# Reassemble the frame
-			completeFrame = bytearray()
-			for i in range(totalFragments):
-				if i in self.fragmentBuffer[fragmentId]:
-					completeFrame.extend(self.fragmentBuffer[fragmentId][i])
-				else:
-					print(f"[Client] Warning: Missing fragment {i} for frame {frameNbr}")
-					self.stats.recordFrameLost()
-					# Clean up incomplete frame
-					del self.fragmentBuffer[fragmentId]
-					del self.fragmentMetadata[fragmentId]
-					return
-			
-			# Update frame display
-			if frameNbr > self.frameNbr:
-				self.frameNbr = frameNbr
-				self.stats.recordFrameReceived()
-				self.updateMovie(self.writeFrame(bytes(completeFrame)))
-				print(f"[Client] Frame {frameNbr} reassembled from {totalFragments} fragments ({len(completeFrame)} bytes)")
-			
-			# Clean up buffer
-			del self.fragmentBuffer[fragmentId]
-			del self.fragmentMetadata[fragmentId]
-			
-			# Clean up old incomplete fragments (timeout after 10 fragment IDs)
-			oldFragmentIds = [fid for fid in self.fragmentBuffer.keys() if fragmentId - fid > 10]
-			for fid in oldFragmentIds:
-				print(f"[Client] Cleaning up incomplete fragment {fid}")
-				self.stats.recordFrameLost()
-				del self.fragmentBuffer[fid]
-				if fid in self.fragmentMetadata:
-					del self.fragmentMetadata[fid]
+	def onSeekPress(self, event):
+		self.seeking = True
+	
+	def seekMovie(self, event=None):
+		"""Seek bar release handler: play from the chosen position (PAUSE, then PLAY with a Range)."""
+		self.seeking = False
+		if self.seekBar['state'] == DISABLED or self.receiver.state == RtpReceiver.INIT:
+			return
+		playing = self.receiver.state == RtpReceiver.PLAYING
+		if playing:
+			self.receiver.pause()
+		self.receiver.seek(self.seekVar.get())
+		# Frame numbers restart at the new position
+		self.pipeline.reset()
+		if playing:
+			self.playMovie()
+	
+	def changeSpeed(self, speed):
+		"""Fast-forward menu handler (PAUSE, then PLAY with a Scale)."""
+		playing = self.receiver.state == RtpReceiver.PLAYING
+		if playing:
+			self.receiver.pause()
+		self.receiver.setScale(float(speed.rstrip('x')))
+		if playing:
+			self.playMovie()
+	
+	def onFrame(self, frameNbr, data):
+		"""Schedule a complete frame on its media clock and hand it to the decoders (receive thread)."""
+		self.pipeline.submit(frameNbr, data, self.playoutClock.schedule(self.receiver.frameTime))
 	
 	def updateStatsDisplay(self):
 		"""Update the statistics label in the GUI."""
-		statsStr = self.stats.getStatsString()
+		playout = self.playoutClock.getStats()
+		statsStr = (self.stats.getStatsString() + " | " + self.pipeline.getStatsString() +
+		            f" | Playout: {playout['target_delay_ms']:.0f} ms, {playout['late_frames']} late")
 		self.statsLabel.config(text=statsStr)
 					
 	def writeFrame(self, data):
 		"""Write the received frame to a temp image file. Return the image file."""
-		cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
+		cachename = CACHE_FILE_NAME + str(self.receiver.sessionId) + CACHE_FILE_EXT
 		file = open(cachename, "wb")
 		file.write(data)
 		file.close()
 		
 		return cachename
 	
-	def updateMovie(self, imageFile):
-		"""Update the image file as video frame in the GUI with smart scaling."""
-		try:
-			# Open image
-			img = Image.open(imageFile)
-			
-			# Get current label size
-			label_width = self.label.winfo_width()
-			label_height = self.label.winfo_height()
-			
-			# Scale image to fit window while maintaining aspect ratio
-			if label_width > 100 and label_height > 100:  # Valid size
-				img_width, img_height = img.size
-				aspect_ratio = img_width / img_height
-				
-				# Calculate best fit
-				if label_width / label_height > aspect_ratio:
-					# Height is limiting factor
-					new_height = label_height
-					new_width = int(new_height * aspect_ratio)
-				else:
-					# Width is limiting factor
-					new_width = label_width
-					new_height = int(new_width / aspect_ratio)
-				
-				# Resize image with high quality
-				img = img.resize((new_width, new_height), Image.LANCZOS)
-			
-			# Convert to PhotoImage and display
-			photo = ImageTk.PhotoImage(img)
-			self.label.configure(image=photo)
-			self.label.image = photo
-			
-		except Exception as e:
-			print(f"[Client] Error updating display: {e}")
+	def onLabelResize(self, event):
+		"""Remember the label size so decode workers never call into Tk."""
+		self.displaySize = (event.width, event.height)
+	
+	def decodeFrame(self, frameNbr, data):
+		"""Decode and scale a frame (decode worker thread). Return a PIL image."""
+		if self.SAVE_FRAMES:
+			with self.cacheLock:
+				self.writeFrame(data)
 		
-	def connectToServer(self):
-		"""Connect to the Server. Start a new RTSP/TCP session."""
-		self.rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		try:
-			self.rtspSocket.connect((self.serverAddr, self.serverPort))
-		except:
-			tkinter.messagebox.showwarning('Connection Failed', 'Connection to \'%s\' failed.' %self.serverAddr)
+		# Decode straight from the reassembled buffer, no file round trip
+		img = Image.open(io.BytesIO(data))
+		target = self.targetSize(img.size)
+		if target is not None and self.DRAFT_DECODE and img.format == 'JPEG':
+			# Let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the target
+			img.draft('RGB', target)
+		img.load()
+		
+		if target is not None and img.size != target:
+			img = img.resize(target, self.RESAMPLE_FILTERS[self.RESAMPLE])
+		return img
 	
-	def sendRtspRequest(self, requestCode):
-		"""Send RTSP request to the server."""	
+	def targetSize(self, sourceSize):
+		"""Return the size that fits the label keeping the aspect ratio, or None to show as is.
 		
-		# Setup request
-		if requestCode == self.SETUP and self.state == self.INIT:
-			threading.Thread(target=self.recvRtspReply).start()
-			# Update RTSP sequence number.
-			self.rtspSeq += 1
-			
-			# Write the RTSP request to be sent.
-			request = f"SETUP {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nTransport: RTP/UDP; client_port= {self.rtpPort}"
-			
-			# Keep track of the sent request.
-			self.requestSent = self.SETUP
+		Cached until the source or the window size changes.
+		"""
+		sourceCached, displayCached, target = self.scaleCache
+		displaySize = self.displaySize
+		if sourceCached == sourceSize and displayCached == displaySize:
+			return target
 		
-		# Play request
-		elif requestCode == self.PLAY and self.state == self.READY:
-			# Update RTSP sequence number.
-			self.rtspSeq += 1
+		target = None
+		label_width, label_height = displaySize
+		if label_width > 100 and label_height > 100:  # Valid size
+			img_width, img_height = sourceSize
+			aspect_ratio = img_width / img_height
 			
-			# Write the RTSP request to be sent.
-			request = f"PLAY {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}"
-			
-			# Keep track of the sent request.
-			self.requestSent = self.PLAY
+			# Calculate best fit
+			if label_width / label_height > aspect_ratio:
+				# Height is limiting factor
+				new_height = label_height
+				new_width = int(new_height * aspect_ratio)
+			else:
+				# Width is limiting factor
+				new_width = label_width
+				new_height = int(new_width / aspect_ratio)
+			target = (new_width, new_height)
 		
-		# Pause request
-		elif requestCode == self.PAUSE and self.state == self.PLAYING:
-			# Update RTSP sequence number.
-			self.rtspSeq += 1
-			
-			# Write the RTSP request to be sent.
-			request = f"PAUSE {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}"
-			
-			# Keep track of the sent request.
-			self.requestSent = self.PAUSE
-			
-		# Teardown request
-		elif requestCode == self.TEARDOWN and not self.state == self.INIT:
-			# Update RTSP sequence number.
-			self.rtspSeq += 1
-			
-			# Write the RTSP request to be sent.
-			request = f"TEARDOWN {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}"
-			
-			# Keep track of the sent request.
-			self.requestSent = self.TEARDOWN
-		else:
-			return
+		self.scaleCache = (sourceSize, displaySize, target)
+		return target
+	
+	def pollDisplay(self):
+		"""Show the latest decoded frame and refresh statistics (Tk thread)."""
+		item = self.pipeline.takeLatest()
+		if item is not None:
+			self.updateMovie(item[1])
+			if self.receiver.duration and not self.seeking:
+				# Frame n of the file is at (n - 1) / frame rate
+				self.seekVar.set((item[0] - 1) / DEFAULT_FRAME_RATE)
 		
-		# Send the RTSP request using rtspSocket.
-		self.rtspSocket.send(request.encode())
+		# Update statistics display every second
+		if time.time() - self.lastStatsUpdate > 1.0:
+			self.updateStatsDisplay()
+			self.lastStatsUpdate = time.time()
 		
-		print('\nData sent:\n' + request)
+		self.master.after(DISPLAY_POLL_MS, self.pollDisplay)
 	
-	def recvRtspReply(self):
-		"""Receive RTSP reply from the server."""
-		while True:
-			reply = self.rtspSocket.recv(1024)
-			
-			if reply: 
-				self.parseRtspReply(reply.decode("utf-8"))
-			
-			# Close the RTSP socket upon requesting Teardown
-			if self.requestSent == self.TEARDOWN:
-				self.rtspSocket.shutdown(socket.SHUT_RDWR)
-				self.rtspSocket.close()
-				break
-	
-	def parseRtspReply(self, data):
-		"""Parse the RTSP reply from the server."""
-		lines = data.split('\n')
-		seqNum = int(lines[1].split(' ')[1])
-		
-		# Process only if the server reply's sequence number is the same as the request's
-		if seqNum == self.rtspSeq:
-			session = int(lines[2].split(' ')[1])
-			# New RTSP session ID
-			if self.sessionId == 0:
-				self.sessionId = session
+	def updateMovie(self, img):
+		"""Display a decoded frame in the GUI (Tk thread)."""
+		try:
+			# Reuse the PhotoImage while the frame size is unchanged
+			key = (img.mode, img.size)
+			if key == self.photoKey:
+				self.photo.paste(img)
+			else:
+				self.photo = ImageTk.PhotoImage(img)
+				self.photoKey = key
+				self.label.configure(image=self.photo)
+				self.label.image = self.photo
 			
-			# Process only if the session ID is the same
-			if self.sessionId == session:
-				if int(lines[0].split(' ')[1]) == 200: 
-					if self.requestSent == self.SETUP:
-						# Update RTSP state.
-						self.state = self.READY
-						
-						# Open RTP port.
-						self.openRtpPort() 
-					elif self.requestSent == self.PLAY:
-						self.state = self.PLAYING
-					elif self.requestSent == self.PAUSE:
-						self.state = self.READY
-						
-						# The play thread exits. A new thread is created on resume.
-						self.playEvent.set()
-					elif self.requestSent == self.TEARDOWN:
-						self.state = self.INIT
-						
-						# Flag the teardownAcked to close the socket.
-						self.teardownAcked = 1 
-	
-	def openRtpPort(self):
-		"""Open RTP socket binded to a specified port."""
-		#-------------
-	def openRtpPort(self):
-		"""Open RTP socket binded to a specified port."""
-		# Create a new datagram socket to receive RTP packets from the server
-		self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-		
-		# Set the timeout value of the socket to 0.5sec
-		self.rtpSocket.settimeout(0.5)
+		except Exception as e:
+			print(f"[Client] Error updating display: {e}")
 		
+	def connectToServer(self):
+		"""Connect to the Server. Start a new RTSP/TCP session."""
 		try:
-			# Bind the socket to the address using the RTP port given by the client user
-			self.rtpSocket.bind(('', self.rtpPort))
-		except:
-			tkinter.messagebox.showwarning('Unable to Bind', 'Unable to bind PORT=%d' %self.rtpPort)
+			self.receiver.connect()
+		except OSError:
+			tkinter.messagebox.showwarning('Connection Failed', 'Connection to \'%s\' failed.' %self.receiver.serverAddr)
 
 	def handler(self):
 		"""Handler on explicitly closing the GUI window."""
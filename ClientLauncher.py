@@ -1,19 +1,44 @@
-import sys
+import argparse
 from tkinter import Tk
 from Client import Client
+from RtpReceiver import RtpReceiver
+from Transcoder import FULL, RENDITIONS
 
 if __name__ == "__main__":
-	try:
-		serverAddr = sys.argv[1]
-		serverPort = sys.argv[2]
-		rtpPort = sys.argv[3]
-		fileName = sys.argv[4]	
-	except:
-		print("[Usage: ClientLauncher.py Server_name Server_port RTP_port Video_file]\n")	
+	parser = argparse.ArgumentParser(usage="ClientLauncher.py Server_name Server_port RTP_port Video_file [options]")
+	parser.add_argument('serverAddr', help="RTSP server host")
+	parser.add_argument('serverPort', help="RTSP server port")
+	parser.add_argument('rtpPort', help="local port to receive RTP on")
+	parser.add_argument('fileName', help="video file to request")
+	parser.add_argument('--save-frames', action='store_true',
+	                    help="also write every received frame to cache-<session>.jpg (debugging/snapshots)")
+	parser.add_argument('--resample', choices=sorted(Client.RESAMPLE_FILTERS), default=Client.RESAMPLE,
+	                    help="filter used to scale frames to the window (nearest is fastest, lanczos sharpest)")
+	parser.add_argument('--no-draft', action='store_true',
+	                    help="always decode JPEGs at full size before scaling")
+	parser.add_argument('--playout-delay', type=int, default=int(Client.PLAYOUT_DELAY * 1000), metavar='MS',
+	                    help="present frames on their media clock this many ms after the earliest arrival, "
+	                         "absorbing network jitter (0 = show frames as soon as they are decoded)")
+	parser.add_argument('--no-nack', action='store_true',
+	                    help="do not ask the server to resend missing fragments")
+	parser.add_argument('--rendition', choices=[FULL] + sorted(RENDITIONS),
+	                    help="JPEG rendition to ask the server for (lower ones are smaller; switchable in the window)")
+	parser.add_argument('--no-reports', action='store_true',
+	                    help="do not send receiver reports (the server then never adapts its frame rate)")
+	args = parser.parse_args()
+	
+	Client.SAVE_FRAMES = args.save_frames
+	Client.RESAMPLE = args.resample
+	Client.DRAFT_DECODE = not args.no_draft
+	Client.PLAYOUT_DELAY = args.playout_delay / 1000
+	Client.RENDITION = args.rendition
+	RtpReceiver.SEND_NACKS = not args.no_nack
+	if args.no_reports:
+		RtpReceiver.REPORT_INTERVAL = 0
 	
 	root = Tk()
 	
 	# Create a new client
-	app = Client(root, serverAddr, serverPort, rtpPort, fileName)
+	app = Client(root, args.serverAddr, args.serverPort, args.rtpPort, args.fileName)
 	app.master.title("RTPClient")	
 	root.mainloop()
@@ -0,0 +1,329 @@
+import heapq, itertools, multiprocessing, selectors, socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ServerWorker import ServerWorker
+from Pacer import PacedStream, sharedReader
+from MetricsServer import sharedRegistry, startMetricsServer
+from Broadcast import sharedChannels
+
+
+class Timer:
+	"""Handle for a callback scheduled on the event loop."""
+	__slots__ = ('deadline', 'callback', 'cancelled')
+
+	def __init__(self, deadline, callback):
+		self.deadline = deadline
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self):
+		"""Prevent the callback from running."""
+		self.cancelled = True
+
+
+class EventLoop:
+	"""Single-threaded loop multiplexing sockets (selectors) and timers (heap).
+
+	Blocking file work runs on a small thread pool (runInThread); its
+	results are posted back and handled on the loop thread.
+	"""
+
+	FILE_WORKERS = 4  # Threads opening and reading video files for the loop's sessions
+
+	def __init__(self):
+		self.selector = selectors.DefaultSelector()
+		self.timers = []
+		self.counter = itertools.count()  # Tie-breaker for timers with equal deadlines
+		self.running = False
+		self.maxLag = 0.0  # Worst timer lateness seen (seconds)
+		self.executor = None  # Started with the first runInThread()
+		# Callbacks posted from other threads, and a socket pair that wakes select() for them
+		self.posted = deque()
+		self.wakeReader, self.wakeWriter = socket.socketpair()
+		self.wakeReader.setblocking(False)
+		self.wakeWriter.setblocking(False)
+		self.addReader(self.wakeReader, self.runPosted)
+
+	def addReader(self, sock, callback):
+		"""Call callback() whenever sock is readable."""
+		self.selector.register(sock, selectors.EVENT_READ, callback)
+
+	def removeReader(self, sock):
+		"""Stop watching sock."""
+		try:
+			self.selector.unregister(sock)
+		except (KeyError, ValueError):
+			pass
+
+	def callAt(self, deadline, callback):
+		"""Schedule callback() at a time.monotonic() deadline. Return a Timer."""
+		timer = Timer(deadline, callback)
+		heapq.heappush(self.timers, (deadline, next(self.counter), timer))
+		return timer
+
+	def callFromThread(self, callback):
+		"""Run callback() on the loop thread as soon as possible (any thread)."""
+		self.posted.append(callback)
+		try:
+			self.wakeWriter.send(b'\0')
+		except BlockingIOError:
+			pass  # Already woken: the pending bytes will do
+
+	def runPosted(self):
+		"""Run the callbacks posted by other threads."""
+		try:
+			while self.wakeReader.recv(1024):
+				pass
+		except BlockingIOError:
+			pass
+		while self.posted:
+			self.posted.popleft()()
+
+	def runInThread(self, func, callback):
+		"""Run func() on a file worker thread, then callback(future) on the loop thread."""
+		if self.executor is None:
+			self.executor = ThreadPoolExecutor(self.FILE_WORKERS, thread_name_prefix='EventLoopFile')
+		future = self.executor.submit(func)
+		future.add_done_callback(lambda future: self.callFromThread(lambda: callback(future)))
+		return future
+
+	def stop(self):
+		"""Make runForever() return after the current iteration."""
+		self.running = False
+
+	def runForever(self):
+		"""Dispatch socket events and due timers until stop() is called."""
+		self.running = True
+		while self.running:
+			timeout = None
+			if self.timers:
+				timeout = max(0.0, self.timers[0][0] - time.monotonic())
+
+			for key, _ in self.selector.select(timeout):
+				key.data()
+
+			now = time.monotonic()
+			while self.timers and self.timers[0][0] <= now:
+				deadline, _, timer = heapq.heappop(self.timers)
+				if timer.cancelled:
+					continue
+				self.maxLag = max(self.maxLag, now - deadline)
+				timer.callback()
+
+
+class EventLoopWorker(ServerWorker):
+	"""RTSP/RTP session driven by an EventLoop instead of its own threads.
+
+	Uses the same RTSP handling, packetization and PacedStream pacing as
+	ServerWorker; only the socket reads and timers are moved onto the loop.
+	SETUP, which opens the file and may build its frame index, runs on a
+	file worker thread; the session's requests are not read meanwhile.
+	Frames are read ahead on the shared frame reader pool, so a slow disk
+	or cache miss delays only its own session, never the loop.
+	"""
+
+	def __init__(self, clientInfo, loop):
+		super().__init__(clientInfo)
+		self.loop = loop
+		self.timer = None
+
+	def run(self):
+		connSocket = self.clientInfo['rtspSocket'][0]
+		connSocket.setblocking(False)
+		self.loop.addReader(connSocket, self.recvRtspRequest)
+
+	def recvRtspRequest(self):
+		"""Read one RTSP request when the connection is readable."""
+		connSocket = self.clientInfo['rtspSocket'][0]
+		try:
+			data = connSocket.recv(1024)
+		except BlockingIOError:
+			return
+		except OSError:
+			data = b''
+
+		if not data:
+			# Client disconnected without TEARDOWN
+			if not self.afterFrameRead(self.close):
+				self.close()
+			return
+
+		request = data.decode("utf-8")
+		print("Data received:\n" + request)
+		requestType = request.split(' ', 1)[0]
+		if requestType == self.SETUP:
+			self.loop.removeReader(connSocket)
+			self.loop.runInThread(lambda: self.processRtspRequest(request), self.onSetupDone)
+			return
+		if requestType == self.TEARDOWN or (requestType == self.PAUSE and self.state == self.PLAYING):
+			if self.afterFrameRead(lambda: self.onFrameRead(request)):
+				return
+		self.processRequest(request)
+
+	def processRequest(self, request):
+		try:
+			self.processRtspRequest(request)
+		except Exception as e:
+			# A malformed request must not take down every other session on the loop
+			print(f"[Server] Error processing RTSP request: {e}")
+
+	def onSetupDone(self, future):
+		"""Read the session's next request once SETUP is done (loop thread)."""
+		if future.exception() is not None:
+			print(f"[Server] Error processing RTSP request: {future.exception()}")
+		self.loop.addReader(self.clientInfo['rtspSocket'][0], self.recvRtspRequest)
+
+	def afterFrameRead(self, callback):
+		"""Stop the session's stream and run callback() on the loop once its frame read in flight is done.
+
+		stopStreaming() waits for the read ahead, which may be stuck on the
+		disk; the request that stops the stream waits for it instead, and
+		the session's requests are not read meanwhile. Return False if no
+		read is in flight: the caller goes ahead at once.
+		"""
+		pacedStream = self.pacedStream
+		if self.channel is not None:
+			# Only the last viewer stops the channel's producer
+			pacedStream = self.channel.pacedStream if self.channel.subscribers == (self,) else None
+		if pacedStream is None or pacedStream.reading is None or pacedStream.reading.done():
+			return False
+		pacedStream.cancel()
+		self.loop.removeReader(self.clientInfo['rtspSocket'][0])
+		pacedStream.reading.add_done_callback(lambda future: self.loop.callFromThread(callback))
+		return True
+
+	def onFrameRead(self, request):
+		"""Process a PAUSE or TEARDOWN deferred by afterFrameRead(), then read the next request (loop thread)."""
+		self.processRequest(request)
+		self.loop.addReader(self.clientInfo['rtspSocket'][0], self.recvRtspRequest)
+
+	def startStreaming(self):
+		"""Pace the session's packets with loop timers."""
+		self.clientInfo['rtpSocket'].setblocking(False)
+		if self.channel is not None:
+			# The channel's producer is paced on the loop (EventLoopServer.paceChannel)
+			super().startStreaming()
+			return
+		self.pacedStream = PacedStream(self, self.FRAME_RATE, self.TARGET_BITRATE, reader=sharedReader)
+		self.timer = self.loop.callAt(self.pacedStream.frameDeadline, self.onPacingTimer)
+
+	def startFeedback(self):
+		"""Read RTCP feedback when the RTP socket is readable."""
+		rtpSocket = self.clientInfo['rtpSocket']
+		rtpSocket.setblocking(False)
+		self.loop.addReader(rtpSocket, self.recvFeedback)
+
+	def recvFeedback(self):
+		"""Read the pending feedback packets."""
+		rtpSocket = self.clientInfo['rtpSocket']
+		while True:
+			try:
+				data = rtpSocket.recv(2048)
+			except BlockingIOError:
+				return
+			except OSError:
+				# The client's port is gone (ICMP port unreachable)
+				self.loop.removeReader(rtpSocket)
+				return
+			self.handleFeedback(data)
+
+	def closeRtpSocket(self):
+		if 'rtpSocket' in self.clientInfo:
+			self.loop.removeReader(self.clientInfo['rtpSocket'])
+		super().closeRtpSocket()
+
+	def stopStreaming(self):
+		"""Cancel the pacing timer (PAUSE or TEARDOWN)."""
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+		super().stopStreaming()
+
+	def onPacingTimer(self):
+		"""Send the packets that are due and schedule the next wakeup."""
+		deadline = self.pacedStream.runDue(time.monotonic())
+		self.timer = self.loop.callAt(deadline, self.onPacingTimer) if deadline is not None else None
+
+	def close(self):
+		"""Release everything held by the session after the client disconnects."""
+		connSocket = self.clientInfo['rtspSocket'][0]
+		self.loop.removeReader(connSocket)
+		self.stopStreaming()
+		self.closeRtpSocket()
+		if 'videoStream' in self.clientInfo:
+			self.clientInfo['videoStream'].close()
+		self.releaseChannel()
+		connSocket.close()
+		sharedRegistry.unregister(self)
+
+
+class EventLoopServer:
+	"""RTSP server running every session on one event loop."""
+
+	def __init__(self, port, reusePort=False):
+		self.port = port
+		self.loop = EventLoop()
+		self.rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.rtspSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		if reusePort:
+			# Let one loop per core accept on the same port
+			self.rtspSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		self.rtspSocket.bind(('', port))
+		self.rtspSocket.listen(socket.SOMAXCONN)
+		self.rtspSocket.setblocking(False)
+		sharedRegistry.addGauge('event_loop_max_lag_ms', lambda: self.loop.maxLag * 1000,
+		                        'Worst lateness of an event loop timer')
+		sharedChannels.scheduler = self.paceChannel
+
+	def acceptClients(self):
+		"""Accept all pending RTSP connections."""
+		while True:
+			try:
+				clientInfo = {}
+				clientInfo['rtspSocket'] = self.rtspSocket.accept()
+			except BlockingIOError:
+				return
+			EventLoopWorker(clientInfo, self.loop).run()
+
+	def paceChannel(self, pacedStream):
+		"""Drive a broadcast channel's PacedStream with loop timers until it is cancelled."""
+		def onTimer():
+			deadline = pacedStream.runDue(time.monotonic())
+			if deadline is not None:
+				self.loop.callAt(deadline, onTimer)
+		self.loop.callAt(pacedStream.frameDeadline, onTimer)
+
+	def serveForever(self):
+		self.loop.addReader(self.rtspSocket, self.acceptClients)
+		self.loop.runForever()
+
+
+def _serveLoop(port, reusePort, metricsPort=0):
+	server = EventLoopServer(port, reusePort)
+	if metricsPort:
+		startMetricsServer(metricsPort)
+	server.serveForever()
+
+
+def runEventLoopServer(port, loops=1, metricsPort=0):
+	"""Serve on one event loop, or one loop process per core sharing the port.
+
+	With several loops, each process serves its own metrics on metricsPort + i.
+	"""
+	if loops <= 1:
+		_serveLoop(port, False, metricsPort)
+		return
+
+	if not hasattr(socket, 'SO_REUSEPORT'):
+		print("[Server] SO_REUSEPORT is not available, running a single event loop")
+		_serveLoop(port, False, metricsPort)
+		return
+
+	processes = [multiprocessing.Process(target=_serveLoop, args=(port, True, metricsPort + i if metricsPort else 0))
+	             for i in range(loops)]
+	for process in processes:
+		process.start()
+	for process in processes:
+		process.join()
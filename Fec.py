@@ -0,0 +1,50 @@
+import struct
+
+from RtpPacket import PendingPacket, FRAGMENT_FLAG_PARITY
+
+# XOR parity over a group of data fragments (the scheme of RFC 5109 without
+# its FEC header: the fragment header already names the group). The parity
+# payload is the XOR of the group's payloads, each zero-padded to the
+# fragment size, followed by the XOR of their lengths, so a missing last
+# fragment is rebuilt at its real length.
+LENGTH_FIELD = struct.Struct('!H')
+DEFAULT_GROUP_SIZE = 10  # Data fragments per parity packet
+
+
+def parityPayload(payloads, fragmentSize):
+	"""Return the parity payload of a group of fragment payloads."""
+	acc = 0
+	lengths = 0
+	for payload in payloads:
+		# Little-endian: a shorter payload is implicitly zero-padded at the end
+		acc ^= int.from_bytes(payload, 'little')
+		lengths ^= len(payload)
+	return acc.to_bytes(fragmentSize, 'little') + LENGTH_FIELD.pack(lengths)
+
+
+def recoverPayload(parity, payloads, fragmentSize):
+	"""Rebuild the one missing payload of a group from its parity and the other payloads.
+
+	Raises ValueError if the lengths do not add up (parity of another group or corrupt).
+	"""
+	acc = int.from_bytes(parity[:fragmentSize], 'little')
+	length = LENGTH_FIELD.unpack_from(parity, fragmentSize)[0]
+	for payload in payloads:
+		acc ^= int.from_bytes(payload, 'little')
+		length ^= len(payload)
+	if not 0 < length <= fragmentSize:
+		raise ValueError(f"Recovered fragment length {length} out of range")
+	return acc.to_bytes(fragmentSize, 'little')[:length]
+
+
+def protectFragments(packets, groupSize=DEFAULT_GROUP_SIZE):
+	"""Return the fragment PendingPackets of a frame with a parity packet after every group of groupSize."""
+	protected = []
+	for first in range(0, len(packets), groupSize):
+		group = packets[first:first + groupSize]
+		protected.extend(group)
+		head = group[0]
+		protected.append(PendingPacket(parityPayload([packet.payload for packet in group], head.fragment_size),
+		                               head.seqnum, head.timestamp, head.fragment_id, head.total_fragments,
+		                               first, head.fragment_size, FRAGMENT_FLAG_PARITY, len(group)))
+	return protected
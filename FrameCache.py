@@ -0,0 +1,170 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_BUDGET = 128 * 1024 * 1024  # 128MB
+DEFAULT_SHARDS = 16
+PROTECTED_RATIO = 0.8  # Share of each shard reserved for frames hit more than once
+
+
+class _Shard:
+	"""One lock-protected slice of the cache using segmented LRU.
+
+	New frames enter the probation segment; a second hit promotes them to the
+	protected segment. Eviction takes the least recently used probation frame
+	first, so a single sequential pass over a cold file cannot flush the
+	frames that many sessions keep re-reading.
+	"""
+
+	def __init__(self, budget):
+		self.lock = threading.Lock()
+		self.budget = budget
+		self.protectedBudget = int(budget * PROTECTED_RATIO)
+		self.probation = OrderedDict()
+		self.protected = OrderedDict()
+		self.probationBytes = 0
+		self.protectedBytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.insertions = 0
+
+	def get(self, key):
+		with self.lock:
+			data = self.protected.get(key)
+			if data is not None:
+				self.protected.move_to_end(key)
+				self.hits += 1
+				return data
+
+			data = self.probation.pop(key, None)
+			if data is None:
+				self.misses += 1
+				return None
+
+			# Second hit: promote to the protected segment
+			self.hits += 1
+			self.probationBytes -= len(data)
+			self.protected[key] = data
+			self.protectedBytes += len(data)
+			while self.protectedBytes > self.protectedBudget and len(self.protected) > 1:
+				oldKey, oldData = self.protected.popitem(last=False)
+				self.protectedBytes -= len(oldData)
+				self.probation[oldKey] = oldData
+				self.probationBytes += len(oldData)
+			self._evict()
+			return data
+
+	def contains(self, key):
+		with self.lock:
+			return key in self.protected or key in self.probation
+
+	def put(self, key, data):
+		size = len(data)
+		if size > self.budget:
+			return
+		with self.lock:
+			if key in self.protected or key in self.probation:
+				return
+			self.probation[key] = data
+			self.probationBytes += size
+			self.insertions += 1
+			self._evict()
+
+	def _evict(self):
+		"""Drop least recently used frames until the shard fits its budget."""
+		while self.probationBytes + self.protectedBytes > self.budget:
+			if self.probation:
+				_, data = self.probation.popitem(last=False)
+				self.probationBytes -= len(data)
+			else:
+				_, data = self.protected.popitem(last=False)
+				self.protectedBytes -= len(data)
+			self.evictions += 1
+
+	def clear(self):
+		with self.lock:
+			self.probation.clear()
+			self.protected.clear()
+			self.probationBytes = 0
+			self.protectedBytes = 0
+
+
+class FrameCache:
+	"""Process-wide cache of video frames keyed by (file, frame number).
+
+	The byte budget is split across independently locked shards, and frames
+	are loaded outside any lock, so concurrent sessions reading through the
+	cache only contend when they touch the same shard at the same instant.
+	"""
+
+	def __init__(self, budget=DEFAULT_BUDGET, shards=DEFAULT_SHARDS):
+		self.configure(budget, shards)
+
+	def configure(self, budget, shards=DEFAULT_SHARDS):
+		"""Set the memory budget in bytes (0 disables the cache). Drops cached frames."""
+		self.budget = max(0, int(budget))
+		self.shards = [_Shard(self.budget // shards) for _ in range(shards)]
+
+	def enabled(self):
+		"""Check if the cache has a memory budget."""
+		return self.budget > 0
+
+	def _shard(self, key):
+		return self.shards[hash(key) % len(self.shards)]
+
+	def get(self, key):
+		"""Return the cached frame or None."""
+		return self._shard(key).get(key)
+
+	def contains(self, key):
+		"""Check if a frame is cached, without counting a hit or miss or refreshing it."""
+		return self._shard(key).contains(key)
+
+	def put(self, key, data):
+		"""Cache a frame (as immutable bytes)."""
+		self._shard(key).put(key, data)
+
+	def getOrLoad(self, key, loader):
+		"""Return the cached frame, calling loader() and caching the result on a miss."""
+		shard = self._shard(key)
+		data = shard.get(key)
+		if data is None:
+			data = loader()
+			if data is not None:
+				shard.put(key, data)
+		return data
+
+	def clear(self):
+		"""Drop every cached frame (counters are kept)."""
+		for shard in self.shards:
+			shard.clear()
+
+	def getStats(self):
+		"""Get cache counters as a dictionary."""
+		stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'insertions': 0, 'entries': 0, 'bytes': 0}
+		for shard in self.shards:
+			with shard.lock:
+				stats['hits'] += shard.hits
+				stats['misses'] += shard.misses
+				stats['evictions'] += shard.evictions
+				stats['insertions'] += shard.insertions
+				stats['entries'] += len(shard.probation) + len(shard.protected)
+				stats['bytes'] += shard.probationBytes + shard.protectedBytes
+		lookups = stats['hits'] + stats['misses']
+		stats['budget_bytes'] = self.budget
+		stats['hit_rate'] = (stats['hits'] / lookups * 100) if lookups else 0
+		return stats
+
+	def getStatsString(self):
+		"""Get cache statistics as a formatted string."""
+		stats = self.getStats()
+		return (
+			f"Cache: {stats['entries']} frames, {stats['bytes'] / 1048576:.1f}/"
+			f"{stats['budget_bytes'] / 1048576:.0f} MB | "
+			f"Hit rate: {stats['hit_rate']:.1f}% | "
+			f"Hits: {stats['hits']} | Misses: {stats['misses']} | Evictions: {stats['evictions']}"
+		)
+
+
+# Cache shared by every session of the server process
+sharedCache = FrameCache()
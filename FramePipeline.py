@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import deque
+
+from Playout import PlayoutBuffer, DEFAULT_PLAYOUT_FRAMES
+
+DEFAULT_QUEUE_SIZE = 2  # Frames waiting for a decode worker
+DEFAULT_DECODE_WORKERS = 2
+
+
+class LatestFrameQueue:
+	"""Bounded queue that drops its oldest item when full (latest frame wins)."""
+
+	def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+		self.items = deque()
+		self.maxsize = maxsize
+		self.cond = threading.Condition()
+		self.closed = False
+		self.puts = 0
+		self.drops = 0
+		self.peakDepth = 0
+
+	def put(self, item):
+		"""Add an item, dropping the oldest one if the queue is full. Return True if one was dropped."""
+		with self.cond:
+			dropped = len(self.items) >= self.maxsize
+			if dropped:
+				self.items.popleft()
+				self.drops += 1
+			self.items.append(item)
+			self.puts += 1
+			self.peakDepth = max(self.peakDepth, len(self.items))
+			self.cond.notify()
+			return dropped
+
+	def get(self, timeout=None):
+		"""Return the oldest item, waiting up to timeout. Return None on timeout or after close()."""
+		with self.cond:
+			if not self.items and not self.closed:
+				self.cond.wait(timeout)
+			if self.items:
+				return self.items.popleft()
+			return None
+
+	def takeLatest(self):
+		"""Return the newest item without waiting, discarding older ones. Return None if empty."""
+		with self.cond:
+			if not self.items:
+				return None
+			item = self.items.pop()
+			self.drops += len(self.items)
+			self.items.clear()
+			return item
+
+	def close(self):
+		"""Wake every waiting get()."""
+		with self.cond:
+			self.closed = True
+			self.cond.notify_all()
+
+	def depth(self):
+		return len(self.items)
+
+	def getStats(self):
+		with self.cond:
+			return {'depth': len(self.items), 'peak_depth': self.peakDepth, 'puts': self.puts, 'drops': self.drops}
+
+
+class FramePipeline:
+	"""Staged frame pipeline: receive thread -> decode/scale workers -> playout -> display.
+
+	The receive thread only submits complete frames, so it returns to recv()
+	at once. Workers run decode(frameNumber, data) in parallel and leave the
+	result in a playout buffer until its presentation time; the display side
+	(the Tk thread, polling from master.after) takes the newest due result.
+	When any stage falls behind, older frames are dropped instead of queued.
+	"""
+
+	def __init__(self, decode, workers=DEFAULT_DECODE_WORKERS, queueSize=DEFAULT_QUEUE_SIZE,
+	             playoutFrames=DEFAULT_PLAYOUT_FRAMES):
+		self.decode = decode
+		self.workerCount = max(1, workers)
+		self.decodeQueue = LatestFrameQueue(queueSize)
+		self.playout = PlayoutBuffer(playoutFrames)
+		self.lock = threading.Lock()
+		self.newestDecoded = -1
+		self.staleDecoded = 0
+		self.decodeErrors = 0
+		self.framesDecoded = 0
+		self.decodeTime = 0.0
+		self.framesDisplayed = 0
+		self.workers = []
+		self.running = False
+
+	def start(self):
+		"""Start the decode workers."""
+		if self.running:
+			return
+		self.running = True
+		self.decodeQueue.closed = False
+		for i in range(self.workerCount):
+			worker = threading.Thread(target=self._work, name=f'Decoder-{i}', daemon=True)
+			worker.start()
+			self.workers.append(worker)
+
+	def stop(self):
+		"""Stop the decode workers (queued frames are discarded)."""
+		self.running = False
+		self.decodeQueue.close()
+		for worker in self.workers:
+			worker.join(1.0)
+		self.workers = []
+
+	def submit(self, frameNumber, data, presentAt=0.0):
+		"""Hand a complete frame to the decoders (receive thread, never blocks).
+
+		presentAt is its time.monotonic() presentation time (0 = as soon as decoded).
+		"""
+		self.decodeQueue.put((frameNumber, data, presentAt))
+
+	def takeLatest(self, now=None):
+		"""Return the newest decoded (frameNumber, result) that is due, or None (display thread)."""
+		item = self.playout.takeDue(now)
+		if item is not None:
+			self.framesDisplayed += 1
+		return item
+
+	def _work(self):
+		while self.running:
+			item = self.decodeQueue.get(0.5)
+			if item is None:
+				continue
+			frameNumber, data, presentAt = item
+			with self.lock:
+				if frameNumber <= self.newestDecoded:
+					# Another worker already finished a newer frame
+					self.staleDecoded += 1
+					continue
+
+			start = time.perf_counter()
+			try:
+				result = self.decode(frameNumber, data)
+			except Exception as e:
+				print(f"[Client] Error decoding frame {frameNumber}: {e}")
+				with self.lock:
+					self.decodeErrors += 1
+				continue
+			elapsed = time.perf_counter() - start
+
+			with self.lock:
+				self.framesDecoded += 1
+				self.decodeTime += elapsed
+				if frameNumber <= self.newestDecoded:
+					self.staleDecoded += 1
+					continue
+				self.newestDecoded = frameNumber
+			self.playout.put(frameNumber, result, presentAt)
+
+	def reset(self):
+		"""Forget the newest frame number and held frames (e.g. after a seek restarts numbering)."""
+		with self.lock:
+			self.newestDecoded = -1
+		self.playout.reset()
+
+	def getStats(self):
+		"""Get per-stage queue depths and drop counters as a dictionary."""
+		decodeStats = self.decodeQueue.getStats()
+		playoutStats = self.playout.getStats()
+		with self.lock:
+			return {
+				'decode_queue_depth': decodeStats['depth'],
+				'decode_queue_peak': decodeStats['peak_depth'],
+				'decode_queue_drops': decodeStats['drops'],
+				'playout_depth': playoutStats['depth'],
+				'playout_peak': playoutStats['peak_depth'],
+				'display_drops': playoutStats['drops'] + self.staleDecoded,
+				'frames_decoded': self.framesDecoded,
+				'frames_displayed': self.framesDisplayed,
+				'decode_errors': self.decodeErrors,
+				'avg_decode_ms': (self.decodeTime / self.framesDecoded * 1000) if self.framesDecoded else 0,
+			}
+
+	def getStatsString(self):
+		"""Get pipeline statistics as a formatted string."""
+		stats = self.getStats()
+		return (
+			f"Queues: decode {stats['decode_queue_depth']} (peak {stats['decode_queue_peak']}), "
+			f"playout {stats['playout_depth']} (peak {stats['playout_peak']}) | "
+			f"Decode: {stats['avg_decode_ms']:.1f} ms | "
+			f"Dropped: {stats['decode_queue_drops']} undecoded, {stats['display_drops']} undisplayed"
+		)
@@ -0,0 +1,216 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from FrameCache import sharedCache
+from Transcoder import sharedTranscoder
+
+METRIC_PREFIX = 'stream_server'
+
+# Per-session counters summed into the server totals: (stats key, metric name, help)
+SESSION_COUNTERS = (
+	('bytes_sent', 'bytes_sent_total', 'RTP bytes sent'),
+	('packets_sent', 'packets_sent_total', 'RTP packets sent'),
+	('fragments_sent', 'fragments_sent_total', 'RTP packets carrying a fragment of a large frame'),
+	('frames_sent', 'frames_sent_total', 'Video frames sent'),
+	('frames_skipped', 'frames_skipped_total', 'Video frames skipped to thin the stream for a lossy client'),
+	('fec_packets_sent', 'fec_packets_sent_total', 'XOR parity packets sent'),
+	('rendition_frames', 'rendition_frames_total', 'Frames sent in a transcoded rendition'),
+	('rendition_misses', 'rendition_misses_total', 'Frames sent as the original because their rendition was not ready'),
+)
+
+# Per-session gauges: (stats key, metric name, help)
+SESSION_GAUGES = (
+	('fps', 'fps', 'Frames sent per second over the last 10 s'),
+	('target_fps', 'target_fps', 'Frame rate the session is paced at'),
+	('bitrate_kbps', 'bitrate_kbps', 'Send bitrate over the last second in Kbps'),
+	('pacer_avg_lag_ms', 'pacer_avg_lag_ms', 'Average lateness of frame sends against their deadline'),
+	('pacer_max_lag_ms', 'pacer_max_lag_ms', 'Worst lateness of a frame send against its deadline'),
+	('clock_resyncs', 'clock_resyncs', 'Times the frame clock was restarted after a stall'),
+	('keep_ratio', 'keep_ratio', 'Share of frames sent after thinning for loss'),
+	('reported_loss_pct', 'reported_loss_pct', 'Frame loss in the latest receiver report'),
+)
+
+# Frame cache counters and gauges: (stats key, metric name, type, help)
+CACHE_METRICS = (
+	('hits', 'cache_hits_total', 'counter', 'Frame cache hits'),
+	('misses', 'cache_misses_total', 'counter', 'Frame cache misses'),
+	('evictions', 'cache_evictions_total', 'counter', 'Frames evicted from the cache'),
+	('entries', 'cache_entries', 'gauge', 'Frames in the cache'),
+	('bytes', 'cache_bytes', 'gauge', 'Bytes held by the cache'),
+	('budget_bytes', 'cache_budget_bytes', 'gauge', 'Memory budget of the cache'),
+)
+
+# Rendition transcoder counters and gauges: (stats key, metric name, type, help)
+TRANSCODER_METRICS = (
+	('transcoded', 'transcodes_total', 'counter', 'Frames transcoded to a lower rendition'),
+	('failed', 'transcode_failures_total', 'counter', 'Frames that could not be transcoded'),
+	('pending', 'transcode_pending', 'gauge', 'Frame transcodes queued or running'),
+)
+
+
+class SessionRegistry:
+	"""Sessions of this server process, for the metrics endpoint.
+
+	Sessions register at SETUP and unregister when they end; the counters
+	of ended sessions are kept in the server totals so those never go
+	backwards. Other components can add server-wide gauges with addGauge().
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.sessions = {}  # id(worker) -> worker
+		self.sessionsTotal = 0
+		self.closedTotals = dict.fromkeys((key for key, _, _ in SESSION_COUNTERS), 0)
+		self.gauges = {}  # name -> (callable, help)
+		self.startTime = time.time()
+
+	def register(self, worker):
+		with self.lock:
+			if id(worker) not in self.sessions:
+				self.sessions[id(worker)] = worker
+				self.sessionsTotal += 1
+
+	def unregister(self, worker):
+		"""Forget a session, keeping its counters in the totals (safe to call twice)."""
+		with self.lock:
+			if self.sessions.pop(id(worker), None) is None:
+				return
+		stats = worker.getSessionStats()
+		with self.lock:
+			for key in self.closedTotals:
+				self.closedTotals[key] += stats[key]
+
+	def addGauge(self, name, fn, help=''):
+		"""Export fn() as a server-wide gauge."""
+		with self.lock:
+			self.gauges[name] = (fn, help)
+
+	def snapshot(self):
+		"""Return server totals, per-session metrics and cache stats as a dictionary."""
+		with self.lock:
+			workers = list(self.sessions.values())
+			totals = dict(self.closedTotals)
+			sessionsTotal = self.sessionsTotal
+			gauges = dict(self.gauges)
+
+		sessions = [worker.getSessionStats() for worker in workers]
+		for session in sessions:
+			for key in totals:
+				totals[key] += session[key]
+		server = {
+			'uptime_seconds': time.time() - self.startTime,
+			'sessions_active': len(sessions),
+			'sessions_playing': sum(1 for session in sessions if session['state'] == 'playing'),
+			'sessions_total': sessionsTotal,
+			'fps': sum(session['fps'] for session in sessions),
+			'bitrate_kbps': sum(session['bitrate_kbps'] for session in sessions),
+		}
+		server.update(totals)
+		for name, (fn, _) in gauges.items():
+			try:
+				server[name] = fn()
+			except Exception as e:
+				print(f"[Metrics] Error reading {name}: {e}")
+		return {
+			'server': server,
+			'sessions': sessions,
+			'cache': sharedCache.getStats() if sharedCache.enabled() else None,
+			'transcoder': sharedTranscoder.getStats() if sharedTranscoder.available() else None,
+		}
+
+	def gaugeHelp(self):
+		with self.lock:
+			return {name: help for name, (_, help) in self.gauges.items()}
+
+
+def _labels(session):
+	def escape(value):
+		return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+	return (f'{{session="{escape(session["session"])}",client="{escape(session["client"])}",'
+	        f'file="{escape(session["file"])}"}}')
+
+
+def formatPrometheus(snapshot, gaugeHelp=None):
+	"""Render a snapshot in the Prometheus text exposition format."""
+	lines = []
+
+	def metric(name, kind, help, samples):
+		name = f'{METRIC_PREFIX}_{name}'
+		lines.append(f'# HELP {name} {help}')
+		lines.append(f'# TYPE {name} {kind}')
+		for labels, value in samples:
+			lines.append(f'{name}{labels} {value}')
+
+	server = snapshot['server']
+	sessions = snapshot['sessions']
+	metric('uptime_seconds', 'gauge', 'Seconds since the server started', [('', server['uptime_seconds'])])
+	metric('sessions_active', 'gauge', 'Sessions set up and not torn down', [('', server['sessions_active'])])
+	metric('sessions_playing', 'gauge', 'Sessions currently streaming', [('', server['sessions_playing'])])
+	metric('sessions_total', 'counter', 'Sessions set up since the server started', [('', server['sessions_total'])])
+	metric('fps', 'gauge', 'Frames sent per second by all sessions over the last 10 s', [('', server['fps'])])
+	metric('bitrate_kbps', 'gauge', 'Send bitrate of all sessions over the last second in Kbps',
+	       [('', server['bitrate_kbps'])])
+	for key, name, help in SESSION_COUNTERS:
+		metric(name, 'counter', f'{help} by all sessions', [('', server[key])])
+	for name, help in (gaugeHelp or {}).items():
+		if name in server:
+			metric(name, 'gauge', help or name, [('', server[name])])
+
+	for key, name, help in SESSION_COUNTERS:
+		metric(f'session_{name}', 'counter', f'{help} by the session',
+		       [(_labels(session), session[key]) for session in sessions])
+	for key, name, help in SESSION_GAUGES:
+		metric(f'session_{name}', 'gauge', help, [(_labels(session), session[key]) for session in sessions])
+
+	cache = snapshot['cache']
+	if cache is not None:
+		for key, name, kind, help in CACHE_METRICS:
+			metric(name, kind, help, [('', cache[key])])
+	transcoder = snapshot['transcoder']
+	if transcoder is not None:
+		for key, name, kind, help in TRANSCODER_METRICS:
+			metric(name, kind, help, [('', transcoder[key])])
+	return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+	"""GET /metrics (Prometheus text) and /metrics.json (JSON)."""
+
+	registry = None
+
+	def do_GET(self):
+		path = self.path.split('?', 1)[0]
+		if path == '/metrics':
+			body = formatPrometheus(self.registry.snapshot(), self.registry.gaugeHelp()).encode()
+			contentType = 'text/plain; version=0.0.4; charset=utf-8'
+		elif path == '/metrics.json':
+			body = json.dumps(self.registry.snapshot(), indent=2).encode()
+			contentType = 'application/json'
+		else:
+			self.send_error(404, "Try /metrics or /metrics.json")
+			return
+		self.send_response(200)
+		self.send_header('Content-Type', contentType)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		# Scrapes every few seconds would flood the server console
+		pass
+
+
+def startMetricsServer(port, registry=None, host='127.0.0.1'):
+	"""Serve the registry's metrics over HTTP from a daemon thread. Return the HTTP server."""
+	handler = type('BoundMetricsHandler', (MetricsHandler,), {'registry': registry or sharedRegistry})
+	httpServer = ThreadingHTTPServer((host, port), handler)
+	httpServer.daemon_threads = True
+	threading.Thread(target=httpServer.serve_forever, name='Metrics', daemon=True).start()
+	print(f"[Metrics] Serving http://{host}:{httpServer.server_address[1]}/metrics and /metrics.json")
+	return httpServer
+
+
+# Registry shared by every session of the server process
+sharedRegistry = SessionRegistry()
@@ -1,119 +1,496 @@
+import math
 import time
 import threading
+import weakref
+
+HISTOGRAM_SUB_BUCKETS = 16  # Per power of two: values are kept within ~3% relative error
+HISTOGRAM_MIN_EXP = -10  # Smallest tracked value ~0.001 (ms)
+HISTOGRAM_MAX_EXP = 20  # Largest tracked value ~1e6 (ms); larger values land in the last bucket
+WINDOW_SLOTS = 60  # One slot per second: rates over the last 1 s / 10 s / 60 s
+RATE_WINDOWS = (1, 10, 60)
+JITTER_GAIN = 1 / 16  # RFC 3550 6.4.1 smoothing factor
+
+
+class LatencyHistogram:
+	"""Fixed-size log-bucket histogram (HDR style) for percentiles.
+
+	Each power of two is split into HISTOGRAM_SUB_BUCKETS linear buckets, so
+	memory is constant and percentiles are exact to a few percent no matter
+	how many values are recorded. Histograms can be merged.
+	"""
+
+	def __init__(self):
+		self.counts = [0] * ((HISTOGRAM_MAX_EXP - HISTOGRAM_MIN_EXP + 1) * HISTOGRAM_SUB_BUCKETS)
+		self.count = 0
+		self.total = 0.0
+		self.min = None
+		self.max = None
+
+	@staticmethod
+	def _bucket(value):
+		if value <= 0:
+			return 0
+		mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+		if exponent < HISTOGRAM_MIN_EXP:
+			return 0
+		if exponent > HISTOGRAM_MAX_EXP:
+			return (HISTOGRAM_MAX_EXP - HISTOGRAM_MIN_EXP + 1) * HISTOGRAM_SUB_BUCKETS - 1
+		return (exponent - HISTOGRAM_MIN_EXP) * HISTOGRAM_SUB_BUCKETS + int((mantissa - 0.5) * 2 * HISTOGRAM_SUB_BUCKETS)
+
+	@staticmethod
+	def _bucketValue(index):
+		"""Return the midpoint of a bucket."""
+		exponent, sub = divmod(index, HISTOGRAM_SUB_BUCKETS)
+		mantissa = 0.5 + (sub + 0.5) / (2 * HISTOGRAM_SUB_BUCKETS)
+		return math.ldexp(mantissa, exponent + HISTOGRAM_MIN_EXP)
+
+	def record(self, value):
+		self.counts[self._bucket(value)] += 1
+		self.count += 1
+		self.total += value
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+
+	def merge(self, other):
+		"""Add the values recorded by another histogram."""
+		for i, count in enumerate(other.counts):
+			if count:
+				self.counts[i] += count
+		self.count += other.count
+		self.total += other.total
+		if other.min is not None:
+			self.min = other.min if self.min is None else min(self.min, other.min)
+			self.max = other.max if self.max is None else max(self.max, other.max)
+
+	def mean(self):
+		return self.total / self.count if self.count else 0
+
+	def percentile(self, pct):
+		"""Return the pct-th percentile, or 0 if nothing was recorded."""
+		if not self.count:
+			return 0
+		rank = max(1, math.ceil(self.count * pct / 100))
+		seen = 0
+		for i, count in enumerate(self.counts):
+			seen += count
+			if seen >= rank:
+				# Clamp the bucket midpoint to the observed range
+				return min(max(self._bucketValue(i), self.min), self.max)
+		return self.max
+
+
+class SlidingWindow:
+	"""Per-second counters in a ring buffer: totals over the last N seconds in fixed memory."""
+
+	def __init__(self, fields, slots=WINDOW_SLOTS + 1):
+		self.fields = fields
+		self.slots = [[0] * len(fields) for _ in range(slots)]
+		self.slotSeconds = [-1] * slots
+
+	def slot(self, now):
+		"""Return the counter list of the current second (one list per second, indexed by field)."""
+		second = int(now)
+		index = second % len(self.slots)
+		slot = self.slots[index]
+		if self.slotSeconds[index] != second:
+			# Slot last used a full revolution ago: start it over
+			self.slotSeconds[index] = second
+			for i in range(len(slot)):
+				slot[i] = 0
+		return slot
+
+	def add(self, now, field, value=1):
+		self.slot(now)[field] += value
+
+	def merge(self, other):
+		"""Add the counters of another window of the same size."""
+		for index, second in enumerate(other.slotSeconds):
+			if second < 0 or second < self.slotSeconds[index]:
+				continue
+			slot = self.slot(second)
+			for i, value in enumerate(other.slots[index]):
+				slot[i] += value
+
+	def rates(self, now, seconds, since=None):
+		"""Return {field: per-second rate} over the last seconds full seconds plus the current one.
+
+		since (the start of counting) shortens the span for young sessions.
+		"""
+		second = int(now)
+		totals = [0] * len(self.fields)
+		for index, slotSecond in enumerate(self.slotSeconds):
+			if second - seconds <= slotSecond <= second:
+				for i, value in enumerate(self.slots[index]):
+					totals[i] += value
+		span = seconds + (now - second)
+		if since is not None:
+			span = min(span, now - since)
+		if span <= 0:
+			return {field: 0.0 for field in self.fields}
+		return {field: totals[i] / span for i, field in enumerate(self.fields)}
+
+
+# Fields of the sliding window, in slot order
+PACKETS_SENT, BYTES_SENT, PACKETS_RECEIVED, BYTES_RECEIVED, FRAMES_SENT, FRAMES_RECEIVED, FRAMES_LOST = range(7)
+WINDOW_FIELDS = ('packets_sent', 'bytes_sent', 'packets_received', 'bytes_received',
+                 'frames_sent', 'frames_received', 'frames_lost')
+
+
+class StatsShard:
+	"""Counters written by a single thread. Only their owner writes them, so no lock is needed."""
+	__slots__ = ('packetsSent', 'packetsReceived', 'bytesSent', 'bytesReceived', 'packetsLost', 'framesSent',
+	             'framesReceived', 'framesLost', 'framesSkipped', 'fragmentsSent', 'fragmentsReceived', 'nacksSent', 'nacksReceived',
+	             'retransmitsSent', 'retransmitsReceived', 'retransmitsSuppressed', 'fecSent', 'fecReceived',
+	             'fecRecovered', 'fragmentsLost', 'reportsSent', 'reportsReceived', 'lastPacketTime',
+	             'latency', 'jitter', 'lastTransit', 'minTransit', 'window', 'owner')
+
+	# Lifetime counters, summed when shards are merged
+	COUNTERS = ('packetsSent', 'packetsReceived', 'bytesSent', 'bytesReceived', 'packetsLost', 'framesSent',
+	            'framesReceived', 'framesLost', 'framesSkipped', 'fragmentsSent', 'fragmentsReceived', 'nacksSent',
+	            'nacksReceived', 'retransmitsSent', 'retransmitsReceived', 'retransmitsSuppressed', 'fecSent',
+	            'fecReceived', 'fecRecovered', 'fragmentsLost', 'reportsSent', 'reportsReceived')
+
+	def __init__(self, owner=None):
+		self.packetsSent = 0
+		self.packetsReceived = 0
+		self.bytesSent = 0
+		self.bytesReceived = 0
+		self.packetsLost = 0
+		self.framesSent = 0
+		self.framesReceived = 0
+		self.framesLost = 0
+		self.framesSkipped = 0  # Thinned out by the sender
+		self.fragmentsSent = 0
+		self.fragmentsReceived = 0
+		self.nacksSent = 0  # Fragments requested
+		self.nacksReceived = 0
+		self.retransmitsSent = 0
+		self.retransmitsReceived = 0
+		self.retransmitsSuppressed = 0  # Requested too late or no longer buffered
+		self.fecSent = 0  # Parity packets
+		self.fecReceived = 0
+		self.fecRecovered = 0  # Fragments rebuilt from parity
+		self.fragmentsLost = 0  # Fragments missing from frames given up on
+		self.reportsSent = 0  # RTCP receiver reports
+		self.reportsReceived = 0
+		self.lastPacketTime = 0.0
+		self.latency = LatencyHistogram()
+		self.jitter = 0.0  # RFC 3550 interarrival jitter (seconds)
+		self.lastTransit = None
+		self.minTransit = None  # Fastest arrival relative to the media clock
+		self.window = SlidingWindow(WINDOW_FIELDS)
+		self.owner = owner  # weakref to the writing thread; None for a merged shard
+
+	def alive(self):
+		if self.owner is None:
+			return True
+		thread = self.owner()
+		return thread is not None and thread.is_alive()
+
+	def merged(self, others):
+		"""Return a new ownerless shard holding this shard's counters plus those of others."""
+		shard = StatsShard()
+		for source in (self,) + tuple(others):
+			for name in self.COUNTERS:
+				setattr(shard, name, getattr(shard, name) + getattr(source, name))
+			shard.latency.merge(source.latency)
+			shard.window.merge(source.window)
+			if source.packetsReceived and source.lastPacketTime >= shard.lastPacketTime:
+				shard.jitter = source.jitter  # Keep the estimate of the stream that received last
+			shard.lastPacketTime = max(shard.lastPacketTime, source.lastPacketTime)
+		return shard
+
 
 class NetworkStats:
-	"""Track network statistics for video streaming."""
-	
+	"""Track network statistics for video streaming.
+
+	Memory is constant: latency goes into a log-bucket histogram, jitter is
+	the RFC 3550 running estimate, and recent rates come from a 60-second
+	ring of per-second counters next to the lifetime totals.
+
+	Recording never takes a lock: each thread writes its own StatsShard and
+	readers merge the shards. Readers may see a packet's counters half
+	updated, which is fine for statistics. On hot paths, record one packet
+	with a single recordSent()/recordReceived() call.
+
+	Each PLAY starts new threads, so shards of threads that have ended are
+	folded into one retired shard; the list stays as long as the number of
+	live recording threads.
+	"""
+
 	def __init__(self):
-		self.lock = threading.Lock()
+		self.lock = threading.Lock()  # Guards the shard list only
 		self.reset()
-		
+
 	def reset(self):
 		"""Reset all statistics."""
 		with self.lock:
-			self.totalPacketsSent = 0
-			self.totalPacketsReceived = 0
-			self.totalBytesSent = 0
-			self.totalBytesReceived = 0
-			self.packetsLost = 0
-			self.framesSent = 0
-			self.framesReceived = 0
-			self.framesLost = 0
-			self.fragmentsSent = 0
-			self.fragmentsReceived = 0
+			# Threads find no shard in the new thread-local and start a fresh one
+			self.local = threading.local()
+			self.shards = []
+			self.retired = None  # Counters of threads that have ended
 			self.startTime = time.time()
-			self.lastPacketTime = time.time()
-			self.latencies = []
-			self.jitters = []
-			self.lastArrivalTime = None
-			self.lastTransitTime = None
-			
+
+	def resetTransit(self):
+		"""Forget the media clock anchor of latency and jitter (call while no packets are recorded, e.g. before PLAY)."""
+		for shard in self._shardList():
+			shard.minTransit = None
+			shard.lastTransit = None
+
+	def _shard(self):
+		"""Return the calling thread's shard."""
+		try:
+			return self.local.shard
+		except AttributeError:
+			shard = StatsShard(weakref.ref(threading.current_thread()))
+			with self.lock:
+				self.local.shard = shard
+				self._retireDeadShards()
+				self.shards.append(shard)
+			return shard
+
+	def _retireDeadShards(self):
+		"""Fold the shards of ended threads into the retired shard (lock held).
+
+		The list is replaced rather than changed in place, so a reader
+		summing an earlier copy never counts a shard twice.
+		"""
+		live, dead = [], []
+		for shard in self.shards:
+			(live if shard.alive() else dead).append(shard)
+		if not dead:
+			return
+		if self.retired is not None:
+			live.remove(self.retired)
+			self.retired = self.retired.merged(dead)
+		else:
+			self.retired = dead[0].merged(dead[1:])
+		self.shards = live + [self.retired]
+
+	def recordSent(self, packetSize, isFragment=False, now=None):
+		"""Record a sent packet (and fragment) with one clock read."""
+		try:
+			shard = self.local.shard
+		except AttributeError:
+			shard = self._shard()
+		if now is None:
+			now = time.time()
+		shard.packetsSent += 1
+		shard.bytesSent += packetSize
+		if isFragment:
+			shard.fragmentsSent += 1
+		shard.lastPacketTime = now
+		slot = shard.window.slot(now)
+		slot[PACKETS_SENT] += 1
+		slot[BYTES_SENT] += packetSize
+
+	def recordReceived(self, packetSize, isFragment=False, mediaTime=None, now=None):
+		"""Record a received packet (and fragment) with one clock read.
+
+		mediaTime is the packet's RTP timestamp in seconds. Sender and receiver
+		clocks are not synchronized, so latency is the transit time above the
+		fastest packet seen: the queuing, pacing and network delay variation.
+		"""
+		try:
+			shard = self.local.shard
+		except AttributeError:
+			shard = self._shard()
+		if now is None:
+			now = time.time()
+		shard.packetsReceived += 1
+		shard.bytesReceived += packetSize
+		if isFragment:
+			shard.fragmentsReceived += 1
+		shard.lastPacketTime = now
+		slot = shard.window.slot(now)
+		slot[PACKETS_RECEIVED] += 1
+		slot[BYTES_RECEIVED] += packetSize
+
+		# Calculate latency if a media timestamp is provided
+		if mediaTime is not None:
+			transit = now - mediaTime
+			if shard.minTransit is None or transit < shard.minTransit:
+				shard.minTransit = transit
+			shard.latency.record((transit - shard.minTransit) * 1000)  # Convert to ms
+
+			# RFC 3550 interarrival jitter: J += (|D| - J) / 16
+			if shard.lastTransit is not None:
+				shard.jitter += (abs(transit - shard.lastTransit) - shard.jitter) * JITTER_GAIN
+			shard.lastTransit = transit
+
 	def recordPacketSent(self, packetSize):
 		"""Record a sent packet."""
-		with self.lock:
-			self.totalPacketsSent += 1
-			self.totalBytesSent += packetSize
-			self.lastPacketTime = time.time()
-	
+		self.recordSent(packetSize)
+
 	def recordFragmentSent(self):
 		"""Record a sent fragment."""
-		with self.lock:
-			self.fragmentsSent += 1
-			
+		self._shard().fragmentsSent += 1
+
 	def recordFrameSent(self):
 		"""Record a sent frame."""
-		with self.lock:
-			self.framesSent += 1
-	
-	def recordPacketReceived(self, packetSize, timestamp=None):
-		"""Record a received packet."""
-		with self.lock:
-			self.totalPacketsReceived += 1
-			self.totalBytesReceived += packetSize
-			
-			# Calculate latency if timestamp provided
-			if timestamp:
-				latency = (time.time() - timestamp) * 1000  # Convert to ms
-				self.latencies.append(latency)
-				
-				# Calculate jitter (variation in latency)
-				if self.lastArrivalTime is not None:
-					arrivalDelta = time.time() - self.lastArrivalTime
-					if self.lastTransitTime is not None:
-						transitDelta = timestamp - self.lastTransitTime
-						jitter = abs(arrivalDelta - transitDelta) * 1000  # ms
-						self.jitters.append(jitter)
-					self.lastTransitTime = timestamp
-				
-				self.lastArrivalTime = time.time()
-	
+		shard = self._shard()
+		shard.framesSent += 1
+		shard.window.add(time.time(), FRAMES_SENT)
+
+	def recordPacketReceived(self, packetSize, mediaTime=None):
+		"""Record a received packet. mediaTime is its RTP timestamp in seconds."""
+		self.recordReceived(packetSize, False, mediaTime)
+
 	def recordFragmentReceived(self):
 		"""Record a received fragment."""
-		with self.lock:
-			self.fragmentsReceived += 1
-			
+		self._shard().fragmentsReceived += 1
+
 	def recordFrameReceived(self):
 		"""Record a received frame."""
-		with self.lock:
-			self.framesReceived += 1
-	
+		shard = self._shard()
+		shard.framesReceived += 1
+		shard.window.add(time.time(), FRAMES_RECEIVED)
+
 	def recordPacketLost(self):
 		"""Record a lost packet."""
+		self._shard().packetsLost += 1
+
+	def recordFrameLost(self, fragments=0):
+		"""Record a lost frame and the number of its fragments that never arrived."""
+		shard = self._shard()
+		shard.framesLost += 1
+		shard.fragmentsLost += fragments
+		shard.window.add(time.time(), FRAMES_LOST)
+
+	def recordFrameSkipped(self, frames=1):
+		"""Record frames the sender skipped to thin the stream."""
+		self._shard().framesSkipped += frames
+
+	def recordReceiverReportSent(self):
+		self._shard().reportsSent += 1
+
+	def recordReceiverReportReceived(self):
+		self._shard().reportsReceived += 1
+
+	def recordNackSent(self, fragments):
+		"""Record a NACK requesting fragments."""
+		self._shard().nacksSent += fragments
+
+	def recordNackReceived(self, fragments):
+		"""Record a NACK requesting fragments."""
+		self._shard().nacksReceived += fragments
+
+	def recordRetransmitSent(self, packetSize):
+		"""Record a resent fragment (also counted as a sent packet)."""
+		self.recordSent(packetSize, True)
+		self._shard().retransmitsSent += 1
+
+	def recordRetransmitReceived(self):
+		"""Record a resent fragment arriving (already counted as a received packet)."""
+		self._shard().retransmitsReceived += 1
+
+	def recordRetransmitSuppressed(self):
+		"""Record a requested fragment that was not resent."""
+		self._shard().retransmitsSuppressed += 1
+
+	def recordFecSent(self):
+		"""Record a parity packet (already counted as a sent packet)."""
+		self._shard().fecSent += 1
+
+	def recordFecReceived(self):
+		"""Record a parity packet arriving (already counted as a received packet)."""
+		self._shard().fecReceived += 1
+
+	def recordFecRecovered(self):
+		"""Record a fragment rebuilt from parity."""
+		self._shard().fecRecovered += 1
+
+	def _shardList(self):
 		with self.lock:
-			self.packetsLost += 1
-	
-	def recordFrameLost(self):
-		"""Record a lost frame."""
-		with self.lock:
-			self.framesLost += 1
-	
+			self._retireDeadShards()
+			return list(self.shards)
+
+	def getWindowRates(self, now=None):
+		"""Get per-second rates over the last 1 s / 10 s / 60 s as a dictionary."""
+		if now is None:
+			now = time.time()
+		shards = self._shardList()
+		windows = {}
+		for seconds in RATE_WINDOWS:
+			rates = dict.fromkeys(WINDOW_FIELDS, 0.0)
+			for shard in shards:
+				for field, rate in shard.window.rates(now, seconds, self.startTime).items():
+					rates[field] += rate
+			windows[f'{seconds}s'] = {
+				'packets_sent_per_sec': rates['packets_sent'],
+				'packets_received_per_sec': rates['packets_received'],
+				'bandwidth_sent_kbps': rates['bytes_sent'] * 8 / 1024,
+				'bandwidth_received_kbps': rates['bytes_received'] * 8 / 1024,
+				'fps_sent': rates['frames_sent'],
+				'fps_received': rates['frames_received'],
+				'frames_lost_per_sec': rates['frames_lost'],
+			}
+		return windows
+
 	def getStats(self):
 		"""Get current statistics as a dictionary."""
-		with self.lock:
-			elapsedTime = time.time() - self.startTime
-			
-			stats = {
-				'packets_sent': self.totalPacketsSent,
-				'packets_received': self.totalPacketsReceived,
-				'packets_lost': self.packetsLost,
-				'bytes_sent': self.totalBytesSent,
-				'bytes_received': self.totalBytesReceived,
-				'frames_sent': self.framesSent,
-				'frames_received': self.framesReceived,
-				'frames_lost': self.framesLost,
-				'fragments_sent': self.fragmentsSent,
-				'fragments_received': self.fragmentsReceived,
-				'elapsed_time': elapsedTime,
-				'bandwidth_sent_kbps': (self.totalBytesSent * 8 / 1024 / elapsedTime) if elapsedTime > 0 else 0,
-				'bandwidth_received_kbps': (self.totalBytesReceived * 8 / 1024 / elapsedTime) if elapsedTime > 0 else 0,
-				'packet_loss_rate': (self.packetsLost / (self.totalPacketsSent if self.totalPacketsSent > 0 else 1)) * 100,
-				'frame_loss_rate': (self.framesLost / (self.framesSent if self.framesSent > 0 else 1)) * 100,
-				'avg_latency_ms': (sum(self.latencies) / len(self.latencies)) if self.latencies else 0,
-				'avg_jitter_ms': (sum(self.jitters) / len(self.jitters)) if self.jitters else 0,
-			}
-			
-			return stats
-	
+		shards = self._shardList()
+		elapsedTime = time.time() - self.startTime
+		latency = LatencyHistogram()
+		for shard in shards:
+			latency.merge(shard.latency)
+
+		def total(name):
+			return sum(getattr(shard, name) for shard in shards)
+
+		packetsSent, bytesSent, bytesReceived = total('packetsSent'), total('bytesSent'), total('bytesReceived')
+		framesSent, framesLost = total('framesSent'), total('framesLost')
+		packetsLost = total('packetsLost')
+		fecSent, fecReceived = total('fecSent'), total('fecReceived')
+		fecRecovered, fragmentsLost = total('fecRecovered'), total('fragmentsLost')
+		# Overhead is parity over data packets, on whichever side is recording
+		fecPackets, dataPackets = (fecSent, packetsSent - fecSent) if fecSent else (
+			fecReceived, total('packetsReceived') - fecReceived)
+		# Jitter is a per-stream estimate: report the shard that received last
+		receiving = max(shards, key=lambda shard: shard.lastPacketTime if shard.packetsReceived else -1, default=None)
+
+		stats = {
+			'packets_sent': packetsSent,
+			'packets_received': total('packetsReceived'),
+			'packets_lost': packetsLost,
+			'bytes_sent': bytesSent,
+			'bytes_received': bytesReceived,
+			'frames_sent': framesSent,
+			'frames_received': total('framesReceived'),
+			'frames_lost': framesLost,
+			'frames_skipped': total('framesSkipped'),
+			'fragments_sent': total('fragmentsSent'),
+			'fragments_received': total('fragmentsReceived'),
+			'nacks_sent': total('nacksSent'),
+			'nacks_received': total('nacksReceived'),
+			'retransmits_sent': total('retransmitsSent'),
+			'retransmits_received': total('retransmitsReceived'),
+			'retransmits_suppressed': total('retransmitsSuppressed'),
+			'fec_packets_sent': fecSent,
+			'fec_packets_received': fecReceived,
+			'fec_recovered': fecRecovered,
+			'fragments_lost': fragmentsLost,
+			'receiver_reports_sent': total('reportsSent'),
+			'receiver_reports_received': total('reportsReceived'),
+			'fec_overhead_pct': (fecPackets / dataPackets * 100) if dataPackets > 0 else 0,
+			'fec_recovery_pct': (fecRecovered / (fecRecovered + fragmentsLost) * 100) if fecRecovered else 0,
+			'elapsed_time': elapsedTime,
+			'bandwidth_sent_kbps': (bytesSent * 8 / 1024 / elapsedTime) if elapsedTime > 0 else 0,
+			'bandwidth_received_kbps': (bytesReceived * 8 / 1024 / elapsedTime) if elapsedTime > 0 else 0,
+			'packet_loss_rate': (packetsLost / (packetsSent if packetsSent > 0 else 1)) * 100,
+			'frame_loss_rate': (framesLost / (framesSent if framesSent > 0 else 1)) * 100,
+			'avg_latency_ms': latency.mean(),
+			'latency_p50_ms': latency.percentile(50),
+			'latency_p95_ms': latency.percentile(95),
+			'latency_p99_ms': latency.percentile(99),
+			'latency_max_ms': latency.max or 0,
+			'avg_jitter_ms': receiving.jitter * 1000 if receiving is not None else 0,
+			'windows': self.getWindowRates(),
+		}
+		return stats
+
 	def printStats(self):
 		"""Print statistics to console."""
 		stats = self.getStats()
@@ -131,23 +508,46 @@ class NetworkStats:
 		print(f"  Received: {stats['frames_received']}")
 		print(f"  Lost: {stats['frames_lost']}")
 		print(f"  Loss Rate: {stats['frame_loss_rate']:.2f}%")
+		if stats['frames_skipped']:
+			print(f"  Skipped: {stats['frames_skipped']} (thinned for loss)")
+		if stats['receiver_reports_sent'] or stats['receiver_reports_received']:
+			print(f"  Receiver Reports: {stats['receiver_reports_sent'] or stats['receiver_reports_received']}")
 		print(f"\nFragments:")
 		print(f"  Sent: {stats['fragments_sent']}")
 		print(f"  Received: {stats['fragments_received']}")
+		if stats['nacks_sent'] or stats['nacks_received']:
+			print(f"\nRetransmission:")
+			print(f"  NACKed: {stats['nacks_sent'] or stats['nacks_received']} fragments")
+			print(f"  Resent: {stats['retransmits_sent'] or stats['retransmits_received']}")
+			print(f"  Suppressed: {stats['retransmits_suppressed']}")
+		if stats['fec_packets_sent'] or stats['fec_packets_received']:
+			print(f"\nForward Error Correction:")
+			print(f"  Parity Packets: {stats['fec_packets_sent'] or stats['fec_packets_received']} "
+			      f"({stats['fec_overhead_pct']:.1f}% overhead)")
+			print(f"  Recovered: {stats['fec_recovered']} fragments, "
+			      f"{stats['fragments_lost']} unrecoverable ({stats['fec_recovery_pct']:.1f}% recovered)")
 		print(f"\nBandwidth:")
 		print(f"  Sent: {stats['bandwidth_sent_kbps']:.2f} Kbps")
 		print(f"  Received: {stats['bandwidth_received_kbps']:.2f} Kbps")
 		print(f"\nLatency:")
 		print(f"  Average: {stats['avg_latency_ms']:.2f} ms")
+		print(f"  p50/p95/p99: {stats['latency_p50_ms']:.2f} / {stats['latency_p95_ms']:.2f} / "
+		      f"{stats['latency_p99_ms']:.2f} ms")
 		print(f"  Jitter: {stats['avg_jitter_ms']:.2f} ms")
+		print(f"\nLast 1s / 10s / 60s:")
+		for name, rates in stats['windows'].items():
+			print(f"  {name}: {rates['fps_sent']:.1f} fps sent, {rates['fps_received']:.1f} fps received, "
+			      f"{max(rates['bandwidth_sent_kbps'], rates['bandwidth_received_kbps']):.0f} Kbps")
 		print("="*60 + "\n")
-	
+
 	def getStatsString(self):
 		"""Get statistics as a formatted string."""
 		stats = self.getStats()
+		recent = stats['windows']['1s']
 		return (
-			f"FPS: {stats['frames_received']}/{stats['elapsed_time']:.1f}s | "
+			f"FPS: {recent['fps_received']:.1f} (1s) | "
 			f"Loss: {stats['frame_loss_rate']:.1f}% | "
-			f"BW: {stats['bandwidth_received_kbps']:.0f} Kbps | "
-			f"Latency: {stats['avg_latency_ms']:.1f}ms"
+			f"BW: {recent['bandwidth_received_kbps']:.0f} Kbps | "
+			f"Latency: {stats['latency_p50_ms']:.1f}ms p50, {stats['latency_p99_ms']:.1f}ms p99 | "
+			f"Jitter: {stats['avg_jitter_ms']:.1f}ms"
 		)
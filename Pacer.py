@@ -0,0 +1,312 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from RtpPacket import DEFAULT_FRAME_RATE
+
+TICK = 0.001  # Timer wheel resolution (seconds)
+WHEEL_SLOTS = 1024  # ~1s horizon per revolution; later deadlines wait extra revolutions
+SEND_SLACK = 0.0005  # Packets due within this window are sent in the same wakeup
+FRAME_BUDGET = 0.9  # Share of the frame interval used to spread a frame's packets
+MAX_FRAMES_BEHIND = 5  # Rebase the frame clock (dropping the frames missed) instead of bursting after a stall
+READER_THREADS = 4  # Threads reading paced streams' frames ahead of their deadlines
+
+
+class FrameClock:
+	"""Drift-free frame deadlines: start + n * interval.
+
+	Deadlines never depend on when the previous frame finished sending, so
+	send time does not accumulate into the frame interval. After a stall
+	the clock restarts, and `missed` counts the frames whose deadlines
+	passed meanwhile, which the session drops to stay on real time.
+	"""
+
+	def __init__(self, frameRate=DEFAULT_FRAME_RATE, start=None):
+		self.interval = 1.0 / frameRate
+		self.start = time.monotonic() if start is None else start
+		self.frameIndex = 0
+		self.resyncs = 0
+		self.missed = 0
+
+	def deadline(self):
+		"""Return the deadline of the next frame."""
+		return self.start + self.frameIndex * self.interval
+
+	def advance(self, now):
+		"""Move to the next frame. Return its deadline."""
+		self.frameIndex += 1
+		deadline = self.deadline()
+		if deadline < now - MAX_FRAMES_BEHIND * self.interval:
+			# Stalled for several frames: restart the clock rather than send a burst
+			self.missed += int((now - deadline) / self.interval)
+			self.start = now
+			self.frameIndex = 0
+			self.resyncs += 1
+			deadline = now
+		return deadline
+
+	def setFrameRate(self, frameRate):
+		"""Change the frame rate from the next frame on."""
+		self.start = self.deadline()
+		self.frameIndex = 0
+		self.interval = 1.0 / frameRate
+
+
+class PacedStream:
+	"""Per-session pacing job: one frame per clock tick, packets spread over the frame budget.
+
+	The session (a ServerWorker) provides nextFramePackets(late) returning a list of
+	packets (anything with len() = wire size) and sendPacket(packet); late
+	is the number of frames the clock missed in a stall, to be dropped. With a target
+	bitrate the packets of a frame are spaced by their serialization time at
+	that rate; either way they are spread evenly and always finish within
+	FRAME_BUDGET of the frame interval.
+
+	With a reader (anything with submit(func, *args), e.g. a FrameReader) the
+	pacing thread only sends: the session's blocking part, prepareFrame(late),
+	runs on a reader thread one frame ahead, and framePackets(frame) turns
+	the frame read into packets when its deadline comes. A read that is
+	not done by then delays only this stream. One read is in flight at a
+	time, so the session's read state is never used by two threads at once.
+	"""
+
+	def __init__(self, session, frameRate=DEFAULT_FRAME_RATE, bitrate=0, start=None, reader=None):
+		self.session = session
+		self.clock = FrameClock(frameRate, start)
+		self.bitrate = bitrate  # Target bits per second, 0 = spread over the frame budget
+		self.pending = deque()
+		self.packetGap = 0.0
+		self.nextPacketTime = 0.0
+		self.frameDeadline = self.clock.deadline()
+		self.cancelled = False
+		# Scheduling lag: how late frames start relative to their deadline
+		self.framesStarted = 0
+		self.totalLag = 0.0
+		self.maxLag = 0.0
+		# Read-ahead: the frame read for the next deadline, once `ready`
+		self.reader = reader
+		self.reading = None  # Future of the read in flight
+		self.ready = False
+		self.frame = None
+		self.stalled = False  # The current deadline is waiting for its read
+		self.readStalls = 0
+		self.missedTaken = 0  # Frames of clock.missed already passed to the session
+		self.lock = threading.Lock()  # No read is started once cancel() returns
+		if reader is not None:
+			self._readAhead()
+
+	def cancel(self):
+		with self.lock:
+			self.cancelled = True
+
+	def finishReading(self):
+		"""Wait for the read in flight (after cancel()). Return the frame read ahead but never sent, or None."""
+		if self.reading is not None:
+			self.reading.result()
+		frame, self.frame = self.frame, None
+		return frame
+
+	def _lateFrames(self):
+		"""Return the frames missed by the clock since the last call."""
+		late = self.clock.missed - self.missedTaken
+		self.missedTaken = self.clock.missed
+		return late
+
+	def _read(self, late):
+		"""Read the next frame (reader thread)."""
+		try:
+			self.frame = self.session.prepareFrame(late)
+		except Exception as e:
+			print(f"[Pacer] Error reading frame: {e}")
+			self.frame = None
+		self.ready = True
+
+	def _readAhead(self, late=0):
+		self.ready = False
+		self.reading = self.reader.submit(self._read, late)
+
+	def _takeFramePackets(self):
+		"""Return the packets of the frame read ahead and start reading the one after it."""
+		with self.lock:
+			if self.cancelled:
+				return []
+			frame, self.frame = self.frame, None
+			self._readAhead(self._lateFrames())
+		return self.session.framePackets(frame) if frame is not None else []
+
+	def setBitrate(self, bitrate):
+		"""Change the target bitrate (bits/s, 0 = spread over the frame budget)."""
+		self.bitrate = bitrate
+
+	def _spread(self, packets):
+		"""Return the gap between packets of a frame."""
+		budget = self.clock.interval * FRAME_BUDGET
+		if len(packets) <= 1:
+			return 0.0
+		gap = budget / len(packets)
+		if self.bitrate > 0:
+			totalBytes = sum(len(packet) for packet in packets)
+			gap = min(gap, totalBytes * 8 / self.bitrate / len(packets))
+		return gap
+
+	def runDue(self, now):
+		"""Send everything due at now. Return the next deadline, or None when cancelled."""
+		if self.cancelled:
+			return None
+
+		if self.pending and now >= self.frameDeadline:
+			# Previous frame overran its budget: flush it before starting the next one
+			while self.pending:
+				self.session.sendPacket(self.pending.popleft())
+
+		if not self.pending and now >= self.frameDeadline:
+			if self.reader is not None and not self.ready:
+				# Frame not read yet: keep the deadline and look again next tick
+				if not self.stalled:
+					self.stalled = True
+					self.readStalls += 1
+				return now + TICK
+			self.stalled = False
+			lag = now - self.frameDeadline
+			self.framesStarted += 1
+			self.totalLag += lag
+			self.maxLag = max(self.maxLag, lag)
+
+			if self.reader is None:
+				packets = self.session.nextFramePackets(self._lateFrames())
+			else:
+				packets = self._takeFramePackets()
+			if packets:
+				self.packetGap = self._spread(packets)
+				self.pending.extend(packets)
+				self.nextPacketTime = now
+			self.frameDeadline = self.clock.advance(now)
+
+		while self.pending and self.nextPacketTime <= now + SEND_SLACK:
+			self.session.sendPacket(self.pending.popleft())
+			self.nextPacketTime += self.packetGap
+
+		if self.cancelled:
+			return None
+		if self.pending:
+			return min(self.nextPacketTime, self.frameDeadline)
+		return self.frameDeadline
+
+	def getStats(self):
+		"""Get pacing statistics as a dictionary."""
+		return {
+			'target_fps': 1.0 / self.clock.interval,
+			'target_bitrate_kbps': self.bitrate / 1000,
+			'avg_lag_ms': (self.totalLag / self.framesStarted * 1000) if self.framesStarted else 0,
+			'max_lag_ms': self.maxLag * 1000,
+			'clock_resyncs': self.clock.resyncs,
+			'frames_missed': self.clock.missed,
+			'read_stalls': self.readStalls,
+		}
+
+
+class FrameReader:
+	"""Threads reading paced streams' frames ahead of their deadlines, started with the first read."""
+
+	def __init__(self, threads=READER_THREADS):
+		self.threads = threads
+		self.executor = None
+		self.lock = threading.Lock()
+
+	def submit(self, func, *args):
+		"""Run func(*args) on a reader thread. Return its Future."""
+		with self.lock:
+			if self.executor is None:
+				self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix='FrameReader')
+		return self.executor.submit(func, *args)
+
+
+class TimerWheel:
+	"""Hashed timer wheel: O(1) scheduling at TICK resolution."""
+
+	def __init__(self, tick=TICK, slots=WHEEL_SLOTS, start=None):
+		self.tick = tick
+		self.slots = [[] for _ in range(slots)]
+		self.epoch = time.monotonic() if start is None else start
+		self.currentTick = 0  # Last tick processed
+		self.count = 0
+
+	def _tickOf(self, deadline):
+		return int((deadline - self.epoch) / self.tick)
+
+	def schedule(self, deadline, job):
+		"""Schedule job at a time.monotonic() deadline."""
+		target = max(self._tickOf(deadline), self.currentTick + 1)
+		self.slots[target % len(self.slots)].append((target, job))
+		self.count += 1
+
+	def advance(self, now):
+		"""Return every job due at or before now."""
+		due = []
+		nowTick = self._tickOf(now)
+		# After a long idle period visit each slot at most once
+		first = max(self.currentTick + 1, nowTick - len(self.slots) + 1)
+		for tick in range(first, nowTick + 1):
+			slot = self.slots[tick % len(self.slots)]
+			if not slot:
+				continue
+			remaining = []
+			for target, job in slot:
+				if target <= nowTick:
+					due.append(job)
+				else:
+					remaining.append((target, job))
+			self.slots[tick % len(self.slots)] = remaining
+		self.currentTick = max(self.currentTick, nowTick)
+		self.count -= len(due)
+		return due
+
+	def nextTickTime(self):
+		"""Return the time of the next tick."""
+		return self.epoch + (self.currentTick + 1) * self.tick
+
+
+class Pacer:
+	"""One thread pacing the packets of every session through a timer wheel."""
+
+	def __init__(self, tick=TICK):
+		self.wheel = TimerWheel(tick)
+		self.cond = threading.Condition()
+		self.thread = None
+
+	def add(self, job):
+		"""Start pacing a job (PacedStream) at its first frame deadline."""
+		with self.cond:
+			self.wheel.schedule(job.frameDeadline, job)
+			if self.thread is None:
+				self.thread = threading.Thread(target=self._run, name='Pacer', daemon=True)
+				self.thread.start()
+			self.cond.notify()
+
+	def _run(self):
+		while True:
+			with self.cond:
+				while self.wheel.count == 0:
+					self.cond.wait()
+				now = time.monotonic()
+				due = self.wheel.advance(now)
+
+			for job in due:
+				try:
+					deadline = job.runDue(now)
+				except Exception as e:
+					print(f"[Pacer] Error in paced stream: {e}")
+					deadline = None
+				if deadline is not None:
+					with self.cond:
+						self.wheel.schedule(deadline, job)
+
+			delay = self.wheel.nextTickTime() - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+
+
+# Pacer and frame readers shared by every threaded session of the server process
+sharedPacer = Pacer()
+sharedReader = FrameReader()
@@ -0,0 +1,122 @@
+import heapq
+import threading
+import time
+
+DEFAULT_PLAYOUT_DELAY = 0.1  # Seconds frames are held past the earliest arrival seen
+RESYNC_LATE_FRAMES = 10  # Consecutive late frames before the playout clock is re-anchored
+DEFAULT_PLAYOUT_FRAMES = 16  # Decoded frames held at most (bounds memory for long delays)
+
+
+class PlayoutClock:
+	"""Maps media time to local presentation time.
+
+	Frame with media time m is presented at m + base + targetDelay, where
+	base is the smallest (arrival - media time) seen: the fastest frame
+	waits targetDelay, slower ones less, so network jitter up to
+	targetDelay is absorbed at a fixed latency cost. When frames keep
+	arriving after their presentation time (a sender stall, clock drift,
+	a backward seek), the clock is re-anchored to the current arrivals.
+	Times are time.monotonic() seconds.
+	"""
+
+	def __init__(self, targetDelay=DEFAULT_PLAYOUT_DELAY):
+		self.targetDelay = targetDelay
+		self.base = None
+		self.lateRun = 0
+		self.lateFrames = 0
+		self.resyncs = 0
+
+	def schedule(self, mediaTime, now=None):
+		"""Return the presentation time of a frame arriving now (in the past when it is late)."""
+		if self.targetDelay <= 0:
+			return 0.0  # Present on arrival
+		if now is None:
+			now = time.monotonic()
+		transit = now - mediaTime
+		if self.base is None or transit < self.base:
+			self.base = transit
+		presentAt = mediaTime + self.base + self.targetDelay
+		if presentAt >= now:
+			self.lateRun = 0
+			return presentAt
+
+		self.lateFrames += 1
+		self.lateRun += 1
+		if self.lateRun >= RESYNC_LATE_FRAMES:
+			self.base = transit
+			self.lateRun = 0
+			self.resyncs += 1
+		return presentAt
+
+	def reset(self):
+		"""Forget the anchor (e.g. after a seek)."""
+		self.base = None
+		self.lateRun = 0
+
+	def getStats(self):
+		return {'target_delay_ms': self.targetDelay * 1000, 'late_frames': self.lateFrames, 'resyncs': self.resyncs}
+
+
+class PlayoutBuffer:
+	"""Decoded frames waiting for their presentation time.
+
+	takeDue() returns the newest frame that is due and drops older due
+	ones, so a late display poll never shows frames out of order. With
+	presentAt = 0 every frame is due at once (present on arrival).
+	"""
+
+	def __init__(self, maxFrames=DEFAULT_PLAYOUT_FRAMES):
+		self.heap = []  # (presentAt, frameNumber, result)
+		self.maxFrames = maxFrames
+		self.lock = threading.Lock()
+		self.lastPresented = -1
+		self.drops = 0
+		self.peakDepth = 0
+
+	def put(self, frameNumber, result, presentAt=0.0):
+		with self.lock:
+			if frameNumber <= self.lastPresented:
+				self.drops += 1
+				return
+			heapq.heappush(self.heap, (presentAt, frameNumber, result))
+			if len(self.heap) > self.maxFrames:
+				# Too far behind: drop the frame due first
+				heapq.heappop(self.heap)
+				self.drops += 1
+			self.peakDepth = max(self.peakDepth, len(self.heap))
+
+	def takeDue(self, now=None):
+		"""Return the newest (frameNumber, result) whose presentation time has come, or None."""
+		if now is None:
+			now = time.monotonic()
+		with self.lock:
+			item = None
+			while self.heap and self.heap[0][0] <= now:
+				_, frameNumber, result = heapq.heappop(self.heap)
+				if frameNumber <= self.lastPresented:
+					self.drops += 1
+					continue
+				if item is not None:
+					self.drops += 1
+				item = (frameNumber, result)
+				self.lastPresented = frameNumber
+			return item
+
+	def nextDue(self):
+		"""Return the presentation time of the next frame, or None when empty."""
+		with self.lock:
+			return self.heap[0][0] if self.heap else None
+
+	def reset(self):
+		"""Drop every held frame and forget the last presented one."""
+		with self.lock:
+			self.drops += len(self.heap)
+			self.heap = []
+			self.lastPresented = -1
+
+	def depth(self):
+		return len(self.heap)
+
+	def getStats(self):
+		with self.lock:
+			return {'depth': len(self.heap), 'peak_depth': self.peakDepth, 'drops': self.drops}
@@ -0,0 +1,98 @@
+from collections import deque
+
+LOSS_HIGH = 0.05  # Loss above which fewer frames are sent
+LOSS_LOW = 0.01  # Loss below which more frames are sent
+DECREASE_FACTOR = 0.75  # Multiplicative decrease of the share of frames sent
+INCREASE_STEP = 0.05  # Additive increase per report
+MIN_KEEP_RATIO = 0.2  # Never send fewer than this share of frames (10 fps at 50 fps)
+MAX_UNREPORTED = 500  # Frames remembered between reports (10 s at 50 fps); older ones are dropped
+FRAME_NUMBER_MASK = 0xFFFF  # Reports name frames by 16-bit RTP sequence number
+
+
+class FrameThinning:
+	"""AIMD control of the share of frames sent to one client, driven by its receiver reports.
+
+	Loss is the larger of what the client reports (frames it started but
+	could not complete) and what the server infers: frames sent up to the
+	client's last frame against the frames it says it received since its
+	previous report, which also catches frames lost whole. Above LOSS_HIGH
+	the share drops by DECREASE_FACTOR (once per two reports, so the client
+	can see the effect); below LOSS_LOW it grows by INCREASE_STEP.
+
+	The session sends frames on a clock slowed to FRAME_RATE * ratio and
+	skips framesToSkip() frames before each one, so playback stays real
+	time and the kept frames are evenly spaced. Reports arrive on the
+	feedback thread; only `ratio` is shared with the pacing thread.
+
+	Sent frames are only tracked once a first report has arrived, and at
+	most MAX_UNREPORTED of them, so a client that never reports costs
+	nothing. Frame numbers are compared as wrapping 16-bit sequence numbers.
+	"""
+
+	def __init__(self, minRatio=MIN_KEEP_RATIO):
+		self.minRatio = minRatio
+		self.ratio = 1.0
+		self.credit = 0.0
+		self.sentFrames = deque(maxlen=MAX_UNREPORTED)  # Frame numbers sent and not yet covered by a report
+		self.lastReceived = None
+		self.holdDecrease = False
+		self.loss = 0.0  # Loss seen in the latest report
+		self.reports = 0
+		self.decreases = 0
+		self.increases = 0
+
+	def reset(self):
+		"""Forget what was sent (e.g. on PLAY): the next report only sets a baseline."""
+		self.credit = 0.0
+		self.sentFrames.clear()
+		self.lastReceived = None
+
+	def framesToSkip(self):
+		"""Return how many frames to skip before sending the next one."""
+		self.credit += 1.0 / self.ratio
+		frames = int(self.credit)
+		self.credit -= frames
+		return frames - 1
+
+	def onFrameSent(self, frameNumber):
+		if self.lastReceived is not None:
+			self.sentFrames.append(frameNumber & FRAME_NUMBER_MASK)
+
+	def onReport(self, report):
+		"""Update the share of frames sent from a ReceiverReport. Return True if it changed."""
+		self.reports += 1
+		sent = 0
+		lastFrame = report.lastFrame & FRAME_NUMBER_MASK
+		# Frames at or before the client's last one, in wrapping sequence order
+		while self.sentFrames and (lastFrame - self.sentFrames[0]) & FRAME_NUMBER_MASK < 0x8000:
+			self.sentFrames.popleft()
+			sent += 1
+		loss = report.fractionLost
+		if self.lastReceived is not None and sent:
+			received = report.framesReceived - self.lastReceived
+			loss = max(loss, 1.0 - min(received, sent) / sent)
+		self.lastReceived = report.framesReceived
+		self.loss = loss
+
+		ratio = self.ratio
+		if loss > LOSS_HIGH:
+			if self.holdDecrease:
+				self.holdDecrease = False
+				return False
+			ratio = max(self.minRatio, ratio * DECREASE_FACTOR)
+			self.holdDecrease = True
+			self.decreases += 1
+		elif loss < LOSS_LOW:
+			ratio = min(1.0, ratio + INCREASE_STEP)
+			self.holdDecrease = False
+			if ratio != self.ratio:
+				self.increases += 1
+		else:
+			self.holdDecrease = False
+		changed = ratio != self.ratio
+		self.ratio = ratio
+		return changed
+
+	def getStats(self):
+		return {'keep_ratio': self.ratio, 'reported_loss_pct': self.loss * 100, 'reports': self.reports,
+		        'decreases': self.decreases, 'increases': self.increases}
@@ -0,0 +1,302 @@
+import time
+from collections import OrderedDict
+
+from RtpPacket import FRAGMENT_FLAG_RETRANSMIT, FRAGMENT_FLAG_PARITY, MAX_FRAME_SIZE
+from Fec import LENGTH_FIELD, recoverPayload
+
+DEFAULT_MAX_IN_FLIGHT = 8  # Frames being reassembled at once
+DEFAULT_FRAME_TIMEOUT = 0.5  # Seconds a partial frame may wait for its missing fragments
+
+
+class PartialFrame:
+	"""One frame being reassembled.
+
+	`fragments` has one slot per fragment holding its payload (a view of
+	the received packet) or None until it arrives; the frame is joined
+	with a single copy when the last slot fills. Copying each fragment into
+	a preallocated buffer instead costs more per packet than the whole join.
+	Parity packets wait in `parity`, keyed by the first index of their
+	group, until one fragment of the group is missing and the rest have
+	arrived.
+	"""
+	__slots__ = ('fragmentId', 'frameNumber', 'totalFragments', 'fragmentSize', 'fragments', 'remaining',
+	             'deadline', 'nextIndex', 'retransmits', 'parity')
+
+	def __init__(self, fragmentId, frameNumber, totalFragments, fragmentSize, deadline):
+		self.fragmentId = fragmentId
+		self.frameNumber = frameNumber
+		self.totalFragments = totalFragments
+		self.fragmentSize = fragmentSize
+		self.fragments = [None] * totalFragments
+		self.remaining = totalFragments  # Counts down to completion
+		self.deadline = deadline
+		self.nextIndex = 0  # Highest index received + 1: indices skipped below it are reported missing
+		self.retransmits = 0
+		self.parity = None  # first index -> (parity payload, group size), allocated with the first parity packet
+
+	def has(self, index):
+		return self.fragments[index] is not None
+
+	def fragment(self, index):
+		"""Return a received fragment."""
+		return self.fragments[index]
+
+	def missing(self):
+		"""Return the indices of the fragments not received yet."""
+		return [i for i, fragment in enumerate(self.fragments) if fragment is None]
+
+	def bufferedBytes(self):
+		return sum(len(fragment) for fragment in self.fragments if fragment is not None)
+
+	def take(self):
+		"""Return the reassembled frame."""
+		return b''.join(self.fragments)
+
+
+class Reassembler:
+	"""Fragment reassembly with bounded memory.
+
+	At most maxInFlight frames are buffered; starting another evicts the
+	oldest. Partial frames are dropped once their deadline passes (checked
+	when a new frame starts, or by calling expire()) or a newer frame
+	completes, so a burst of loss cannot leak buffers.
+
+	With onMissing(frame, indices), fragments are reported missing as soon
+	as a higher index of the same frame arrives (fragments are sent in
+	order), and a frame's missing tail when a newer frame starts, so they
+	can be NACKed while the frame is still in flight.
+
+	Parity packets (FRAGMENT_FLAG_PARITY) rebuild the one missing fragment
+	of their group as soon as the rest of the group is in; a parity packet
+	arriving after its frame completed is simply counted as unused.
+	"""
+
+	def __init__(self, maxInFlight=DEFAULT_MAX_IN_FLIGHT, timeout=DEFAULT_FRAME_TIMEOUT, stats=None, onMissing=None):
+		self.maxInFlight = maxInFlight
+		self.timeout = timeout
+		self.stats = stats  # Optional NetworkStats: lost frames are recorded there
+		self.onMissing = onMissing
+		self.frames = OrderedDict()  # fragment_id -> PartialFrame, oldest first
+		self.lastFrameNumber = -1  # Newest frame completed
+		self.framesCompleted = 0
+		self.framesExpired = 0
+		self.framesEvicted = 0
+		self.framesSuperseded = 0
+		self.duplicates = 0
+		self.invalid = 0
+		self.late = 0
+		self.framesRecovered = 0  # Completed thanks to retransmitted fragments
+		self.retransmitsUsed = 0
+		self.fecRecovered = 0  # Fragments rebuilt from parity
+		self.parityUnused = 0
+
+	def pushPacket(self, rtpPacket, now=None, frameNumber=None):
+		"""Add a decoded fragmented RtpPacket. Return (frameNumber, frame) when a frame completes, else None.
+
+		frameNumber is the packet's sequence number extended past 16 bits
+		(SequenceUnwrapper); without it the raw sequence number is used.
+
+		This runs for every packet: the usual data fragment takes one dict
+		lookup, one byte test and one copy.
+		"""
+		fragmentId, totalFragments, fragmentIndex, fragmentSize, flags, groupSize = rtpPacket.fragmentFields
+		payload = rtpPacket.payload
+		if frameNumber is None:
+			frameNumber = rtpPacket.fields[2]
+		if flags and flags & FRAGMENT_FLAG_PARITY:
+			return self._pushParity(fragmentId, frameNumber, totalFragments, fragmentIndex, fragmentSize, payload,
+			                        now, groupSize)
+		frame = self.frames.get(fragmentId)
+		if frame is None:
+			# Frames still buffered are all newer than the last one completed (older ones are dropped)
+			if frameNumber <= self.lastFrameNumber:
+				self.late += 1
+				return None
+			frame = self._start(fragmentId, frameNumber, totalFragments, fragmentSize, now)
+			if frame is None:
+				return None
+		elif frame.fragmentSize != fragmentSize:
+			self.invalid += 1
+			return None
+
+		# The frame's fragment count (from its first packet) bounds the index: past the end raises IndexError
+		fragments = frame.fragments
+		try:
+			if fragments[fragmentIndex] is not None:
+				self.duplicates += 1
+				return None
+		except IndexError:
+			self.invalid += 1
+			return None
+		# Every fragment but the last is exactly fragmentSize long
+		if len(payload) != fragmentSize and (len(payload) > fragmentSize or fragmentIndex != frame.totalFragments - 1):
+			self.invalid += 1
+			return None
+		fragments[fragmentIndex] = payload
+		remaining = frame.remaining = frame.remaining - 1
+		if self.onMissing is not None and fragmentIndex >= frame.nextIndex:
+			if fragmentIndex > frame.nextIndex:
+				self.onMissing(frame, range(frame.nextIndex, fragmentIndex))
+			frame.nextIndex = fragmentIndex + 1
+		if flags and flags & FRAGMENT_FLAG_RETRANSMIT:
+			frame.retransmits += 1
+			self.retransmitsUsed += 1
+		if not remaining:
+			return self._complete(frame)
+		if frame.parity:
+			# Fragments arriving after their group's parity (reordering, retransmits)
+			for firstIndex, (_, groupSize) in frame.parity.items():
+				if firstIndex <= fragmentIndex < firstIndex + groupSize:
+					self._recover(frame, firstIndex)
+					if not frame.remaining:
+						return self._complete(frame)
+					break
+		return None
+
+	def _pushParity(self, fragmentId, frameNumber, totalFragments, firstIndex, fragmentSize, payload, now, groupSize):
+		"""Keep a parity packet and rebuild its group's missing fragment if it can."""
+		if frameNumber <= self.lastFrameNumber:
+			# Every fragment of the group arrived: the usual case
+			self.parityUnused += 1
+			return None
+		if (groupSize <= 0 or firstIndex + groupSize > totalFragments
+		        or len(payload) != fragmentSize + LENGTH_FIELD.size):
+			self.invalid += 1
+			return None
+
+		frame = self.frames.get(fragmentId)
+		if frame is None:
+			# Every data fragment received so far was lost
+			frame = self._start(fragmentId, frameNumber, totalFragments, fragmentSize, now)
+			if frame is None:
+				return None
+		elif frame.totalFragments != totalFragments or frame.fragmentSize != fragmentSize:
+			self.invalid += 1
+			return None
+		if frame.parity is None:
+			frame.parity = {}
+		frame.parity[firstIndex] = (bytes(payload), groupSize)
+		self._recover(frame, firstIndex)
+		if frame.remaining:
+			return None
+		return self._complete(frame)
+
+	def _recover(self, frame, firstIndex):
+		"""Rebuild the fragment missing from a group whose parity has arrived."""
+		entry = frame.parity.get(firstIndex)
+		if entry is None:
+			return
+		parity, groupSize = entry
+		group = range(firstIndex, firstIndex + groupSize)
+		missing = [i for i in group if not frame.has(i)]
+		if len(missing) != 1:
+			if not missing:
+				del frame.parity[firstIndex]
+			return  # Complete, or more lost than one parity packet can rebuild
+		index = missing[0]
+		try:
+			payload = recoverPayload(parity, [frame.fragment(i) for i in group if i != index], frame.fragmentSize)
+		except ValueError:
+			self.invalid += 1
+			del frame.parity[firstIndex]
+			return
+		del frame.parity[firstIndex]
+		if len(payload) != frame.fragmentSize and index != frame.totalFragments - 1:
+			self.invalid += 1
+			return
+
+		frame.fragments[index] = payload
+		frame.remaining -= 1
+		if index >= frame.nextIndex:
+			frame.nextIndex = index + 1
+		self.fecRecovered += 1
+		if self.stats is not None:
+			self.stats.recordFecRecovered()
+
+	def _start(self, fragmentId, frameNumber, totalFragments, fragmentSize, now):
+		"""Allocate a new partial frame, making room for it. Return None if its header is invalid."""
+		if not self._valid(totalFragments, fragmentSize):
+			self.invalid += 1
+			return None
+		# Deadlines are checked once per new frame rather than once per packet
+		if now is None:
+			now = time.monotonic()
+		self.expire(now)
+		if self.onMissing is not None:
+			self._reportTails(frameNumber)
+		frames = self.frames
+		while len(frames) >= self.maxInFlight:
+			self._recordLost(frames.popitem(last=False)[1])
+			self.framesEvicted += 1
+		frame = PartialFrame(fragmentId, frameNumber, totalFragments, fragmentSize, now + self.timeout)
+		frames[fragmentId] = frame
+		return frame
+
+	def _complete(self, frame):
+		del self.frames[frame.fragmentId]
+		self.framesCompleted += 1
+		if frame.retransmits:
+			self.framesRecovered += 1
+		self.lastFrameNumber = frame.frameNumber
+		self._dropOlderThan(frame.frameNumber)
+		return frame.frameNumber, frame.take()
+
+	def _valid(self, totalFragments, fragmentSize):
+		"""Check the header of a new frame before allocating its buffer."""
+		return (totalFragments > 0 and fragmentSize > 0
+		        and (totalFragments - 1) * fragmentSize < MAX_FRAME_SIZE)
+
+	def _reportTails(self, frameNumber):
+		"""Report the missing last fragments of frames older than a frame that just started."""
+		for frame in self.frames.values():
+			if frame.frameNumber < frameNumber and frame.nextIndex < frame.totalFragments:
+				self.onMissing(frame, range(frame.nextIndex, frame.totalFragments))
+				frame.nextIndex = frame.totalFragments
+
+	def _recordLost(self, frame):
+		if self.stats is not None:
+			self.stats.recordFrameLost(frame.remaining)
+
+	def _dropOlderThan(self, frameNumber):
+		"""Drop partial frames superseded by a newer complete frame."""
+		stale = [fid for fid, frame in self.frames.items() if frame.frameNumber < frameNumber]
+		for fid in stale:
+			self._recordLost(self.frames.pop(fid))
+			self.framesSuperseded += 1
+
+	def expire(self, now):
+		"""Drop partial frames whose deadline has passed."""
+		# Frames are created in arrival order with a fixed timeout, so the oldest expires first
+		while self.frames:
+			frame = next(iter(self.frames.values()))
+			if frame.deadline > now:
+				break
+			self._recordLost(self.frames.popitem(last=False)[1])
+			self.framesExpired += 1
+
+	def reset(self):
+		"""Drop every partial frame without counting it as lost (e.g. after a seek)."""
+		self.frames.clear()
+		self.lastFrameNumber = -1
+
+	def bufferedBytes(self):
+		"""Return the memory held by partial frames."""
+		return sum(frame.bufferedBytes() for frame in self.frames.values())
+
+	def getStats(self):
+		"""Get reassembly counters as a dictionary."""
+		return {
+			'in_flight': len(self.frames),
+			'buffered_bytes': self.bufferedBytes(),
+			'completed': self.framesCompleted,
+			'expired': self.framesExpired,
+			'evicted': self.framesEvicted,
+			'superseded': self.framesSuperseded,
+			'duplicates': self.duplicates,
+			'invalid': self.invalid,
+			'late': self.late,
+			'recovered': self.framesRecovered,
+			'retransmits_used': self.retransmitsUsed,
+			'fec_recovered': self.fecRecovered,
+			'parity_unused': self.parityUnused,
+		}
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+DEFAULT_RETRANSMIT_FRAMES = 16  # Recently sent frames kept for retransmission
+DEFAULT_RETRANSMIT_DEADLINE = 0.15  # Seconds after sending a frame that a resend can still be played out
+
+
+class RetransmitBuffer:
+	"""Bounded ring of the fragment packets of recently sent frames.
+
+	Frames are stored whole, keyed by fragment id, with the time they were
+	packetized; packets are PendingPackets whose payloads are slices of the
+	frame, so memory is bounded by maxFrames frames. A fragment is only
+	resent while its frame is younger than the deadline: after that the
+	client would play it out too late to help.
+	"""
+
+	def __init__(self, maxFrames=DEFAULT_RETRANSMIT_FRAMES, deadline=DEFAULT_RETRANSMIT_DEADLINE):
+		self.maxFrames = maxFrames
+		self.deadline = deadline
+		self.frames = OrderedDict()  # fragment_id -> (sent time, packets), oldest first
+		self.resent = 0
+		self.expired = 0
+		self.unknown = 0
+
+	def addFrame(self, fragmentId, packets, now):
+		"""Keep the packets of a fragmented frame just handed to the pacer."""
+		self.frames[fragmentId] = (now, packets)
+		self.frames.move_to_end(fragmentId)
+		while len(self.frames) > self.maxFrames:
+			self.frames.popitem(last=False)
+
+	def lookup(self, fragmentId, index, now):
+		"""Return the packet to resend, or None if it is unknown or past its deadline."""
+		entry = self.frames.get(fragmentId)
+		if entry is None or index >= len(entry[1]):
+			self.unknown += 1
+			return None
+		if now - entry[0] > self.deadline:
+			self.expired += 1
+			return None
+		self.resent += 1
+		return entry[1][index]
+
+	def clear(self):
+		self.frames.clear()
+
+	def getStats(self):
+		return {'frames': len(self.frames), 'resent': self.resent, 'expired': self.expired, 'unknown': self.unknown}
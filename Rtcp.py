@@ -0,0 +1,143 @@
+import struct
+
+# RTCP feedback carried on the RTP port (RTP/RTCP multiplexing, RFC 5761):
+# the client sends from its RTP port to the server's RTP source address, and
+# the second byte (RTCP packet type 192-223) tells it apart from RTP.
+RTCP_VERSION = 2
+PT_RR = 201  # Receiver report (RFC 3550)
+PT_APP = 204  # Application-defined
+PT_RTPFB = 205  # Transport layer feedback (RFC 4585)
+
+# Fragment NACK: an RTPFB message with an application-chosen FMT, since the
+# RTP sequence number of this stream is the frame number and cannot name a
+# fragment. Each FCI entry asks for fragment `index` of frame `fragment_id`
+# plus those of the 16 following indices whose bit is set in `blp`:
+#   fragment_id(16) | index(16) | blp(16) | reserved(16)
+FMT_FRAGMENT_NACK = 15
+
+RTCP_FEEDBACK_HEADER = struct.Struct('!BBHII')  # V/P/FMT, PT, length in words - 1, sender SSRC, media SSRC
+NACK_ENTRY = struct.Struct('!HHHH')
+MAX_NACK_ENTRIES = 128  # Keeps a NACK under 1100 bytes
+
+# Receiver report: a compound packet of an RR with one report block and an
+# APP packet named 'RXQA' with what the RR cannot carry. Sequence numbers of
+# this stream are frame numbers, so the report block counts frames:
+#   RR:  V/P/RC=1 | PT=201 | length | reporter SSRC
+#        media SSRC | fraction lost(8) cumulative frames lost(24)
+#        last frame number | jitter (90 kHz units) | LSR = 0 | DLSR = 0
+#   APP: V/P/subtype=0 | PT=204 | length | reporter SSRC | 'RXQA'
+#        frames received | achieved fps * 1000
+RR_HEADER = struct.Struct('!BBHI')  # V/P/RC, PT, length in words - 1, reporter SSRC
+REPORT_BLOCK = struct.Struct('!IIIIII')  # SSRC, fraction/cumulative lost, highest seq, jitter, LSR, DLSR
+APP_HEADER = struct.Struct('!BBHI4s')  # V/P/subtype, PT, length in words - 1, SSRC, name
+RECEIVER_QUALITY = struct.Struct('!II')
+APP_NAME_QUALITY = b'RXQA'
+JITTER_CLOCK_RATE = 90000  # Jitter is reported in media clock units
+
+
+def isRtcp(data):
+	"""Tell an RTCP packet from an RTP packet arriving on the same port."""
+	return len(data) >= RTCP_FEEDBACK_HEADER.size and data[0] >> 6 == RTCP_VERSION and 192 <= data[1] <= 223
+
+
+def packetType(data):
+	"""Return (packet type, FMT/count field) of an RTCP packet."""
+	return data[1], data[0] & 0x1F
+
+
+def nackEntries(fragmentId, indices):
+	"""Compress missing fragment indices of one frame into (fragment_id, index, blp) entries."""
+	entries = []
+	for index in sorted(indices):
+		if entries and entries[-1][0] == fragmentId and 0 < index - entries[-1][1] <= 16:
+			fid, first, blp = entries[-1]
+			entries[-1] = (fid, first, blp | (1 << (index - first - 1)))
+		else:
+			entries.append((fragmentId, index, 0))
+	return entries
+
+
+def expandNackEntries(entries):
+	"""Yield every (fragment_id, index) requested by NACK entries."""
+	for fragmentId, index, blp in entries:
+		yield fragmentId, index
+		for bit in range(16):
+			if blp & (1 << bit):
+				yield fragmentId, index + bit + 1
+
+
+def encodeNack(entries, senderSsrc=0, mediaSsrc=0):
+	"""Encode a fragment NACK carrying up to MAX_NACK_ENTRIES entries."""
+	entries = entries[:MAX_NACK_ENTRIES]
+	length = (RTCP_FEEDBACK_HEADER.size + NACK_ENTRY.size * len(entries)) // 4 - 1
+	packet = bytearray(RTCP_FEEDBACK_HEADER.pack((RTCP_VERSION << 6) | FMT_FRAGMENT_NACK, PT_RTPFB, length,
+	                                             senderSsrc, mediaSsrc))
+	for fragmentId, index, blp in entries:
+		packet += NACK_ENTRY.pack(fragmentId & 0xFFFF, index, blp, 0)
+	return bytes(packet)
+
+
+class ReceiverReport:
+	"""What a receiver saw since its previous report."""
+	__slots__ = ('fractionLost', 'framesLost', 'lastFrame', 'jitter', 'framesReceived', 'fps')
+
+	def __init__(self, fractionLost, framesLost, lastFrame, jitter, framesReceived, fps):
+		self.fractionLost = fractionLost  # Share of frames started but never completed (0..1)
+		self.framesLost = framesLost  # Cumulative
+		self.lastFrame = lastFrame  # Newest frame delivered
+		self.jitter = jitter  # Seconds
+		self.framesReceived = framesReceived  # Cumulative
+		self.fps = fps  # Frames delivered per second since the previous report
+
+
+def encodeReceiverReport(report, senderSsrc=0, mediaSsrc=0):
+	"""Encode a ReceiverReport as an RR + APP compound packet."""
+	fraction = min(int(report.fractionLost * 256), 255)
+	packet = bytearray(RR_HEADER.pack((RTCP_VERSION << 6) | 1, PT_RR,
+	                                  (RR_HEADER.size + REPORT_BLOCK.size) // 4 - 1, senderSsrc))
+	packet += REPORT_BLOCK.pack(mediaSsrc, (fraction << 24) | min(report.framesLost, 0xFFFFFF),
+	                            report.lastFrame & 0xFFFFFFFF, int(report.jitter * JITTER_CLOCK_RATE) & 0xFFFFFFFF,
+	                            0, 0)
+	packet += APP_HEADER.pack(RTCP_VERSION << 6, PT_APP, (APP_HEADER.size + RECEIVER_QUALITY.size) // 4 - 1,
+	                          senderSsrc, APP_NAME_QUALITY)
+	packet += RECEIVER_QUALITY.pack(report.framesReceived & 0xFFFFFFFF, int(report.fps * 1000) & 0xFFFFFFFF)
+	return bytes(packet)
+
+
+def decodeReceiverReport(data):
+	"""Decode an RR + APP compound packet. Return a ReceiverReport.
+
+	Raises ValueError for other packets or a truncated message.
+	"""
+	try:
+		first, pt, length, _ = RR_HEADER.unpack_from(data)
+		if pt != PT_RR or first & 0x1F < 1:
+			raise ValueError(f"Not a receiver report (PT {pt}, RC {first & 0x1F})")
+		_, lost, lastFrame, jitter, _, _ = REPORT_BLOCK.unpack_from(data, RR_HEADER.size)
+		offset = (length + 1) * 4
+		_, pt, _, _, name = APP_HEADER.unpack_from(data, offset)
+		if pt != PT_APP or name != APP_NAME_QUALITY:
+			raise ValueError(f"Receiver report without quality block (PT {pt})")
+		framesReceived, fps = RECEIVER_QUALITY.unpack_from(data, offset + APP_HEADER.size)
+	except struct.error as e:
+		raise ValueError(f"Truncated RTCP packet: {e}")
+	return ReceiverReport((lost >> 24) / 256, lost & 0xFFFFFF, lastFrame, jitter / JITTER_CLOCK_RATE,
+	                      framesReceived, fps / 1000)
+
+
+def decodeNack(data):
+	"""Decode a fragment NACK. Return its (fragment_id, index, blp) entries.
+
+	Raises ValueError for other packets or a truncated message.
+	"""
+	try:
+		first, pt, length, _, _ = RTCP_FEEDBACK_HEADER.unpack_from(data)
+	except struct.error as e:
+		raise ValueError(f"Truncated RTCP packet: {e}")
+	if pt != PT_RTPFB or first & 0x1F != FMT_FRAGMENT_NACK:
+		raise ValueError(f"Not a fragment NACK (PT {pt}, FMT {first & 0x1F})")
+	end = (length + 1) * 4
+	if end > len(data):
+		raise ValueError("Truncated RTCP packet")
+	return [NACK_ENTRY.unpack_from(data, offset)[:3]
+	        for offset in range(RTCP_FEEDBACK_HEADER.size, end, NACK_ENTRY.size)]
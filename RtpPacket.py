@@ -1,128 +1,328 @@
-import sys
-from time import time
+import struct
+
 HEADER_SIZE = 12
-FRAGMENT_HEADER_SIZE = 4  # Fragment header: fragment_id(2) + total_fragments(1) + fragment_index(1)
+RTP_VERSION = 2
+PT_MJPEG = 26
+MEDIA_CLOCK_RATE = 90000  # RTP timestamp units per second for video (RFC 3551)
+DEFAULT_FRAME_RATE = 50  # Frames per second the server paces streams at and receivers assume
+MAX_FRAME_SIZE = 5000000  # Sanity limit for HD frames (5MB)
+EXTENSION_BIT = 0x10  # X bit in the first header byte
+
+# Fragmentation header, carried as an RTP header extension (RFC 3550 5.3.1) and
+# signalled by the X bit, so it is never guessed from payload bytes:
+#   profile 'FR'(16) | length in words = 3 (16)
+#   version(8) | flags(8) | fragment_id(16)
+#   total_fragments(16) | fragment_index(16)
+#   fragment_size(16) | group_size(16)
+# fragment_size is the payload size of every fragment but the last, so a
+# fragment's offset in the frame is fragment_index * fragment_size.
+# Flags: FRAGMENT_FLAG_RETRANSMIT marks a fragment resent after a NACK;
+# FRAGMENT_FLAG_PARITY marks an XOR parity packet over the group_size data
+# fragments starting at fragment_index (group_size is 0 on data fragments).
+FRAGMENT_EXT_PROFILE = 0x4652
+FRAGMENT_EXT_VERSION = 1
+FRAGMENT_EXT_WORDS = 3
+FRAGMENT_HEADER_SIZE = 4 + FRAGMENT_EXT_WORDS * 4
+MAX_FRAGMENTS = 0xFFFF
+FRAGMENT_FLAG_RETRANSMIT = 0x01
+FRAGMENT_FLAG_PARITY = 0x02
+
+# Precompiled codecs (network byte order)
+RTP_HEADER = struct.Struct('!BBHII')  # V/P/X/CC, M/PT, sequence number, timestamp, SSRC
+RTP_HEADER_VARIABLE = struct.Struct('!BBHI')  # V/P/X/CC, M/PT, sequence number, timestamp (bytes 0-7)
+RTP_SEQUENCE = struct.Struct('!H')  # Sequence number (bytes 2-3)
+RTP_SSRC = struct.Struct('!I')  # SSRC (bytes 8-11)
+EXTENSION_HEADER = struct.Struct('!HH')  # profile-defined id, length in 32-bit words
+FRAGMENT_HEADER = struct.Struct('!HHBBHHHHH')  # ext header + version, flags, id, total, index, size, group size
+
+def mediaTimestamp(frameNumber, frameRate=DEFAULT_FRAME_RATE):
+	"""Return the 90 kHz RTP timestamp of a frame (frame 1 is at media time 0)."""
+	return int(round((frameNumber - 1) * MEDIA_CLOCK_RATE / frameRate)) & 0xFFFFFFFF
+
+def fragmentPackets(data, seqnum, timestamp, fragmentId, fragmentSize):
+	"""Split a frame into PendingPackets whose payloads are fragmentSize-byte slices of it (no copies)."""
+	view = memoryview(data)
+	totalFragments = (len(data) + fragmentSize - 1) // fragmentSize
+	return [PendingPacket(view[start:start + fragmentSize], seqnum, timestamp, fragmentId, totalFragments, i,
+	                      fragmentSize)
+	        for i, start in enumerate(range(0, len(data), fragmentSize))]
+
+class TimestampUnwrapper:
+	"""Extend 32-bit RTP timestamps into a monotonic media clock across wraparound (~13 h at 90 kHz)."""
+	__slots__ = ('last', 'extended')
+
+	def __init__(self):
+		self.last = None
+		self.extended = 0
+
+	def unwrap(self, timestamp):
+		"""Return the extended timestamp (may go back for reordered packets)."""
+		if self.last is None:
+			self.extended = timestamp
+		else:
+			delta = (timestamp - self.last) & 0xFFFFFFFF
+			if delta >= 0x80000000:
+				delta -= 0x100000000
+			self.extended += delta
+		self.last = timestamp
+		return self.extended
+
+	def seconds(self, timestamp):
+		"""Return the extended timestamp in seconds of media time."""
+		return self.unwrap(timestamp) / MEDIA_CLOCK_RATE
+
+
+class SequenceUnwrapper:
+	"""Extend 16-bit RTP sequence numbers (frame numbers) into a counter that keeps growing past 65535.
+
+	The first number is extended to the value closest to `reference`, the
+	frame the stream is expected to start at (e.g. the frame a seek asked for).
+	"""
+	__slots__ = ('last', 'extended', 'reference')
+
+	def __init__(self, reference=0):
+		self.last = None
+		self.extended = 0
+		self.reference = reference
+
+	def unwrap(self, seqnum):
+		"""Return the extended sequence number (may go back for reordered packets)."""
+		if self.last is None:
+			extended = self.reference + ((seqnum - self.reference + 0x8000) & 0xFFFF) - 0x8000
+			self.extended = extended if extended >= 0 else extended + 0x10000
+		else:
+			delta = (seqnum - self.last) & 0xFFFF
+			if delta >= 0x8000:
+				delta -= 0x10000
+			self.extended += delta
+		self.last = seqnum
+		return self.extended
+
+class PendingPacket:
+	"""Header fields and payload slice of an RTP packet waiting to be sent.
+
+	The header is only written at send time, into a buffer reused for every
+	packet, and the payload stays a slice of the frame.
+	"""
+	__slots__ = ('payload', 'seqnum', 'timestamp', 'marker', 'fragment_id', 'total_fragments', 'fragment_index',
+	             'fragment_size', 'flags', 'group_size')
+
+	def __init__(self, payload, seqnum, timestamp, fragment_id=0, total_fragments=1, fragment_index=0, fragment_size=0,
+	             flags=0, group_size=0):
+		self.payload = payload
+		self.seqnum = seqnum
+		self.timestamp = timestamp
+		self.marker = 1 if (fragment_index == total_fragments - 1) else 0  # Set marker on last fragment
+		self.fragment_id = fragment_id
+		self.total_fragments = total_fragments
+		self.fragment_index = fragment_index
+		self.fragment_size = fragment_size
+		self.flags = flags
+		self.group_size = group_size
+		if flags & FRAGMENT_FLAG_PARITY:
+			self.marker = 0  # Only the last data fragment ends the frame
+
+	def __len__(self):
+		"""Return the size of the packet on the wire."""
+		return self.headerSize() + len(self.payload)
+
+	def headerSize(self):
+		return HEADER_SIZE + FRAGMENT_HEADER_SIZE if self.total_fragments > 1 else HEADER_SIZE
+
+	def isFragment(self):
+		return self.total_fragments > 1
+
+class SharedPacket:
+	"""RTP packet written once and sent to every subscriber of a broadcast channel.
+
+	The header is complete (written by the channel's template); each
+	subscriber only patches in its own sequence number and SSRC with
+	RtpHeaderTemplate.copy(). seqnum is the channel's frame counter.
+	"""
+	__slots__ = ('header', 'payload', 'seqnum', 'marker', 'flags', 'isFragment')
+
+	def __init__(self, header, packet):
+		self.header = header
+		self.payload = packet.payload
+		self.seqnum = packet.seqnum
+		self.marker = packet.marker
+		self.flags = packet.flags
+		self.isFragment = packet.total_fragments > 1
+
+	def __len__(self):
+		"""Return the size of the packet on the wire."""
+		return len(self.header) + len(self.payload)
+
+class RtpHeaderTemplate:
+	"""Prebuilt per-session RTP header: only marker, seq, timestamp and fragment fields are patched."""
+	__slots__ = ('buffer', 'view', 'rtpHeader', 'firstByte', 'pt', 'ssrc')
+
+	def __init__(self, pt=PT_MJPEG, ssrc=0, version=RTP_VERSION, padding=0, cc=0):
+		self.buffer = bytearray(HEADER_SIZE + FRAGMENT_HEADER_SIZE)
+		self.view = memoryview(self.buffer)
+		self.rtpHeader = self.view[:HEADER_SIZE]
+		self.firstByte = (version << 6) | (padding << 5) | cc
+		self.pt = pt
+		self.ssrc = ssrc
+		RTP_HEADER.pack_into(self.buffer, 0, self.firstByte, pt, 0, 0, ssrc)
+		FRAGMENT_HEADER.pack_into(self.buffer, HEADER_SIZE, FRAGMENT_EXT_PROFILE, FRAGMENT_EXT_WORDS,
+		                          FRAGMENT_EXT_VERSION, 0, 0, 0, 0, 0, 0)
+
+	def write(self, seqnum, timestamp, marker, fragment_id=0, total_fragments=1, fragment_index=0, fragment_size=0, flags=0,
+	          group_size=0):
+		"""Patch the variable fields. Return a memoryview of the header to send."""
+		if total_fragments > 1:
+			RTP_HEADER_VARIABLE.pack_into(self.buffer, 0, self.firstByte | EXTENSION_BIT, (marker << 7) | self.pt,
+			                              seqnum & 0xFFFF, timestamp & 0xFFFFFFFF)
+			FRAGMENT_HEADER.pack_into(self.buffer, HEADER_SIZE, FRAGMENT_EXT_PROFILE, FRAGMENT_EXT_WORDS,
+			                          FRAGMENT_EXT_VERSION, flags, fragment_id & 0xFFFF, total_fragments,
+			                          fragment_index, fragment_size, group_size)
+			return self.view
+		RTP_HEADER_VARIABLE.pack_into(self.buffer, 0, self.firstByte, (marker << 7) | self.pt,
+		                              seqnum & 0xFFFF, timestamp & 0xFFFFFFFF)
+		return self.rtpHeader
+
+	def writePacket(self, packet):
+		"""Write the header of a PendingPacket. Return a memoryview of the header to send."""
+		return self.write(packet.seqnum, packet.timestamp, packet.marker, packet.fragment_id,
+		                  packet.total_fragments, packet.fragment_index, packet.fragment_size, packet.flags,
+		                  packet.group_size)
+
+	def copy(self, header, seqnum):
+		"""Copy a complete header written by another template with this sequence number and SSRC. Return a memoryview."""
+		size = len(header)
+		self.buffer[:size] = header
+		RTP_SEQUENCE.pack_into(self.buffer, 2, seqnum & 0xFFFF)
+		RTP_SSRC.pack_into(self.buffer, 8, self.ssrc)
+		return self.view if size > HEADER_SIZE else self.rtpHeader
+
+class RtpPacket:
+	__slots__ = ('header', 'fragmentHeader', 'payload', 'fields', 'fragmentFields')
 
-class RtpPacket:	
-	header = bytearray(HEADER_SIZE)
-	
 	def __init__(self):
+		self.header = None
 		self.fragmentHeader = None
-		
-	def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, fragment_id=0, total_fragments=1, fragment_index=0):
+		self.payload = b''
+		self.fields = (0, 0, 0, 0, 0)
+		self.fragmentFields = (0, 1, 0, 0, 0, 0)
+
+	def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, fragment_id=0, total_fragments=1, fragment_index=0, timestamp=None, fragment_size=0, flags=0, group_size=0):
 		"""Encode the RTP packet with header fields and payload."""
-		timestamp = int(time())
-		self.header = bytearray(HEADER_SIZE)
-		
-		# Fill the header bytearray with RTP header fields
-		# Byte 0: V(2), P(1), X(1), CC(4)
-		self.header[0] = (version << 6) | (padding << 5) | (extension << 4) | cc
-		
-		# Byte 1: M(1), PT(7)
-		self.header[1] = (marker << 7) | pt
-		
-		# Bytes 2-3: Sequence number
-		self.header[2] = (seqnum >> 8) & 0xFF
-		self.header[3] = seqnum & 0xFF
-		
-		# Bytes 4-7: Timestamp
-		self.header[4] = (timestamp >> 24) & 0xFF
-		self.header[5] = (timestamp >> 16) & 0xFF
-		self.header[6] = (timestamp >> 8) & 0xFF
-		self.header[7] = timestamp & 0xFF
-		
-		# Bytes 8-11: SSRC
-		self.header[8] = (ssrc >> 24) & 0xFF
-		self.header[9] = (ssrc >> 16) & 0xFF
-		self.header[10] = (ssrc >> 8) & 0xFF
-		self.header[11] = ssrc & 0xFF
-		
-		# Add fragmentation header if this is a fragmented packet
+		if timestamp is None:
+			# Sequence numbers are frame numbers
+			timestamp = mediaTimestamp(seqnum)
+
+		# Add fragmentation header extension if this is a fragmented packet
 		if total_fragments > 1:
-			self.fragmentHeader = bytearray(FRAGMENT_HEADER_SIZE)
-			self.fragmentHeader[0] = (fragment_id >> 8) & 0xFF
-			self.fragmentHeader[1] = fragment_id & 0xFF
-			self.fragmentHeader[2] = total_fragments & 0xFF
-			self.fragmentHeader[3] = fragment_index & 0xFF
+			if total_fragments > MAX_FRAGMENTS:
+				raise ValueError(f"Frame needs {total_fragments} fragments, at most {MAX_FRAGMENTS} supported")
+			extension = 1
+			fragment_size = fragment_size or len(payload)
+			self.fragmentFields = (fragment_id & 0xFFFF, total_fragments, fragment_index, fragment_size, flags, group_size)
+			self.fragmentHeader = FRAGMENT_HEADER.pack(FRAGMENT_EXT_PROFILE, FRAGMENT_EXT_WORDS, FRAGMENT_EXT_VERSION,
+			                                           flags, fragment_id & 0xFFFF, total_fragments, fragment_index,
+			                                           fragment_size, group_size)
 		else:
+			self.fragmentFields = (0, 1, 0, 0, 0, 0)
 			self.fragmentHeader = None
-		
+
+		self.fields = ((version << 6) | (padding << 5) | (extension << 4) | cc, (marker << 7) | pt,
+		               seqnum & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc)
+		self.header = RTP_HEADER.pack(*self.fields)
+
 		# Get the payload from the argument
 		self.payload = payload
-		
+
 	def decode(self, byteStream):
-		"""Decode the RTP packet."""
-		self.header = bytearray(byteStream[:HEADER_SIZE])
-		
-		# Check if fragmentation header exists (marker bit indicates fragmentation)
-		remainingData = byteStream[HEADER_SIZE:]
-		
-		# Simple heuristic: if data starts with potential fragment header pattern
-		# We check if the first 4 bytes could be a fragment header
-		if len(remainingData) >= FRAGMENT_HEADER_SIZE:
-			# Try to detect fragment header - fragment_id should be reasonable
-			potential_frag_id = (remainingData[0] << 8) | remainingData[1]
-			potential_total = remainingData[2]
-			potential_index = remainingData[3]
-			
-			# If values suggest fragmentation (total > 1 and index < total)
-			if potential_total > 1 and potential_index < potential_total and potential_frag_id < 100000:
-				self.fragmentHeader = bytearray(remainingData[:FRAGMENT_HEADER_SIZE])
-				self.payload = remainingData[FRAGMENT_HEADER_SIZE:]
-			else:
-				self.fragmentHeader = None
-				self.payload = remainingData
-		else:
+		"""Decode the RTP packet. The header and payload are views into byteStream (no copies).
+
+		Raises ValueError for truncated packets or an unknown fragment header version.
+		"""
+		view = memoryview(byteStream)
+		try:
+			self.fields = RTP_HEADER.unpack_from(view)
+			self.header = view[:HEADER_SIZE]
+			offset = HEADER_SIZE + (self.fields[0] & 0x0F) * 4  # Skip CSRC list
+
+			self.fragmentFields = (0, 1, 0, 0, 0, 0)
 			self.fragmentHeader = None
-			self.payload = remainingData
-	
+			if self.fields[0] & EXTENSION_BIT:
+				profile, words = EXTENSION_HEADER.unpack_from(view, offset)
+				extensionEnd = offset + 4 + words * 4
+				if profile == FRAGMENT_EXT_PROFILE:
+					(_, _, version, flags, fragment_id, total_fragments, fragment_index,
+					 fragment_size, group_size) = FRAGMENT_HEADER.unpack_from(view, offset)
+					if version != FRAGMENT_EXT_VERSION:
+						raise ValueError(f"Unsupported fragment header version {version}")
+					self.fragmentFields = (fragment_id, total_fragments, fragment_index, fragment_size, flags, group_size)
+					self.fragmentHeader = view[offset:extensionEnd]
+				# Other extensions are skipped by their length
+				offset = extensionEnd
+		except struct.error as e:
+			raise ValueError(f"Truncated RTP packet: {e}")
+
+		if offset > len(view):
+			raise ValueError("Truncated RTP packet")
+		self.payload = view[offset:]
+
 	def version(self):
 		"""Return RTP version."""
-		return int(self.header[0] >> 6)
-	
+		return self.fields[0] >> 6
+
 	def seqNum(self):
 		"""Return sequence (frame) number."""
-		seqNum = self.header[2] << 8 | self.header[3]
-		return int(seqNum)
-	
+		return self.fields[2]
+
 	def timestamp(self):
 		"""Return timestamp."""
-		timestamp = self.header[4] << 24 | self.header[5] << 16 | self.header[6] << 8 | self.header[7]
-		return int(timestamp)
-	
+		return self.fields[3]
+
 	def payloadType(self):
 		"""Return payload type."""
-		pt = self.header[1] & 127
-		return int(pt)
-	
+		return self.fields[1] & 127
+
+	def marker(self):
+		"""Return the marker bit."""
+		return self.fields[1] >> 7
+
+	def ssrc(self):
+		"""Return the synchronization source identifier."""
+		return self.fields[4]
+
 	def getPayload(self):
 		"""Return payload."""
 		return self.payload
-		
+
 	def getPacket(self):
 		"""Return RTP packet."""
 		if self.fragmentHeader:
-			return self.header + self.fragmentHeader + self.payload
-		return self.header + self.payload
-	
+			return b''.join((self.header, self.fragmentHeader, self.payload))
+		return b''.join((self.header, self.payload))
+
 	def isFragmented(self):
 		"""Check if this packet is part of a fragmented frame."""
 		return self.fragmentHeader is not None
-	
+
 	def getFragmentId(self):
 		"""Return fragment ID."""
-		if self.fragmentHeader:
-			return (self.fragmentHeader[0] << 8) | self.fragmentHeader[1]
-		return 0
-	
+		return self.fragmentFields[0]
+
 	def getTotalFragments(self):
 		"""Return total number of fragments."""
-		if self.fragmentHeader:
-			return self.fragmentHeader[2]
-		return 1
-	
+		return self.fragmentFields[1]
+
 	def getFragmentIndex(self):
 		"""Return fragment index."""
-		if self.fragmentHeader:
-			return self.fragmentHeader[3]
-		return 0
\ No newline at end of file
+		return self.fragmentFields[2]
+
+	def getFragmentSize(self):
+		"""Return the payload size of every fragment of the frame but the last."""
+		return self.fragmentFields[3]
+
+	def getFragmentFlags(self):
+		"""Return the fragment header flags."""
+		return self.fragmentFields[4]
+
+	def getGroupSize(self):
+		"""Return the number of data fragments a parity packet covers (0 for data fragments)."""
+		return self.fragmentFields[5]
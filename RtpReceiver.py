@@ -0,0 +1,547 @@
+import argparse, json, os, socket, threading, time
+
+from RtpPacket import (RtpPacket, TimestampUnwrapper, SequenceUnwrapper, FRAGMENT_FLAG_RETRANSMIT, FRAGMENT_FLAG_PARITY,
+                       DEFAULT_FRAME_RATE)
+from Rtcp import nackEntries, encodeNack, encodeReceiverReport, ReceiverReport
+from NetworkStats import NetworkStats
+from Reassembler import Reassembler
+from FramePipeline import LatestFrameQueue
+from Rtsp import parseNptRange, formatNptRange
+
+RTSP_TIMEOUT = 5.0  # Seconds to wait for an RTSP reply
+RTP_RECV_BUFFER = 4 * 1024 * 1024  # Kernel receive buffer: absorbs bursts of HD fragments
+FRAME_QUEUE_SIZE = 64  # Frames buffered for frames() when no callback is given
+NACK_DEADLINE = 0.1  # Seconds after a frame's first fragment that a retransmission can still be played out
+DEFAULT_REPORT_INTERVAL = 1.0  # Seconds between receiver reports
+
+
+class RtpReceiver:
+	"""Headless RTSP/RTP client: session control, packet receive, reassembly and stats.
+
+	Complete frames are passed to onFrame(frameNumber, data) on the receive
+	thread or, without a callback, buffered for the frames() iterator
+	(oldest dropped when the consumer falls behind). During onFrame,
+	frameTime holds the frame's media time in seconds (from its 90 kHz
+	RTP timestamp) for playout scheduling. Nothing here needs a display,
+	so many receivers can run in one process.
+
+	seek() and scale pick where the next PLAY starts and how fast it
+	plays (RTSP Range and Scale headers); duration is the length the
+	server gave at SETUP (None for live channels).
+	"""
+	INIT = 0
+	READY = 1
+	PLAYING = 2
+
+	SETUP = 'SETUP'
+	PLAY = 'PLAY'
+	PAUSE = 'PAUSE'
+	TEARDOWN = 'TEARDOWN'
+	SET_PARAMETER = 'SET_PARAMETER'
+
+	# NACK missing fragments back to the server (RTCP on the RTP port)
+	SEND_NACKS = True
+	# Send receiver reports (frame loss, jitter, achieved fps) so the server can adapt (0 = never)
+	REPORT_INTERVAL = DEFAULT_REPORT_INTERVAL
+
+	def __init__(self, serverAddr, serverPort, rtpPort, fileName, onFrame=None, verbose=False):
+		self.serverAddr = serverAddr
+		self.serverPort = int(serverPort)
+		self.rtpPort = int(rtpPort)
+		self.fileName = fileName
+		self.onFrame = onFrame
+		self.verbose = verbose
+		self.state = self.INIT
+		self.rtspSeq = 0
+		self.sessionId = 0
+		self.rtspSocket = None
+		self.rtpSocket = None
+		self.thread = None
+		self.playEvent = threading.Event()
+		self.frameNbr = 0  # Newest frame delivered, extended past 16 bits
+		self.frameTime = 0.0  # Media time of the frame being delivered (seconds)
+		self.mediaClock = TimestampUnwrapper()
+		self.sequence = SequenceUnwrapper()
+		self.playStarted = None
+		self.playSeconds = 0.0  # Time spent PLAYING, for per-receiver frame rates
+
+		# Network statistics
+		self.stats = NetworkStats()
+
+		# Fragment reassembly: one slot list per frame, bounded and expired by deadline
+		self.reassembler = Reassembler(stats=self.stats, onMissing=self.requestFragments if self.SEND_NACKS else None)
+		self.nackDeadline = NACK_DEADLINE
+		self.serverRtpAddr = None  # Learned from the first RTP packet; feedback goes there
+		self.nextReport = 0.0
+		self.lastReport = None  # (time, frames received, frames lost) at the previous report
+		self.rendition = None  # JPEG rendition asked for at SETUP (None = the server's default)
+		self.duration = None  # Seconds, from the SETUP reply's Range (None = live or unknown)
+		self.seekPosition = None  # Where the next PLAY starts (seconds, None = where it paused)
+		self.scale = 1.0  # Playback speed asked for with PLAY (> 1 fast-forwards)
+		self.replyHeaders = {}  # Header lines of the last RTSP reply (lowercase names)
+		self.frameQueue = LatestFrameQueue(FRAME_QUEUE_SIZE)
+
+	def connect(self):
+		"""Open the RTSP/TCP connection. Raises OSError on failure."""
+		self.rtspSocket = socket.create_connection((self.serverAddr, self.serverPort), RTSP_TIMEOUT)
+
+	def openRtpPort(self):
+		"""Open the RTP socket bound to the client port. Raises OSError on failure."""
+		self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+		# A larger kernel buffer rides out bursts while a frame is being reassembled
+		try:
+			self.rtpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RTP_RECV_BUFFER)
+		except OSError:
+			pass
+
+		# Wake up regularly to notice PAUSE and TEARDOWN
+		self.rtpSocket.settimeout(0.5)
+		try:
+			self.rtpSocket.bind(('', self.rtpPort))
+		except OSError:
+			self.rtpSocket.close()
+			self.rtpSocket = None
+			raise
+
+	def setup(self):
+		"""Send SETUP. Return True once the session is READY."""
+		if self.state != self.INIT:
+			return False
+		if self.rtspSocket is None:
+			self.connect()
+
+		# Bind before SETUP so the first packets cannot arrive at a closed port
+		if self.rtpSocket is None:
+			self.openRtpPort()
+		if self.sendRtspRequest(self.SETUP) != 200:
+			return False
+		self.state = self.READY
+		try:
+			self.duration = parseNptRange(self.replyHeaders.get('range', ''))[1]
+		except ValueError:
+			self.duration = None
+		return True
+
+	def play(self):
+		"""Start receiving and send PLAY. Return True once PLAYING."""
+		if self.state != self.READY:
+			return False
+		self.playEvent.clear()
+		# Arrival times jump by the pause: measure delay against a fresh media clock anchor
+		self.stats.resetTransit()
+		self.serverRtpAddr = None  # The server sends from a new socket after each PLAY
+		self.nextReport = 0.0  # The first report, right after the first packet, is the server's baseline
+		self.lastReport = None
+		if self.seekPosition is not None:
+			# Frame numbers restart at the new position: forget the old ones and anything still queued
+			self.drainRtp()
+			self.frameNbr = 0
+			self.reassembler.reset()
+			self.mediaClock = TimestampUnwrapper()
+			# The server numbers frames by file position: extend from the frame asked for
+			self.sequence = SequenceUnwrapper(int(round(self.seekPosition * DEFAULT_FRAME_RATE)) + 1)
+		self.thread = threading.Thread(target=self.listenRtp, name=f'RtpReceiver-{self.rtpPort}', daemon=True)
+		self.thread.start()
+		code = self.sendRtspRequest(self.PLAY)
+		self.seekPosition = None  # A refused position is not retried
+		if code != 200:
+			self.stopListening()
+			return False
+		self.state = self.PLAYING
+		self.playStarted = time.monotonic()
+		return True
+
+	def seek(self, position):
+		"""Play from position (seconds) next: right away if playing (PAUSE, PLAY), else at the next play().
+
+		Return True unless the server refused the new position.
+		"""
+		self.seekPosition = max(0.0, position)
+		return self.restart()
+
+	def setScale(self, scale):
+		"""Play at another speed (> 1 fast-forwards): right away if playing, else at the next play()."""
+		self.scale = scale
+		return self.restart()
+
+	def restart(self):
+		"""Send PAUSE and PLAY again if playing, so a new position or speed takes effect. Return True once done."""
+		if self.state != self.PLAYING:
+			return True
+		return self.pause() and self.play()
+
+	def drainRtp(self):
+		"""Discard RTP packets queued from before a seek."""
+		self.rtpSocket.setblocking(False)
+		try:
+			while True:
+				self.rtpSocket.recv(65536)
+		except OSError:
+			pass
+		finally:
+			self.rtpSocket.settimeout(0.5)
+
+	def setRendition(self, rendition):
+		"""Ask for another JPEG rendition, mid-stream if set up. Return True if the server accepted it."""
+		previous, self.rendition = self.rendition, rendition
+		if self.state == self.INIT:
+			return True  # Sent with SETUP
+		if self.sendRtspRequest(self.SET_PARAMETER) != 200:
+			self.rendition = previous
+			return False
+		return True
+
+	def pause(self):
+		"""Send PAUSE and stop receiving. Return True once READY."""
+		if self.state != self.PLAYING:
+			return False
+		if self.sendRtspRequest(self.PAUSE) != 200:
+			return False
+		self.state = self.READY
+		self.stopListening()
+		return True
+
+	def teardown(self):
+		"""Send TEARDOWN and release the session."""
+		if self.state != self.INIT and self.rtspSocket is not None:
+			try:
+				self.sendRtspRequest(self.TEARDOWN)
+			except OSError:
+				pass
+		self.state = self.INIT
+		self.close()
+
+	def close(self):
+		"""Stop receiving and close both sockets."""
+		self.stopListening()
+		self.frameQueue.close()
+		if self.rtpSocket is not None:
+			self.rtpSocket.close()
+			self.rtpSocket = None
+		if self.rtspSocket is not None:
+			try:
+				self.rtspSocket.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+			self.rtspSocket.close()
+			self.rtspSocket = None
+
+	def stopListening(self, wait=True):
+		"""Stop the receive thread, waiting for it to exit unless wait is False."""
+		if self.playStarted is not None:
+			self.playSeconds += time.monotonic() - self.playStarted
+			self.playStarted = None
+		self.playEvent.set()
+		if not wait:
+			return
+		if self.thread is not None and self.thread is not threading.current_thread():
+			self.thread.join()
+		self.thread = None
+
+	def sendRtspRequest(self, method):
+		"""Send an RTSP request and wait for its reply. Return the status code, or None."""
+		self.rtspSeq += 1
+		request = f"{method} {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}"
+		if method == self.SETUP:
+			request += f"\nTransport: RTP/UDP; client_port= {self.rtpPort}"
+		else:
+			request += f"\nSession: {self.sessionId}"
+		if self.rendition and method in (self.SETUP, self.SET_PARAMETER):
+			request += f"\nRendition: {self.rendition}"
+		if method == self.PLAY:
+			if self.seekPosition is not None:
+				request += f"\nRange: {formatNptRange(self.seekPosition)}"
+			if self.scale != 1.0:
+				request += f"\nScale: {self.scale:g}"
+
+		self.rtspSocket.send(request.encode())
+		if self.verbose:
+			print('\nData sent:\n' + request)
+		return self.recvRtspReply()
+
+	def recvRtspReply(self):
+		"""Receive and parse the reply to the last request. Return the status code, or None."""
+		try:
+			reply = self.rtspSocket.recv(1024)
+		except socket.timeout:
+			print(f"[Receiver] No RTSP reply within {RTSP_TIMEOUT}s")
+			return None
+		if not reply:
+			return None
+		return self.parseRtspReply(reply.decode("utf-8"))
+
+	def parseRtspReply(self, data):
+		"""Parse the RTSP reply from the server. Return the status code, or None if it does not match."""
+		lines = data.split('\n')
+		try:
+			code = int(lines[0].split(' ')[1])
+			seqNum = int(lines[1].split(' ')[1])
+			session = int(lines[2].split(' ')[1])
+		except (IndexError, ValueError):
+			print(f"[Receiver] Malformed RTSP reply: {data!r}")
+			return None
+
+		# Process only if the server reply's sequence number is the same as the request's
+		if seqNum != self.rtspSeq:
+			return None
+
+		# New RTSP session ID
+		if self.sessionId == 0:
+			self.sessionId = session
+
+		# Process only if the session ID is the same
+		if self.sessionId != session:
+			return None
+		self.replyHeaders = {}
+		for line in lines[3:]:
+			name, sep, value = line.partition(':')
+			if sep:
+				self.replyHeaders[name.strip().lower()] = value.strip()
+		return code
+
+	def listenRtp(self):
+		"""Receive RTP packets until PAUSE or TEARDOWN (receive thread)."""
+		rtpSocket = self.rtpSocket
+		while not self.playEvent.is_set():
+			try:
+				if self.serverRtpAddr is None:
+					data, self.serverRtpAddr = rtpSocket.recvfrom(65536)
+				else:
+					data = rtpSocket.recv(65536)  # Increased buffer for HD
+			except socket.timeout:
+				data = None
+			except OSError:
+				break
+			if data:
+				self.handlePacket(data)
+			if self.REPORT_INTERVAL and self.serverRtpAddr is not None:
+				now = time.monotonic()
+				if now >= self.nextReport:
+					self.sendReport(now)
+
+		if self.verbose:
+			print("\n[Receiver] Playback stopped. Final statistics:")
+			self.stats.printStats()
+
+	def handlePacket(self, data):
+		"""Decode one RTP packet and deliver the frame it completes, if any."""
+		rtpPacket = RtpPacket()
+		try:
+			rtpPacket.decode(data)
+		except ValueError as e:
+			print(f"[Receiver] Dropped undecodable packet: {e}")
+			return
+		self.processPacket(rtpPacket, len(data))
+
+	def processPacket(self, rtpPacket, size):
+		"""Account for a decoded packet and pass it to reassembly."""
+		currFrameNbr = self.sequence.unwrap(rtpPacket.seqNum())
+
+		# Record packet statistics
+		fragmented = rtpPacket.isFragmented()
+		mediaTime = self.mediaClock.seconds(rtpPacket.timestamp())
+		self.stats.recordReceived(size, fragmented, mediaTime)
+
+		# Check if this is a fragmented packet
+		if fragmented:
+			flags = rtpPacket.fragmentFields[4]
+			if flags:
+				if flags & FRAGMENT_FLAG_RETRANSMIT:
+					self.stats.recordRetransmitReceived()
+				if flags & FRAGMENT_FLAG_PARITY:
+					self.stats.recordFecReceived()
+			result = self.reassembler.pushPacket(rtpPacket, frameNumber=currFrameNbr)
+			if result is not None:
+				# The completing fragment carries the frame's timestamp, like all its fragments
+				self.frameTime = mediaTime
+				self.deliverFrame(*result)
+		elif currFrameNbr > self.frameNbr:
+			self.frameTime = mediaTime
+			self.deliverFrame(currFrameNbr, rtpPacket.getPayload())
+		else:
+			# Discard late packets
+			if self.verbose:
+				print(f"[Receiver] Discarded late packet: {currFrameNbr}")
+			self.stats.recordPacketLost()
+
+	def requestFragments(self, frame, indices):
+		"""NACK missing fragments of a partial frame, unless a resend would arrive too late to play."""
+		started = frame.deadline - self.reassembler.timeout
+		if self.serverRtpAddr is None or time.monotonic() - started > self.nackDeadline:
+			return
+		try:
+			self.rtpSocket.sendto(encodeNack(nackEntries(frame.fragmentId, indices)), self.serverRtpAddr)
+		except OSError as e:
+			print(f"[Receiver] NACK failed: {e}")
+			return
+		self.stats.recordNackSent(len(indices))
+
+	def sendReport(self, now):
+		"""Send a receiver report covering the frames since the previous one (receive thread)."""
+		self.nextReport = now + self.REPORT_INTERVAL
+		stats = self.stats.getStats()
+		received, lost = stats['frames_received'], stats['frames_lost']
+		fraction = fps = 0.0
+		if self.lastReport is not None:
+			lastTime, lastReceived, lastLost = self.lastReport
+			started = (received - lastReceived) + (lost - lastLost)
+			fraction = (lost - lastLost) / started if started else 0.0
+			fps = (received - lastReceived) / (now - lastTime) if now > lastTime else 0.0
+		self.lastReport = (now, received, lost)
+		report = ReceiverReport(fraction, lost, self.frameNbr, stats['avg_jitter_ms'] / 1000, received, fps)
+		try:
+			self.rtpSocket.sendto(encodeReceiverReport(report), self.serverRtpAddr)
+		except OSError as e:
+			print(f"[Receiver] Receiver report failed: {e}")
+			return
+		self.stats.recordReceiverReportSent()
+
+	def deliverFrame(self, frameNbr, data):
+		"""Pass a complete frame to the consumer, unless a newer one was already delivered."""
+		if frameNbr <= self.frameNbr:
+			return
+		self.frameNbr = frameNbr
+		self.stats.recordFrameReceived()
+		if self.verbose:
+			print(f"[Receiver] Frame {frameNbr} received ({len(data)} bytes)")
+		if self.onFrame is not None:
+			self.onFrame(frameNbr, data)
+		else:
+			self.frameQueue.put((frameNbr, data))
+
+	def frames(self, timeout=None):
+		"""Iterate over complete (frameNumber, data) until the session stops or timeout passes without a frame."""
+		while True:
+			item = self.frameQueue.get(timeout)
+			if item is None:
+				return
+			yield item
+
+	def getStats(self):
+		"""Get receive and reassembly statistics as a dictionary."""
+		stats = self.stats.getStats()
+		playSeconds = self.playSeconds
+		if self.playStarted is not None:
+			playSeconds += time.monotonic() - self.playStarted
+		stats['play_seconds'] = playSeconds
+		stats['fps'] = stats['frames_received'] / playSeconds if playSeconds > 0 else 0
+		stats['reassembly'] = self.reassembler.getStats()
+		return stats
+
+
+class FrameRecorder:
+	"""Append received frames to an MJPEG file (plain concatenated JPEGs)."""
+
+	def __init__(self, path):
+		self.file = open(path, 'wb')
+		self.lock = threading.Lock()
+
+	def __call__(self, frameNbr, data):
+		with self.lock:
+			if self.file is not None:
+				self.file.write(data)
+
+	def close(self):
+		with self.lock:
+			self.file.close()
+			self.file = None
+
+
+def runReceivers(serverAddr, serverPort, rtpPort, fileName, count=1, duration=10.0, recordDir=None, rendition=None,
+                 start=None, scale=1.0):
+	"""Run count receivers (RTP ports rtpPort..rtpPort+count-1) for duration seconds. Return their stats."""
+	receivers = []
+	recorders = []
+	for i in range(count):
+		onFrame = None
+		if recordDir is not None:
+			recorder = FrameRecorder(os.path.join(recordDir, f"stream-{rtpPort + i}.Mjpeg"))
+			recorders.append(recorder)
+			onFrame = recorder
+		else:
+			# Frames are only counted
+			onFrame = lambda frameNbr, data: None
+		receivers.append(RtpReceiver(serverAddr, serverPort, rtpPort + i, fileName, onFrame))
+		receivers[-1].rendition = rendition
+		receivers[-1].seekPosition = start
+		receivers[-1].scale = scale
+
+	started = []
+	try:
+		for receiver in receivers:
+			try:
+				if receiver.setup() and receiver.play():
+					started.append(receiver)
+				else:
+					print(f"[Receiver] Port {receiver.rtpPort}: session did not start")
+			except OSError as e:
+				print(f"[Receiver] Port {receiver.rtpPort}: {e}")
+		time.sleep(duration)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		# Stop every receive thread first so teardown order does not skew play time
+		for receiver in receivers:
+			receiver.stopListening(wait=False)
+		for receiver in receivers:
+			receiver.teardown()
+		for recorder in recorders:
+			recorder.close()
+
+	results = {'receivers': [dict(port=r.rtpPort, **r.getStats()) for r in started]}
+	results['total'] = {
+		'receivers_started': len(started),
+		'receivers_requested': count,
+		'frames_received': sum(r['frames_received'] for r in results['receivers']),
+		'frames_lost': sum(r['frames_lost'] for r in results['receivers']),
+		'bytes_received': sum(r['bytes_received'] for r in results['receivers']),
+		'avg_fps': (sum(r['fps'] for r in results['receivers']) / len(started)) if started else 0,
+	}
+	return results
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(usage="RtpReceiver.py Server_name Server_port RTP_port Video_file [options]",
+	                                 description="Headless RTP receivers for soak tests, recording and delivery measurements.")
+	parser.add_argument('serverAddr', help="RTSP server host")
+	parser.add_argument('serverPort', type=int, help="RTSP server port")
+	parser.add_argument('rtpPort', type=int, help="first local RTP port (receiver i uses RTP_port + i)")
+	parser.add_argument('fileName', help="video file to request")
+	parser.add_argument('--count', type=int, default=1, help="number of receivers to run in this process")
+	parser.add_argument('--duration', type=float, default=10.0, help="seconds to receive before TEARDOWN")
+	parser.add_argument('--record', metavar='DIR', help="write each stream to DIR/stream-<port>.Mjpeg")
+	parser.add_argument('--no-nack', action='store_true', help="do not NACK missing fragments")
+	parser.add_argument('--no-reports', action='store_true',
+	                    help="do not send receiver reports (the server then never adapts its frame rate)")
+	parser.add_argument('--rendition', help="JPEG rendition to ask for (full, high, medium, low)")
+	parser.add_argument('--start', type=float, metavar='SECONDS', help="start playing at this position")
+	parser.add_argument('--scale', type=float, default=1.0, help="playback speed (> 1 fast-forwards)")
+	parser.add_argument('--json', action='store_true', help="print machine-readable results")
+	args = parser.parse_args(argv)
+
+	RtpReceiver.SEND_NACKS = not args.no_nack
+	if args.no_reports:
+		RtpReceiver.REPORT_INTERVAL = 0
+	if args.record:
+		os.makedirs(args.record, exist_ok=True)
+	results = runReceivers(args.serverAddr, args.serverPort, args.rtpPort, args.fileName,
+	                       args.count, args.duration, args.record, args.rendition, args.start, args.scale)
+
+	if args.json:
+		print(json.dumps(results, indent=2))
+		return
+	for stats in results['receivers']:
+		print(f"[Receiver] Port {stats['port']}: {stats['frames_received']} frames "
+		      f"({stats['fps']:.1f} fps) | "
+		      f"Lost frames: {stats['frames_lost']} | "
+		      f"BW: {stats['bandwidth_received_kbps']:.0f} Kbps | "
+		      f"Latency: {stats['avg_latency_ms']:.1f}ms")
+	total = results['total']
+	print(f"[Receiver] {total['receivers_started']}/{total['receivers_requested']} receivers | "
+	      f"{total['frames_received']} frames | {total['avg_fps']:.1f} fps per receiver | "
+	      f"{total['frames_lost']} frames lost")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,52 @@
+# RTSP header values shared by the server and the receivers (RFC 2326):
+#   Range: npt=<start>-[<end>]   normal play time in seconds or h:m:s, 'now' for live
+#   Scale: <speed>               1 = normal, 2 = twice as fast (frames are skipped, not sent faster)
+MAX_SCALE = 16.0  # Fastest fast-forward: frames of the file per frame sent
+NPT_NOW = 'now'
+
+
+def parseNptTime(text):
+	"""Parse an npt time ('12.5', '1:02:03.5' or 'now'). Return seconds, or None for 'now'.
+
+	Raises ValueError if malformed or negative.
+	"""
+	text = text.strip()
+	if text == NPT_NOW:
+		return None
+	seconds = 0.0
+	for part in text.split(':'):
+		seconds = seconds * 60 + float(part)
+	if len(text.split(':')) > 3 or not 0 <= seconds < float('inf'):
+		raise ValueError(f"Bad npt time {text!r}")
+	return seconds
+
+
+def parseNptRange(value):
+	"""Parse a Range header value 'npt=start-[end]'. Return (start, end) in seconds, None for 'now' or an open end.
+
+	Raises ValueError if malformed, not npt, or the end is before the start.
+	"""
+	unit, _, spec = value.strip().partition('=')
+	if unit.strip() != 'npt' or '-' not in spec:
+		raise ValueError(f"Unsupported range {value!r}")
+	startText, _, endText = spec.partition('-')
+	start = parseNptTime(startText) if startText.strip() else 0.0
+	end = parseNptTime(endText) if endText.strip() else None
+	if end is not None and start is not None and end < start:
+		raise ValueError(f"Range {value!r} ends before it starts")
+	return start, end
+
+
+def formatNptRange(start, end=None):
+	"""Return a Range header value for start (None for 'now') and an optional end, in seconds."""
+	startText = NPT_NOW if start is None else f"{start:.3f}"
+	endText = '' if end is None else f"{end:.3f}"
+	return f"npt={startText}-{endText}"
+
+
+def parseScale(value):
+	"""Parse a Scale header value. Raises ValueError if it is not a number."""
+	scale = float(value)
+	if scale != scale:  # NaN
+		raise ValueError(f"Bad scale {value!r}")
+	return scale
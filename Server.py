@@ -1,14 +1,61 @@
-import sys, socket
+import argparse, socket
 
 from ServerWorker import ServerWorker
+from FrameCache import sharedCache, DEFAULT_BUDGET
+from MetricsServer import startMetricsServer
+from Transcoder import sharedTranscoder, FULL, RENDITIONS, DEFAULT_WORKERS
 
 class Server:	
 	
 	def main(self):
-		try:
-			SERVER_PORT = int(sys.argv[1])
-		except:
-			print("[Usage: Server.py Server_port]\n")
+		parser = argparse.ArgumentParser(usage="Server.py Server_port [options]")
+		parser.add_argument('port', type=int, help="RTSP port to listen on")
+		parser.add_argument('--mmap', action='store_true',
+		                    help="serve frames from a memory mapping shared by all sessions")
+		parser.add_argument('--cache-mb', type=int, default=DEFAULT_BUDGET // (1024 * 1024),
+		                    help="memory budget of the shared frame cache in MB (0 disables it)")
+		parser.add_argument('--bitrate-kbps', type=int, default=0,
+		                    help="per-session target bitrate for pacing fragments (0 = spread over the frame interval)")
+		parser.add_argument('--event-loop', action='store_true',
+		                    help="run all sessions on a single-threaded event loop instead of thread-per-client")
+		parser.add_argument('--loops', type=int, default=1,
+		                    help="with --event-loop, number of loop processes sharing the port (one per core)")
+		parser.add_argument('--no-retransmit', action='store_true',
+		                    help="ignore NACKs instead of resending recent fragments")
+		parser.add_argument('--no-adapt', action='store_true',
+		                    help="send every frame regardless of the loss in client receiver reports")
+		parser.add_argument('--fec', type=int, default=0, metavar='N',
+		                    help="send an XOR parity packet after every N fragments of a frame, so one lost "
+		                         "fragment per group is rebuilt without a retransmission (0 disables)")
+		parser.add_argument('--rendition', choices=[FULL] + sorted(RENDITIONS), default=FULL,
+		                    help="JPEG rendition sent to clients that do not pick one at SETUP (needs Pillow)")
+		parser.add_argument('--transcode-workers', type=int, default=DEFAULT_WORKERS, metavar='N',
+		                    help="processes producing lower renditions, shared by all sessions (0 disables renditions)")
+		parser.add_argument('--metrics-port', type=int, default=0,
+		                    help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics and JSON on "
+		                         "/metrics.json (0 disables; with --loops N, loop i uses PORT + i)")
+		args = parser.parse_args()
+		
+		SERVER_PORT = args.port
+		ServerWorker.USE_MMAP = args.mmap
+		ServerWorker.TARGET_BITRATE = args.bitrate_kbps * 1000
+		ServerWorker.RETRANSMIT = not args.no_retransmit
+		ServerWorker.FEC_GROUP = max(args.fec, 0)
+		ServerWorker.ADAPTIVE = not args.no_adapt
+		sharedCache.configure(args.cache_mb * 1024 * 1024)
+		sharedTranscoder.configure(args.transcode_workers)
+		ServerWorker.DEFAULT_RENDITION = args.rendition
+		if args.rendition != FULL and not sharedTranscoder.available():
+			print("[Server] Renditions need Pillow and --transcode-workers > 0: sending original frames")
+		
+		if args.event_loop:
+			from EventLoopServer import runEventLoopServer
+			runEventLoopServer(SERVER_PORT, args.loops, args.metrics_port)
+			return
+		
+		if args.metrics_port:
+			startMetricsServer(args.metrics_port)
+		
 		rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		rtspSocket.bind(('', SERVER_PORT))
 		rtspSocket.listen(5)        
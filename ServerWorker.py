@@ -1,16 +1,29 @@
 from random import randint
 import sys, traceback, threading, socket
-import time
+from time import monotonic
 
 from VideoStream import VideoStream
-from RtpPacket import RtpPacket
+from RtpPacket import (HEADER_SIZE, FRAGMENT_HEADER_SIZE, MAX_FRAGMENTS, FRAGMENT_FLAG_RETRANSMIT, PendingPacket,
+                       RtpHeaderTemplate, mediaTimestamp, fragmentPackets, DEFAULT_FRAME_RATE)
+from Rtcp import (isRtcp, packetType, decodeNack, expandNackEntries, decodeReceiverReport, PT_RTPFB, PT_RR,
+                  FMT_FRAGMENT_NACK)
+from Retransmit import RetransmitBuffer, DEFAULT_RETRANSMIT_DEADLINE
+from Fec import protectFragments
+from RateControl import FrameThinning
+from Transcoder import sharedTranscoder, FULL, RENDITIONS, DEFAULT_LOOKAHEAD
+from Broadcast import sharedChannels, isLive, LIVE_PREFIX
+from Rtsp import parseNptRange, formatNptRange, parseScale, MAX_SCALE
 from NetworkStats import NetworkStats
+from FrameCache import sharedCache
+from Pacer import PacedStream, sharedPacer, sharedReader
+from MetricsServer import sharedRegistry
 
 class ServerWorker:
 	SETUP = 'SETUP'
 	PLAY = 'PLAY'
 	PAUSE = 'PAUSE'
 	TEARDOWN = 'TEARDOWN'
+	SET_PARAMETER = 'SET_PARAMETER'
 	
 	INIT = 0
 	READY = 1
@@ -20,10 +33,37 @@ class ServerWorker:
 	OK_200 = 0
 	FILE_NOT_FOUND_404 = 1
 	CON_ERR_500 = 2
+	PARAMETER_NOT_UNDERSTOOD_451 = 3
+	INVALID_RANGE_457 = 4
+	METHOD_NOT_VALID_455 = 5
 	
 	# HD Video streaming parameters
 	MTU = 1400  # Maximum Transmission Unit (bytes) - safe for most networks
-	MAX_PAYLOAD_SIZE = MTU - 12 - 4  # MTU - RTP_HEADER - FRAGMENT_HEADER
+	MAX_PAYLOAD_SIZE = MTU - HEADER_SIZE - FRAGMENT_HEADER_SIZE
+	
+	# Pacing: frames per second and target bitrate (bits/s, 0 = spread each
+	# frame's fragments evenly over the frame interval)
+	FRAME_RATE = DEFAULT_FRAME_RATE
+	TARGET_BITRATE = 0
+	
+	# Send header and payload as separate iovecs so payload bytes are never copied
+	USE_SENDMSG = hasattr(socket.socket, 'sendmsg')
+	
+	# Serve frames as zero-copy slices of a memory mapping shared by all sessions
+	USE_MMAP = False
+	
+	# Resend fragments NACKed by the client while their frame can still be
+	# played out (seconds after packetizing)
+	RETRANSMIT = True
+	RETRANSMIT_DEADLINE = DEFAULT_RETRANSMIT_DEADLINE
+	# Send an XOR parity packet after every FEC_GROUP fragments of a frame, so
+	# one lost fragment per group is rebuilt without a round trip (0 = off)
+	FEC_GROUP = 0
+	# Thin frames and slow the pacing clock when receiver reports show loss
+	ADAPTIVE = True
+	# Rendition sent when the client does not pick one (see Transcoder.RENDITIONS)
+	DEFAULT_RENDITION = FULL
+	FEEDBACK_POLL = 0.5  # Seconds the feedback thread waits before checking its socket is still current
 	
 	clientInfo = {}
 	
@@ -31,6 +71,37 @@ class ServerWorker:
 		self.clientInfo = clientInfo
 		self.stats = NetworkStats()
 		self.fragmentId = 0
+		self.pacedStream = None
+		
+		# Headers are patched into one prebuilt template at send time
+		self.ssrc = randint(1, 0xFFFFFFFF)
+		self.headerTemplate = RtpHeaderTemplate(ssrc=self.ssrc)
+		
+		# Fragments of recent frames, resent on NACK with their own header template
+		# (the feedback thread must not patch the pacer's)
+		self.retransmitBuffer = RetransmitBuffer(deadline=self.RETRANSMIT_DEADLINE)
+		self.retransmitTemplate = RtpHeaderTemplate(ssrc=self.ssrc)
+		
+		# Share of frames sent, adapted to the client's receiver reports
+		self.thinning = FrameThinning()
+		self.appliedRatio = 1.0
+		
+		# JPEG rendition sent, picked at SETUP or with SET_PARAMETER
+		self.rendition = FULL
+		self.renditionFrames = 0
+		self.renditionMisses = 0  # Sent as the original because the rendition was not ready
+		
+		# Broadcast channel the session is subscribed to (file names under live/), whose
+		# frame counter is offset by seqBase so the session's sequence numbers carry on from lastSeq
+		self.channel = None
+		self.seqBase = 0
+		self.lastSeq = 0
+		
+		# Trick play from the PLAY request's Range and Scale headers: playback stops after
+		# endFrame (None = end of file) and each frame sent stands for `scale` frames of the file
+		self.endFrame = None
+		self.scale = 1.0
+		self.scaleCredit = 0.0
 		
 	def run(self):
 		threading.Thread(target=self.recvRtspRequest).start()
@@ -39,10 +110,21 @@ class ServerWorker:
 		"""Receive RTSP request from the client."""
 		connSocket = self.clientInfo['rtspSocket'][0]
 		while True:            
-			data = connSocket.recv(256)
+			try:
+				data = connSocket.recv(1024)
+			except OSError:
+				break
 			if data:
 				print("Data received:\n" + data.decode("utf-8"))
 				self.processRtspRequest(data.decode("utf-8"))
+			else:
+				# Client closed the connection
+				break
+		
+		# Stop streaming to a client that went away without TEARDOWN
+		self.stopStreaming()
+		self.releaseChannel()
+		sharedRegistry.unregister(self)
 	
 	def processRtspRequest(self, data):
 		"""Process RTSP request sent from the client."""
@@ -64,35 +146,59 @@ class ServerWorker:
 				print("processing SETUP\n")
 				
 				try:
-					self.clientInfo['videoStream'] = VideoStream(filename)
+					if isLive(filename):
+						self.openChannel(filename[len(LIVE_PREFIX):])
+						videoStream = self.channel.videoStream
+					else:
+						self.clientInfo['videoStream'] = VideoStream(filename, useMmap=self.USE_MMAP, cache=sharedCache)
+						videoStream = self.clientInfo['videoStream']
 					self.state = self.READY
+					self.clientInfo['fileName'] = filename
+					print(f"[Server] {filename}: {videoStream.getTotalFrames()} frames, "
+					      f"{videoStream.getDuration():.1f}s")
 				except IOError:
 					self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
 				
 				# Generate a randomized RTSP session ID
 				self.clientInfo['session'] = randint(100000, 999999)
 				
-				# Send RTSP reply
-				self.replyRtsp(self.OK_200, seq[1])
+				# Send RTSP reply, with the playable range
+				if self.state != self.READY:
+					self.replyRtsp(self.OK_200, seq[1])
+				elif self.channel is not None:
+					self.replyRtsp(self.OK_200, seq[1], ['Range: ' + formatNptRange(None)])
+				else:
+					duration = videoStream.getDuration(self.FRAME_RATE)
+					self.replyRtsp(self.OK_200, seq[1], ['Range: ' + formatNptRange(0.0, duration)])
 				
-				# Get the RTP/UDP port from the last line
+				# Get the RTP/UDP port from the transport line
 				self.clientInfo['rtpPort'] = request[2].split(' ')[3]
+				self.setRendition(self.requestHeader(request, 'Rendition') or self.DEFAULT_RENDITION)
+				if self.state == self.READY:
+					sharedRegistry.register(self)
 		
 		# Process PLAY request 		
 		elif requestType == self.PLAY:
 			if self.state == self.READY:
 				print("processing PLAY\n")
+				try:
+					headers = self.applyPlayRange(request)
+				except ValueError as e:
+					print(f"[Server] Session {self.clientInfo['session']}: {e}")
+					self.replyRtsp(self.INVALID_RANGE_457, seq[1])
+					return
 				self.state = self.PLAYING
 				
 				# Create a new socket for RTP/UDP
-				self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+				self.openRtpSocket()
+				self.startFeedback()
+				self.thinning.reset()
+				self.appliedRatio = 1.0  # The new PacedStream starts at the full frame rate
 				
-				self.replyRtsp(self.OK_200, seq[1])
+				self.replyRtsp(self.OK_200, seq[1], headers)
 				
-				# Create a new thread and start sending RTP packets
-				self.clientInfo['event'] = threading.Event()
-				self.clientInfo['worker']= threading.Thread(target=self.sendRtp) 
-				self.clientInfo['worker'].start()
+				# Start sending RTP packets
+				self.startStreaming()
 		
 		# Process PAUSE request
 		elif requestType == self.PAUSE:
@@ -100,115 +206,426 @@ class ServerWorker:
 				print("processing PAUSE\n")
 				self.state = self.READY
 				
-				self.clientInfo['event'].set()
+				self.stopStreaming()
 			
 				self.replyRtsp(self.OK_200, seq[1])
 		
+		# Process SET_PARAMETER request (switch rendition mid-stream)
+		elif requestType == self.SET_PARAMETER:
+			rendition = self.requestHeader(request, 'Rendition')
+			if self.state == self.INIT:
+				# No session yet to change
+				self.replyRtsp(self.METHOD_NOT_VALID_455, seq[1])
+			elif rendition is not None and self.setRendition(rendition):
+				self.replyRtsp(self.OK_200, seq[1])
+			else:
+				self.replyRtsp(self.PARAMETER_NOT_UNDERSTOOD_451, seq[1])
+		
 		# Process TEARDOWN request
 		elif requestType == self.TEARDOWN:
 			print("processing TEARDOWN\n")
 
-			self.clientInfo['event'].set()
+			self.stopStreaming()
 			
 			self.replyRtsp(self.OK_200, seq[1])
 			
 			# Close the RTP socket
-			self.clientInfo['rtpSocket'].close()
+			self.closeRtpSocket()
 			
-	def sendRtp(self):
-		"""Send RTP packets over UDP with HD support and fragmentation."""
-		while True:
-			self.clientInfo['event'].wait(0.02) #50fps
+			# Release the video file (or this session's share of its mapping)
+			if 'videoStream' in self.clientInfo:
+				self.clientInfo['videoStream'].close()
+			self.releaseChannel()
 			
-			# Stop sending if request is PAUSE or TEARDOWN
-			if self.clientInfo['event'].isSet(): 
-				break 
-				
-			data = self.clientInfo['videoStream'].nextFrame()
-			if data: 
-				frameNumber = self.clientInfo['videoStream'].frameNbr()
-				frameSize = len(data)
-				
-				try:
-					address = self.clientInfo['rtspSocket'][1][0]
-					port = int(self.clientInfo['rtpPort'])
-					
-					# Check if frame needs fragmentation
-					if frameSize > self.MAX_PAYLOAD_SIZE:
-						# Fragment the frame
-						self.sendFragmentedFrame(data, frameNumber, address, port)
-					else:
-						# Send as single packet
-						rtpPacket = self.makeRtp(data, frameNumber)
-						self.clientInfo['rtpSocket'].sendto(rtpPacket, (address, port))
-						self.stats.recordPacketSent(len(rtpPacket))
-					
-					self.stats.recordFrameSent()
-					
-					# Print stats every 100 frames
-					if frameNumber % 100 == 0:
-						stats = self.stats.getStats()
-						print(f"[Server] Frame {frameNumber} | Size: {frameSize} bytes | "
-						      f"BW: {stats['bandwidth_sent_kbps']:.0f} Kbps | "
-						      f"Fragments: {stats['fragments_sent']}")
-						
-				except Exception as e:
-					print(f"Connection Error: {e}")
-					#print('-'*60)
-					#traceback.print_exc(file=sys.stdout)
-					#print('-'*60)
-		
-		# Print final statistics when streaming stops
-		print("\n[Server] Streaming stopped. Final statistics:")
-		self.stats.printStats()
+			sharedRegistry.unregister(self)
+			
+	def requestHeader(self, request, name):
+		"""Return the value of a header line of an RTSP request, or None."""
+		prefix = name.lower() + ':'
+		for line in request[1:]:
+			if line.lower().startswith(prefix):
+				return line[len(prefix):].strip()
+		return None
+	
+	def applyPlayRange(self, request):
+		"""Seek to the start of a PLAY request's Range and set its end and Scale. Return the reply headers.
+
+		Without a Range, playback resumes where it paused. Seeking takes constant
+		time (frame index). Raises ValueError for a malformed or unsatisfiable range.
+		"""
+		rangeValue = self.requestHeader(request, 'Range')
+		scaleValue = self.requestHeader(request, 'Scale')
+		if self.channel is not None:
+			# A broadcast is played where the channel is
+			return ['Range: ' + formatNptRange(None)]
+		
+		videoStream = self.clientInfo['videoStream']
+		scale = parseScale(scaleValue) if scaleValue is not None else 1.0
+		if rangeValue is not None:
+			start, end = parseNptRange(rangeValue)
+			totalFrames = videoStream.getTotalFrames()
+			duration = videoStream.getDuration(self.FRAME_RATE)
+			# Times are bounded by the duration before becoming frame numbers: a huge finite npt time would overflow int()
+			if start is not None:
+				frameNumber = int(round(start * self.FRAME_RATE)) + 1 if start < duration else totalFrames + 1
+				if frameNumber > totalFrames:
+					raise ValueError(f"Range {rangeValue!r} starts after the end ({duration:.3f}s)")
+				videoStream.seek(frameNumber)
+			self.endFrame = None
+			if end is not None:
+				# A range ending within its first frame still plays that frame
+				self.endFrame = max(int(round(min(end, duration) * self.FRAME_RATE)), videoStream.frameNbr() + 1)
+		
+		# Fast-forward only: the server skips frames; slower or reverse play is sent at normal speed
+		self.scale = min(scale, MAX_SCALE) if scale > 1.0 else 1.0
+		self.scaleCredit = 0.0
+		position = videoStream.frameNbr() / self.FRAME_RATE
+		end = self.endFrame / self.FRAME_RATE if self.endFrame is not None else None
+		headers = ['Range: ' + formatNptRange(position, end)]
+		if scaleValue is not None or self.scale != 1.0:
+			headers.append(f"Scale: {self.scale:g}")
+		print(f"[Server] Session {self.clientInfo['session']}: playing from {position:.3f}s at {self.scale:g}x")
+		return headers
+	
+	def setRendition(self, rendition):
+		"""Send frames in a rendition from the next frame on. Return False if it cannot be produced."""
+		if self.channel is not None and rendition != FULL:
+			print(f"[Server] Rendition {rendition!r} unavailable on broadcast channels, sending {self.rendition}")
+			return False
+		if rendition != FULL and (rendition not in RENDITIONS or not sharedTranscoder.available()):
+			print(f"[Server] Rendition {rendition!r} unavailable "
+			      f"({'Pillow or transcode workers missing' if rendition in RENDITIONS else 'unknown'}), "
+			      f"sending {self.rendition}")
+			return False
+		if rendition != self.rendition:
+			print(f"[Server] Session {self.clientInfo.get('session')}: sending {rendition} rendition")
+		self.rendition = rendition
+		return True
 	
-	def makeRtp(self, payload, frameNbr, fragment_id=0, total_fragments=1, fragment_index=0):
-		"""RTP-packetize the video data with optional fragmentation support."""
-		version = 2
-		padding = 0
-		extension = 0
-		cc = 0
-		marker = 1 if (fragment_index == total_fragments - 1) else 0  # Set marker on last fragment
-		pt = 26 # MJPEG type
-		seqnum = frameNbr
-		ssrc = 0 
+	def startStreaming(self):
+		"""Hand the session to the shared pacer, which sends its frames on a drift-free clock."""
+		if self.channel is not None:
+			# The channel's producer sends to every subscriber
+			sharedChannels.subscribe(self.channel, self)
+			return
+		self.pacedStream = PacedStream(self, self.FRAME_RATE, self.TARGET_BITRATE, reader=sharedReader)
+		sharedPacer.add(self.pacedStream)
+	
+	def stopStreaming(self):
+		"""Stop sending RTP packets (PAUSE or TEARDOWN)."""
+		if self.channel is not None:
+			if self.channel.unsubscribe(self):
+				self.streamingStopped()
+		elif self.pacedStream is not None:
+			self.pacedStream.cancel()
+			frame = self.pacedStream.finishReading()
+			if frame is not None:
+				# Read ahead but never sent: the next PLAY starts with it
+				self.clientInfo['videoStream'].seek(frame[0])
+			self.pacedStream = None
+			self.streamingStopped()
+	
+	def openChannel(self, filename):
+		"""Join the broadcast channel of a file. Raises IOError if it cannot be read."""
+		self.channel = sharedChannels.open(filename, fragmentSize=self.MAX_PAYLOAD_SIZE, frameRate=self.FRAME_RATE,
+		                                   bitrate=self.TARGET_BITRATE, fecGroup=self.FEC_GROUP,
+		                                   retransmitDeadline=self.RETRANSMIT_DEADLINE if self.RETRANSMIT else None,
+		                                   useMmap=self.USE_MMAP)
+		if self.channel.retransmitBuffer is not None:
+			# NACKs name the channel's fragment ids
+			self.retransmitBuffer = self.channel.retransmitBuffer
+	
+	def releaseChannel(self):
+		"""Leave the broadcast channel (TEARDOWN or disconnect)."""
+		if self.channel is not None:
+			sharedChannels.close(self.channel)
+			self.channel = None
+	
+	def nextFramePackets(self, late=0):
+		"""Read the next frame and RTP-packetize it. Return a list of PendingPacket."""
+		frame = self.prepareFrame(late)
+		return self.framePackets(frame) if frame is not None else []
+	
+	def prepareFrame(self, late=0):
+		"""Pick and read the next frame to send (on a reader thread, ahead of its deadline).
+
+		The `late` frames whose send times the pacing clock missed in a stall
+		are dropped, so playback stays on real time. Return (frameNumber, data), or
+		None at the end of the stream or range.
+		"""
+		videoStream = self.clientInfo['videoStream']
+		skip = thinned = 0
+		if self.ADAPTIVE:
+			skip = thinned = self.thinning.framesToSkip()
+		if late:
+			# The clock runs at FRAME_RATE * ratio: each missed tick stands for 1 / ratio frames
+			late = round(late / self.thinning.ratio) if self.ADAPTIVE else late
+			skip += late
+			thinned += late
+		if self.scale != 1.0:
+			# Fast-forward: each frame sent stands for `scale` frames of the file
+			self.scaleCredit += self.scale * (skip + 1)
+			skip = int(self.scaleCredit)
+			self.scaleCredit -= skip
+			skip -= 1
+		if skip:
+			# Skipped frames are never read
+			current = videoStream.frameNbr()
+			target = min(current + skip, self.endFrame if self.endFrame is not None else videoStream.getTotalFrames())
+			videoStream.seek(target + 1)
+			if thinned:
+				# Frames passed over for fast-forward are not counted as thinned or late
+				self.stats.recordFrameSkipped(min(round(thinned * self.scale), target - current))
+		if self.endFrame is not None and videoStream.frameNbr() >= self.endFrame:
+			return None
+		data = self.readFrame(videoStream)
+		if not data:
+			return None
+		return videoStream.frameNbr(), data
+	
+	def framePackets(self, frame):
+		"""RTP-packetize a frame from prepareFrame() (pacing thread). Return a list of PendingPacket."""
+		if self.ADAPTIVE:
+			self.applyThinning()
+		frameNumber, data = frame
+		frameSize = len(data)
+		timestamp = mediaTimestamp(frameNumber, self.FRAME_RATE)  # Media clock, shared by the frame's fragments
+		
+		# Check if frame needs fragmentation
+		if frameSize > self.MAX_PAYLOAD_SIZE:
+			packets = self.fragmentFrame(data, frameNumber, timestamp)
+			if self.RETRANSMIT and packets:
+				# Data fragments only: NACK indices name data fragments
+				self.retransmitBuffer.addFrame(self.fragmentId, packets, monotonic())
+			if self.FEC_GROUP and packets:
+				packets = protectFragments(packets, self.FEC_GROUP)
+		else:
+			packets = [PendingPacket(data, frameNumber, timestamp)]
 		
-		rtpPacket = RtpPacket()
+		self.stats.recordFrameSent()
+		if self.ADAPTIVE:
+			self.thinning.onFrameSent(frameNumber)
 		
-		rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, 
-		                 fragment_id, total_fragments, fragment_index)
+		# Print stats every 100 frames
+		if frameNumber % 100 == 0:
+			stats = self.stats.getStats()
+			print(f"[Server] Frame {frameNumber} | Size: {frameSize} bytes | "
+			      f"BW: {stats['bandwidth_sent_kbps']:.0f} Kbps | "
+			      f"Fragments: {stats['fragments_sent']}")
 		
-		return rtpPacket.getPacket()
+		return packets
+	
+	def readFrame(self, videoStream):
+		"""Read the next frame in this session's rendition (the original while the rendition is not ready)."""
+		rendition = self.rendition
+		if rendition == FULL:
+			return videoStream.nextFrame()
+		frameNumber = videoStream.frameNbr() + 1
+		if frameNumber > videoStream.getTotalFrames():
+			return None
+		# Transcode the frames that will actually be sent next (thinning skips some)
+		step = self.scale / self.thinning.ratio if self.ADAPTIVE else self.scale
+		sharedTranscoder.prefetch(videoStream, (frameNumber + round(i * step) for i in range(1, DEFAULT_LOOKAHEAD + 1)),
+		                          rendition)
+		data = sharedTranscoder.get(videoStream, frameNumber, rendition)
+		if data is None:
+			self.renditionMisses += 1
+			return videoStream.nextFrame()
+		videoStream.seek(frameNumber + 1)
+		self.renditionFrames += 1
+		return data
+	
+	def applyThinning(self):
+		"""Slow the pacing clock (and bitrate) to the share of frames sent (pacing thread)."""
+		ratio = self.thinning.ratio
+		pacedStream = self.pacedStream
+		if ratio == self.appliedRatio or pacedStream is None:
+			return
+		self.appliedRatio = ratio
+		pacedStream.clock.setFrameRate(self.FRAME_RATE * ratio)
+		if self.TARGET_BITRATE:
+			pacedStream.setBitrate(self.TARGET_BITRATE * ratio)
+	
+	def openRtpSocket(self):
+		"""Create the RTP/UDP socket, connected to the client's RTP port."""
+		# PLAY after PAUSE: the previous socket (and its feedback reader) is done
+		self.closeRtpSocket()
+		self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		# A connected socket skips per-packet address parsing and route lookup
+		self.clientInfo["rtpSocket"].connect((self.clientInfo['rtspSocket'][1][0], int(self.clientInfo['rtpPort'])))
+	
+	def sendPacket(self, packet):
+		"""Send one RTP packet to the client, header and payload as separate iovecs."""
+		header = self.headerTemplate.writePacket(packet)
+		try:
+			if self.USE_SENDMSG:
+				self.clientInfo['rtpSocket'].sendmsg((header, packet.payload))
+			else:
+				self.clientInfo['rtpSocket'].send(bytes(header) + packet.payload)
+		except Exception as e:
+			print(f"Connection Error: {e}")
+			#print('-'*60)
+			#traceback.print_exc(file=sys.stdout)
+			#print('-'*60)
+			return
+		
+		self.stats.recordSent(len(header) + len(packet.payload), packet.total_fragments > 1)
+		if packet.flags:
+			self.stats.recordFecSent()
+	
+	def sendSharedPacket(self, packet):
+		"""Send a broadcast channel's packet with this session's sequence number and SSRC."""
+		seqnum = packet.seqnum - self.seqBase
+		if seqnum <= self.lastSeq:
+			return  # Rest of a frame that started before the session joined
+		header = self.headerTemplate.copy(packet.header, seqnum)
+		try:
+			if self.USE_SENDMSG:
+				self.clientInfo['rtpSocket'].sendmsg((header, packet.payload))
+			else:
+				self.clientInfo['rtpSocket'].send(bytes(header) + packet.payload)
+		except Exception as e:
+			print(f"Connection Error: {e}")
+			return
+		
+		self.stats.recordSent(len(header) + len(packet.payload), packet.isFragment)
+		if packet.flags:
+			self.stats.recordFecSent()
+		if packet.marker:
+			self.stats.recordFrameSent()
+	
+	def getSessionStats(self):
+		"""Get this session's metrics as a dictionary (called from the metrics thread)."""
+		stats = self.stats.getStats()
+		channel = self.channel
+		pacedStream = channel.pacedStream if channel is not None else self.pacedStream
+		pacing = pacedStream.getStats() if pacedStream is not None else {}
+		return {
+			'session': self.clientInfo.get('session'),
+			'client': self.clientInfo['rtspSocket'][1][0],
+			'file': self.clientInfo.get('fileName', ''),
+			'state': {self.INIT: 'init', self.READY: 'ready', self.PLAYING: 'playing'}[self.state],
+			'bytes_sent': stats['bytes_sent'],
+			'packets_sent': stats['packets_sent'],
+			'fragments_sent': stats['fragments_sent'],
+			'frames_sent': stats['frames_sent'],
+			'frames_skipped': stats['frames_skipped'],
+			'fec_packets_sent': stats['fec_packets_sent'],
+			'fps': stats['windows']['10s']['fps_sent'],
+			'target_fps': pacing.get('target_fps', self.FRAME_RATE),
+			'bitrate_kbps': stats['windows']['1s']['bandwidth_sent_kbps'],
+			'pacer_avg_lag_ms': pacing.get('avg_lag_ms', 0),
+			'pacer_max_lag_ms': pacing.get('max_lag_ms', 0),
+			'clock_resyncs': pacing.get('clock_resyncs', 0),
+			'rendition': self.rendition,
+			'rendition_frames': self.renditionFrames,
+			'rendition_misses': self.renditionMisses,
+			'keep_ratio': self.thinning.ratio,
+			'reported_loss_pct': self.thinning.loss * 100,
+		}
 	
-	def sendFragmentedFrame(self, data, frameNumber, address, port):
-		"""Fragment and send a large frame."""
+	def closeRtpSocket(self):
+		if 'rtpSocket' in self.clientInfo:
+			self.clientInfo['rtpSocket'].close()
+	
+	def startFeedback(self):
+		"""Read RTCP feedback arriving on the RTP socket on a thread of its own."""
+		rtpSocket = self.clientInfo['rtpSocket']
+		rtpSocket.settimeout(self.FEEDBACK_POLL)
+		threading.Thread(target=self.listenFeedback, args=(rtpSocket,), daemon=True).start()
+	
+	def listenFeedback(self, rtpSocket):
+		"""Handle feedback until the socket is closed or replaced (feedback thread)."""
+		while self.clientInfo.get('rtpSocket') is rtpSocket:
+			try:
+				data = rtpSocket.recv(2048)
+			except socket.timeout:
+				continue
+			except OSError:
+				# Closed, or the client's port is gone (ICMP port unreachable)
+				break
+			self.handleFeedback(data)
+	
+	def handleFeedback(self, data):
+		"""Act on one RTCP packet sent by the client."""
+		if not isRtcp(data):
+			return
+		pt, fmt = packetType(data)
+		try:
+			if pt == PT_RTPFB and fmt == FMT_FRAGMENT_NACK:
+				self.handleNack(decodeNack(data))
+			elif pt == PT_RR:
+				self.handleReceiverReport(decodeReceiverReport(data))
+		except ValueError as e:
+			print(f"[Server] Dropped malformed feedback: {e}")
+	
+	def handleNack(self, entries):
+		"""Resend the requested fragments that are still buffered and not past their deadline."""
+		now = monotonic()
+		requested = 0
+		for fragmentId, index in expandNackEntries(entries):
+			requested += 1
+			packet = self.retransmitBuffer.lookup(fragmentId, index, now) if self.RETRANSMIT else None
+			if packet is None:
+				self.stats.recordRetransmitSuppressed()
+			else:
+				self.resendPacket(packet)
+		self.stats.recordNackReceived(requested)
+	
+	def handleReceiverReport(self, report):
+		"""Adapt the share of frames sent to the loss the client reports."""
+		self.stats.recordReceiverReportReceived()
+		# Broadcast sessions all get the channel's frames: only on-demand sessions are thinned
+		if self.ADAPTIVE and self.channel is None and self.thinning.onReport(report):
+			print(f"[Server] Session {self.clientInfo.get('session')}: {self.thinning.loss * 100:.1f}% loss, "
+			      f"client at {report.fps:.1f} fps, sending {self.thinning.ratio * 100:.0f}% of frames")
+	
+	def resendPacket(self, packet):
+		"""Send a fragment again, flagged as a retransmission."""
+		header = self.retransmitTemplate.write(packet.seqnum - self.seqBase, packet.timestamp, packet.marker, packet.fragment_id,
+		                                       packet.total_fragments, packet.fragment_index, packet.fragment_size,
+		                                       FRAGMENT_FLAG_RETRANSMIT)
+		try:
+			if self.USE_SENDMSG:
+				self.clientInfo['rtpSocket'].sendmsg((header, packet.payload))
+			else:
+				self.clientInfo['rtpSocket'].send(bytes(header) + packet.payload)
+		except OSError as e:
+			print(f"[Server] Retransmit error: {e}")
+			return
+		self.stats.recordRetransmitSent(len(header) + len(packet.payload))
+	
+	def streamingStopped(self):
+		"""Print final statistics when streaming stops."""
+		print("\n[Server] Streaming stopped. Final statistics:")
+		self.stats.printStats()
+		if sharedCache.enabled():
+			print(f"[Server] {sharedCache.getStatsString()}")
+		if self.renditionFrames or self.renditionMisses:
+			print(f"[Server] Rendition {self.rendition}: {self.renditionFrames} frames transcoded, "
+			      f"{self.renditionMisses} sent as the original (not ready)")
+	
+	def fragmentFrame(self, data, frameNumber, timestamp):
+		"""Split a large frame into fragment packets. Return a list of PendingPacket."""
 		# Calculate number of fragments needed
 		totalFragments = (len(data) + self.MAX_PAYLOAD_SIZE - 1) // self.MAX_PAYLOAD_SIZE
-		self.fragmentId += 1
+		if totalFragments > MAX_FRAGMENTS:
+			print(f"[Server] Frame {frameNumber} too large: {len(data)} bytes needs {totalFragments} fragments")
+			return []
+		self.fragmentId = (self.fragmentId + 1) & 0xFFFF
 		
 		print(f"[Server] Fragmenting frame {frameNumber}: {len(data)} bytes into {totalFragments} fragments")
 		
-		# Send each fragment
-		for i in range(totalFragments):
-			start = i * self.MAX_PAYLOAD_SIZE
-			end = min(start + self.MAX_PAYLOAD_SIZE, len(data))
-			fragmentData = data[start:end]
-			
-			# Create RTP packet with fragment information
-			rtpPacket = self.makeRtp(fragmentData, frameNumber, self.fragmentId, totalFragments, i)
-			self.clientInfo['rtpSocket'].sendto(rtpPacket, (address, port))
-			
-			self.stats.recordPacketSent(len(rtpPacket))
-			self.stats.recordFragmentSent()
-			
-			# Small delay between fragments to avoid overwhelming the network
-			time.sleep(0.001)  # 1ms delay between fragments
+		# Slices of a memoryview reference the frame instead of copying it
+		return fragmentPackets(data, frameNumber, timestamp, self.fragmentId, self.MAX_PAYLOAD_SIZE)
 		
-	def replyRtsp(self, code, seq):
-		"""Send RTSP reply to the client."""
+	def replyRtsp(self, code, seq, headers=()):
+		"""Send RTSP reply to the client, with extra header lines on 200 OK."""
 		if code == self.OK_200:
 			#print("200 OK")
 			reply = 'RTSP/1.0 200 OK\nCSeq: ' + seq + '\nSession: ' + str(self.clientInfo['session'])
+			for header in headers:
+				reply += '\n' + header
 			connSocket = self.clientInfo['rtspSocket'][0]
 			connSocket.send(reply.encode())
 		
@@ -217,3 +634,17 @@ class ServerWorker:
 			print("404 NOT FOUND")
 		elif code == self.CON_ERR_500:
 			print("500 CONNECTION ERROR")
+		elif code == self.PARAMETER_NOT_UNDERSTOOD_451:
+			self.replyRtspError('451 Parameter Not Understood', seq)
+		elif code == self.METHOD_NOT_VALID_455:
+			self.replyRtspError('455 Method Not Valid In This State', seq)
+		elif code == self.INVALID_RANGE_457:
+			self.replyRtspError('457 Invalid Range', seq)
+	
+	def replyRtspError(self, status, seq):
+		"""Send an RTSP error reply, with the Session header only once SETUP has made one."""
+		reply = 'RTSP/1.0 ' + status + '\nCSeq: ' + seq
+		session = self.clientInfo.get('session')
+		if session is not None:
+			reply += '\nSession: ' + str(session)
+		self.clientInfo['rtspSocket'][0].send(reply.encode())
@@ -0,0 +1,178 @@
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from FrameCache import sharedCache
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None  # Renditions need Pillow; without it sessions are sent the original frames
+
+FULL = 'full'  # The frames as stored in the file
+
+# Quality ladder: rendition -> (JPEG quality, scale). Scales of 1/2 and 1/4
+# let libjpeg decode straight to the smaller size (DCT scaling).
+RENDITIONS = {
+	'high': (80, 1.0),
+	'medium': (70, 0.5),
+	'low': (50, 0.25),
+}
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+DEFAULT_LOOKAHEAD = 8  # Frames transcoded ahead of the one being sent
+MAX_JOBS = 512  # Transcodes queued, running or finished but not cached
+
+
+def transcodeFrame(path, offset, length, quality, scale):
+	"""Re-encode one frame of a video file as JPEG (runs in a pool process). Return the JPEG bytes."""
+	with open(path, 'rb') as f:
+		f.seek(offset)
+		data = f.read(length)
+	image = Image.open(io.BytesIO(data))
+	if scale < 1.0:
+		size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+		image.draft('RGB', size)  # Decode at the smallest DCT scale still >= size
+		if image.size != size:
+			image = image.resize(size, Image.BILINEAR)
+	if image.mode not in ('RGB', 'L'):
+		image = image.convert('RGB')
+	out = io.BytesIO()
+	image.save(out, 'JPEG', quality=quality)
+	return out.getvalue()
+
+
+class TranscodePool:
+	"""Process pool producing lower renditions of frames for every session of the server process.
+
+	Renditions are cached in the FrameCache under (file, version, frame
+	number, rendition), so viewers of the same file and rendition share
+	each transcode, and concurrent requests for a frame share one job.
+	Pool processes read the frame from the file themselves, so only its
+	location and the JPEG result cross the process boundary. Sessions
+	prefetch the frames they will send next; get() never waits, so the
+	send path is never blocked: a frame whose rendition is not ready yet
+	is a miss and the caller sends the original instead. A miss cancels
+	the frame's job if it has not started, so an overloaded pool keeps
+	working on frames that can still be on time.
+	"""
+
+	def __init__(self, workers=DEFAULT_WORKERS, cache=sharedCache):
+		self.workers = workers
+		self.cache = cache
+		self.executor = None  # Started on first use, in the process that uses it
+		self.lock = threading.Lock()
+		self.jobs = OrderedDict()  # key -> Future, oldest first
+		self.transcoded = 0
+		self.failed = 0
+		self.dropped = 0  # Cancelled before starting: the frame was needed before it could be ready
+		self.served = 0
+		self.misses = 0
+
+	def configure(self, workers):
+		"""Set the number of pool processes (0 disables renditions)."""
+		self.shutdown()
+		self.workers = max(0, workers)
+
+	def available(self):
+		"""Check if renditions can be produced (Pillow installed and workers configured)."""
+		return Image is not None and self.workers > 0
+
+	def _submit(self, key, location, rendition):
+		quality, scale = RENDITIONS[rendition]
+		with self.lock:
+			if key in self.jobs:
+				return
+			if self.executor is None:
+				# Spawned, not forked: the server's threads and sockets stay out of the workers
+				self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'))
+			future = self.executor.submit(transcodeFrame, *location, quality, scale)
+			self.jobs[key] = future
+			while len(self.jobs) > MAX_JOBS:
+				self.jobs.popitem(last=False)[1].cancel()
+		future.add_done_callback(lambda future: self._done(key, future))
+
+	def _done(self, key, future):
+		"""Cache a finished rendition (pool management thread)."""
+		if future.cancelled():
+			return
+		if future.exception() is not None:
+			# Kept in jobs so the frame is not retried until the job ages out
+			self.failed += 1
+			print(f"[Transcoder] Frame {key[-2]} ({key[-1]}) failed: {future.exception()}")
+			return
+		self.transcoded += 1
+		if self.cache.enabled():
+			self.cache.put(key, future.result())
+			with self.lock:
+				self.jobs.pop(key, None)
+
+	def get(self, videoStream, frameNumber, rendition):
+		"""Return a frame in a rendition if it is ready, else None (and start transcoding it)."""
+		key = videoStream.cacheKey + (frameNumber, rendition)
+		data = self.cache.get(key) if self.cache.enabled() else None
+		if data is None:
+			with self.lock:
+				future = self.jobs.get(key)
+			if future is not None and future.done() and not future.cancelled() and future.exception() is None:
+				data = future.result()
+			elif future is not None and future.cancel():
+				# Still queued and already late: free the pool for frames that can still be on time
+				with self.lock:
+					self.jobs.pop(key, None)
+				self.dropped += 1
+			elif future is None:
+				location = videoStream.frameLocation(frameNumber)
+				if location is not None:
+					self._submit(key, location, rendition)
+		if data is None:
+			self.misses += 1
+			return None
+		self.served += 1
+		return data
+
+	def prefetch(self, videoStream, frameNumbers, rendition):
+		"""Start transcoding frames that will be sent soon, unless cached or already queued."""
+		for frameNumber in frameNumbers:
+			key = videoStream.cacheKey + (frameNumber, rendition)
+			if key in self.jobs or (self.cache.enabled() and self.cache.contains(key)):
+				continue
+			location = videoStream.frameLocation(frameNumber)
+			if location is None:
+				break
+			self._submit(key, location, rendition)
+
+	def pending(self):
+		"""Return the number of transcodes queued or running."""
+		with self.lock:
+			return sum(1 for future in self.jobs.values() if not future.done())
+
+	def shutdown(self):
+		with self.lock:
+			executor, self.executor = self.executor, None
+			for future in self.jobs.values():
+				future.cancel()
+			self.jobs.clear()
+		if executor is not None:
+			executor.shutdown(wait=False)
+
+	def getStats(self):
+		"""Get transcoding counters as a dictionary."""
+		lookups = self.served + self.misses
+		return {
+			'workers': self.workers,
+			'pending': self.pending(),
+			'transcoded': self.transcoded,
+			'failed': self.failed,
+			'dropped': self.dropped,
+			'served': self.served,
+			'misses': self.misses,
+			'ready_rate': (self.served / lookups * 100) if lookups else 0,
+		}
+
+
+# Pool shared by every session of the server process
+sharedTranscoder = TranscodePool()
@@ -1,5 +1,339 @@
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+from RtpPacket import DEFAULT_FRAME_RATE, MAX_FRAME_SIZE
+
+# Sidecar index file: <video>.idx next to the video file
+INDEX_EXT = '.idx'
+INDEX_MAGIC = b'VSIX'
+INDEX_VERSION = 1
+# magic, version, format code, source size, source mtime (ns), frame count
+INDEX_HEADER = struct.Struct('<4sHHQqQ')
+INDEX_FORMATS = {'custom': 1, 'mjpeg': 2, 'unknown': 0}
+
+
+class FrameIndex:
+	"""Compact offset/length table of every frame in a video file."""
+
+	def __init__(self, fileFormat, offsets=None, lengths=None):
+		self.fileFormat = fileFormat
+		self.offsets = offsets if offsets is not None else array('Q')  # Start of frame data
+		self.lengths = lengths if lengths is not None else array('I')  # Frame data length
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def frameCount(self):
+		"""Return the total number of frames."""
+		return len(self.offsets)
+
+	def frameAt(self, frameNumber):
+		"""Return (offset, length) of a frame (1-based frame number)."""
+		return self.offsets[frameNumber - 1], self.lengths[frameNumber - 1]
+
+	def append(self, offset, length):
+		"""Add the next frame boundary."""
+		self.offsets.append(offset)
+		self.lengths.append(length)
+
+	@staticmethod
+	def sidecarPath(filename):
+		"""Return the path of the index file for a video."""
+		return filename + INDEX_EXT
+
+	@classmethod
+	def load(cls, filename, fileFormat):
+		"""Load the sidecar index of a video. Return None if missing or stale."""
+		try:
+			st = os.stat(filename)
+			with open(cls.sidecarPath(filename), 'rb') as f:
+				header = f.read(INDEX_HEADER.size)
+				if len(header) < INDEX_HEADER.size:
+					return None
+				magic, version, formatCode, size, mtime, count = INDEX_HEADER.unpack(header)
+				if (magic != INDEX_MAGIC or version != INDEX_VERSION
+				        or formatCode != INDEX_FORMATS.get(fileFormat)
+				        or size != st.st_size or mtime != st.st_mtime_ns):
+					return None
+
+				offsets = array('Q')
+				lengths = array('I')
+				offsets.fromfile(f, count)
+				lengths.fromfile(f, count)
+		except (OSError, EOFError):
+			return None
+
+		return cls(fileFormat, offsets, lengths)
+
+	def save(self, filename):
+		"""Write the index as a sidecar file next to the video."""
+		path = self.sidecarPath(filename)
+		tmpPath = f"{path}.{os.getpid()}.tmp"
+		try:
+			st = os.stat(filename)
+			with open(tmpPath, 'wb') as f:
+				f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, INDEX_FORMATS.get(self.fileFormat, 0),
+				                          st.st_size, st.st_mtime_ns, len(self)))
+				self.offsets.tofile(f)
+				self.lengths.tofile(f)
+			# Atomic replace so concurrent SETUPs never see a partial index
+			os.replace(tmpPath, path)
+			return True
+		except OSError as e:
+			print(f"[VideoStream] Warning: Could not save frame index {path}: {e}")
+			try:
+				os.remove(tmpPath)
+			except OSError:
+				pass
+			return False
+
+	@classmethod
+	def build(cls, file, fileFormat):
+		"""Scan a video file once and record every frame boundary."""
+		index = cls(fileFormat)
+		file.seek(0)
+		if fileFormat == 'mjpeg':
+			scanMJPEG(file, index)
+		elif fileFormat == 'custom':
+			scanCustom(file, index)
+		file.seek(0)
+		return index
+
+
+def scanCustom(file, index):
+	"""Index a custom format file (5-byte decimal length prefix + data)."""
+	fileSize = os.fstat(file.fileno()).st_size
+	while True:
+		lengthData = file.read(5)
+		if not lengthData or len(lengthData) < 5:
+			break
+
+		try:
+			framelength = int(lengthData)
+		except ValueError as e:
+			print(f"[VideoStream] Error reading frame length: {e}")
+			break
+
+		if framelength <= 0 or framelength > MAX_FRAME_SIZE:
+			print(f"[VideoStream] Warning: Invalid frame length {framelength}, stopping scan")
+			break
+
+		offset = file.tell()
+		file.seek(framelength, os.SEEK_CUR)
+		if file.tell() > fileSize:
+			print(f"[VideoStream] Warning: Truncated frame at offset {offset}")
+			break
+
+		index.append(offset, framelength)
+
+
+# JPEG markers
+SOI = b'\xff\xd8'
+EOI = b'\xff\xd9'
+MARKER_SOS = 0xDA
+MARKER_EOI = 0xD9
+MIN_JPEG_SIZE = 100  # Smaller frames are treated as garbage
+
+SCAN_BLOCK_SIZE = 1 << 20  # Read the file in 1MB blocks while scanning
+
+
+class MJPEGScanner:
+	"""Block-buffered MJPEG frame boundary scanner.
+
+	Reads the file in large blocks and locates markers with bytes.find instead
+	of a byte-at-a-time loop. Header segments (APPn, DQT, DHT, SOF...) are
+	skipped using their length fields, so SOI/EOI markers inside embedded EXIF
+	thumbnails are never mistaken for frame boundaries. Only the entropy-coded
+	data after SOS is searched for EOI; there a literal FF is always stuffed
+	as FF 00, so FF D9 can only be the real end of the image.
+	"""
+
+	def __init__(self, file, blockSize=SCAN_BLOCK_SIZE):
+		self.file = file
+		self.blockSize = blockSize
+		self.buf = b''
+		self.base = file.tell()  # File offset of buf[0]
+		self.eof = False
+
+	def _fill(self, keepFrom):
+		"""Drop buffered bytes before file offset keepFrom and read one more block."""
+		if self.eof:
+			return False
+		block = self.file.read(self.blockSize)
+		if not block:
+			self.eof = True
+			return False
+		drop = keepFrom - self.base
+		self.buf = self.buf[drop:] + block
+		self.base = keepFrom
+		return True
+
+	def _ensure(self, end, keepFrom):
+		"""Make sure file offsets up to end are buffered. Return False at EOF."""
+		while self.base + len(self.buf) < end:
+			if not self._fill(keepFrom):
+				return False
+		return True
+
+	def _find(self, pattern, start, keepFrom, limit=None):
+		"""Find pattern at or after file offset start, reading blocks as needed."""
+		while True:
+			pos = self.buf.find(pattern, start - self.base)
+			if pos >= 0:
+				return self.base + pos
+			if limit is not None and self.base + len(self.buf) > limit:
+				return -1
+			# Markers may straddle a block boundary: rescan the last byte
+			start = max(start, self.base + len(self.buf) - len(pattern) + 1)
+			if not self._fill(min(keepFrom, start)):
+				return -1
+
+	def _frameEnd(self, frameStart):
+		"""Return the file offset just past the EOI of the frame starting at frameStart."""
+		pos = frameStart + 2
+		while True:
+			if not self._ensure(pos + 4, frameStart):
+				return -1
+			i = pos - self.base
+			if self.buf[i] != 0xFF:
+				# Not a marker where one should be; fall back to a plain EOI search
+				break
+			marker = self.buf[i + 1]
+			if marker == 0xFF:
+				pos += 1  # Fill byte
+				continue
+			if marker == MARKER_EOI:
+				return pos + 2
+			if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+				pos += 2  # Standalone marker without length
+				continue
+
+			segmentLength = (self.buf[i + 2] << 8) | self.buf[i + 3]
+			pos += 2 + segmentLength
+			if marker == MARKER_SOS:
+				break
+
+			if pos - frameStart > MAX_FRAME_SIZE:
+				return -1
+
+		end = self._find(EOI, pos, frameStart, frameStart + MAX_FRAME_SIZE)
+		return end + 2 if end >= 0 else -1
+
+	def frames(self):
+		"""Yield (offset, length) for every frame in the file."""
+		pos = self.base
+		while True:
+			start = self._find(SOI, pos, pos)
+			if start < 0:
+				return
+
+			end = self._frameEnd(start)
+			if end < 0:
+				# EOF inside the frame: keep it if it looks like a JPEG (truncated last frame)
+				self._ensure(start + MAX_FRAME_SIZE, start)
+				length = min(self.base + len(self.buf), start + MAX_FRAME_SIZE) - start
+				if self.eof and length > MIN_JPEG_SIZE:
+					yield start, length
+					return
+				if self.eof:
+					return
+				print(f"[VideoStream] Warning: Frame at offset {start} exceeds 5MB, resyncing")
+				pos = start + 2
+				continue
+
+			length = end - start
+			if length > MIN_JPEG_SIZE:
+				yield start, length
+			pos = end
+
+
+def scanMJPEG(file, index):
+	"""Index a standard MJPEG file (concatenated JPEGs, FF D8 ... FF D9)."""
+	for offset, length in MJPEGScanner(file).frames():
+		index.append(offset, length)
+
+
+def fileKey(filename, file):
+	"""Return (path, size, mtime) of an open video file: the version its index, mapping and cached frames belong to."""
+	st = os.fstat(file.fileno())
+	return os.path.abspath(filename), st.st_size, st.st_mtime_ns
+
+
+# Indexes already loaded by this process, keyed by file version. The lock only
+# guards the dicts: a file is loaded or scanned outside it, by the first session
+# asking for it, while later sessions of the same file wait on its Event.
+_indexCache = {}
+_indexLoading = {}  # key -> Event set when the loading session is done
+_indexLock = threading.Lock()
+
+
+def getFrameIndex(key, file, fileFormat):
+	"""Return the frame index of a video: from memory, the sidecar file, or a fresh scan."""
+	while True:
+		with _indexLock:
+			index = _indexCache.get(key)
+			if index is not None:
+				return index
+			loading = _indexLoading.get(key)
+			if loading is None:
+				loading = _indexLoading[key] = threading.Event()
+				break
+		# Retry once it is done: if the load failed, the next caller tries itself
+		loading.wait()
+
+	try:
+		path = key[0]
+		index = FrameIndex.load(path, fileFormat)
+		if index is None:
+			print(f"[VideoStream] Building frame index for {path}")
+			index = FrameIndex.build(file, fileFormat)
+			index.save(path)
+		with _indexLock:
+			_indexCache[key] = index
+		return index
+	finally:
+		with _indexLock:
+			del _indexLoading[key]
+		loading.set()
+
+
+# Memory mappings shared by every VideoStream of the same file version, so a
+# replaced file gets a new mapping to go with its new index
+_mappings = {}
+_mappingLock = threading.Lock()
+
+
+def acquireMapping(key, file):
+	"""Return a read-only mapping of a video file version shared by all sessions."""
+	with _mappingLock:
+		entry = _mappings.get(key)
+		if entry is None:
+			entry = [mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), 0]
+			_mappings[key] = entry
+		entry[1] += 1
+		return entry[0]
+
+
+def releaseMapping(key):
+	"""Drop one reference to a shared mapping, unmapping it after the last one."""
+	with _mappingLock:
+		entry = _mappings.get(key)
+		if entry is None:
+			return
+		entry[1] -= 1
+		if entry[1] <= 0:
+			del _mappings[key]
+			try:
+				entry[0].close()
+			except BufferError:
+				pass  # Frames still in flight; unmapped once they are garbage collected
+
+
 class VideoStream:
-	def __init__(self, filename):
+	def __init__(self, filename, useMmap=False, cache=None):
 		self.filename = filename
 		try:
 			self.file = open(filename, 'rb')
@@ -8,164 +342,148 @@ class VideoStream:
 		self.frameNum = 0
 		self.totalBytesRead = 0
 		self.lastFrameSize = 0
-		
+
 		# Auto-detect file format
 		self.fileFormat = self._detectFormat()
 		print(f"[VideoStream] Detected format: {self.fileFormat}")
-		
+
+		# Frame boundaries, scanned once and shared through the sidecar index.
+		# Index, mapping and cached frames all belong to the version opened here.
+		self.fileKey = fileKey(filename, self.file)
+		self.index = getFrameIndex(self.fileKey, self.file, self.fileFormat)
+
+		# In mmap mode frames are zero-copy memoryview slices of one mapping
+		# per file, shared by all sessions, and no per-session file handle is kept
+		self.mapping = None
+		self.view = None
+		if useMmap and self.fileKey[1] > 0:
+			self.mapping = acquireMapping(self.fileKey, self.file)
+			self.view = memoryview(self.mapping)
+			self.file.close()
+
+		# Optional process-wide FrameCache, keyed by (file, version, frame number).
+		# Mapped frames already live in the shared page cache and bypass it.
+		self.cache = cache if (cache is not None and cache.enabled() and self.view is None) else None
+		self.cacheKey = self.fileKey
+
 	def _detectFormat(self):
 		"""Detect if file is custom format (with length prefix) or standard MJPEG."""
 		pos = self.file.tell()
 		firstBytes = self.file.read(5)
 		self.file.seek(pos)
-		
+
 		if not firstBytes or len(firstBytes) < 5:
 			return 'unknown'
-		
+
 		# Try to parse as custom format (5-digit decimal length)
 		try:
 			length = int(firstBytes)
 			# If it's a reasonable length, likely custom format
-			if 0 < length < 5000000:
+			if 0 < length < MAX_FRAME_SIZE:
 				return 'custom'
 		except:
 			pass
-		
+
 		# Check for JPEG marker (FF D8)
 		if firstBytes[0] == 0xFF and firstBytes[1] == 0xD8:
 			return 'mjpeg'
-		
+
 		return 'custom'  # Default to custom format
-		
+
 	def nextFrame(self):
-		"""Get next frame - supports both custom format and standard MJPEG."""
-		if self.fileFormat == 'mjpeg':
-			return self._nextFrameMJPEG()
-		else:
-			return self._nextFrameCustom()
-	
-	def _nextFrameCustom(self):
-		"""Read frame from custom format (5-byte length prefix + data)."""
+		"""Get next frame - supports both custom format and standard MJPEG.
+
+		Returns bytes, or a memoryview into the shared mapping in mmap mode.
+		"""
+		if self.frameNum >= len(self.index):
+			return None
+
+		frameNumber = self.frameNum + 1
+		offset, framelength = self.index.frameAt(frameNumber)
 		try:
-			# Read frame length (first 5 bytes as decimal string)
-			lengthData = self.file.read(5)
-			if not lengthData or len(lengthData) < 5:
-				return None
-				
-			framelength = int(lengthData)
-			
-			# Validate frame length (sanity check for HD frames up to 5MB)
-			if framelength <= 0 or framelength > 5000000:
-				print(f"[VideoStream] Warning: Invalid frame length {framelength}, skipping")
-				return None
-							
-			# Read the current frame data
-			data = self.file.read(framelength)
-			
-			if len(data) == framelength:
-				self.frameNum += 1
-				self.lastFrameSize = framelength
-				self.totalBytesRead += framelength + 5  # Include length prefix
-				
-				# Log large frames (HD frames)
-				if framelength > 20000:  # > 20KB is likely HD
-					print(f"[VideoStream] HD Frame {self.frameNum}: {framelength} bytes")
-				
-				return data
+			if self.view is not None:
+				data = self.view[offset:offset + framelength]
+			elif self.cache is not None:
+				data = self.cache.getOrLoad(self.cacheKey + (frameNumber,),
+				                            lambda: self._readFrame(offset, framelength))
 			else:
-				print(f"[VideoStream] Warning: Expected {framelength} bytes, got {len(data)}")
-				return None
-				
-		except ValueError as e:
-			print(f"[VideoStream] Error reading frame length: {e}")
-			return None
+				data = self._readFrame(offset, framelength)
 		except Exception as e:
 			print(f"[VideoStream] Error reading frame: {e}")
 			return None
-	
-	def _nextFrameMJPEG(self):
-		"""Read frame from standard MJPEG format (JPEG markers)."""
-		try:
-			# Look for JPEG start marker (FF D8)
-			frameData = bytearray()
-			
-			# Read until we find FF D8 (JPEG start)
-			byte1 = self.file.read(1)
-			if not byte1:
-				return None
-			
-			# If we're not at a frame start, search for it
-			if byte1[0] != 0xFF:
-				while True:
-					byte1 = self.file.read(1)
-					if not byte1:
-						return None
-					if byte1[0] == 0xFF:
-						break
-			
-			byte2 = self.file.read(1)
-			if not byte2 or byte2[0] != 0xD8:
-				print(f"[VideoStream] Warning: Expected JPEG marker, got {byte2.hex() if byte2 else 'EOF'}")
-				return None
-			
-			# Start of JPEG frame
-			frameData.extend(byte1)
-			frameData.extend(byte2)
-			
-			# Read until we find JPEG end marker (FF D9)
-			while True:
-				byte = self.file.read(1)
-				if not byte:
-					# End of file
-					if len(frameData) > 100:  # Minimum valid JPEG size
-						break
-					return None
-				
-				frameData.append(byte[0])
-				
-				# Check for end marker (FF D9)
-				if len(frameData) >= 2 and frameData[-2] == 0xFF and frameData[-1] == 0xD9:
-					break
-				
-				# Safety check - don't read frames larger than 5MB
-				if len(frameData) > 5000000:
-					print(f"[VideoStream] Warning: Frame exceeds 5MB, stopping read")
-					break
-			
-			if len(frameData) > 100:  # Valid JPEG frame
-				self.frameNum += 1
-				self.lastFrameSize = len(frameData)
-				self.totalBytesRead += len(frameData)
-				
-				# Log large frames (HD frames)
-				if len(frameData) > 20000:
-					print(f"[VideoStream] HD Frame {self.frameNum}: {len(frameData)} bytes")
-				
-				return bytes(frameData)
-			else:
-				return None
-				
-		except Exception as e:
-			print(f"[VideoStream] Error reading MJPEG frame: {e}")
+
+		if data is None:
+			return None
+
+		self.frameNum += 1
+		self.lastFrameSize = framelength
+		# Include length prefix for the custom format
+		self.totalBytesRead += framelength + (5 if self.fileFormat == 'custom' else 0)
+
+		# Log large frames (HD frames)
+		if framelength > 20000:  # > 20KB is likely HD
+			print(f"[VideoStream] HD Frame {self.frameNum}: {framelength} bytes")
+
+		return data
+
+	def _readFrame(self, offset, framelength):
+		"""Read one frame from the file. Return None on a short read."""
+		self.file.seek(offset)
+		data = self.file.read(framelength)
+		if len(data) != framelength:
+			print(f"[VideoStream] Warning: Expected {framelength} bytes, got {len(data)}")
 			return None
-		
+		return data
+
+	def seek(self, frameNumber):
+		"""Position the stream so the next call to nextFrame() returns the given frame (1-based)."""
+		if frameNumber < 1 or frameNumber > len(self.index) + 1:
+			raise ValueError(f"Frame {frameNumber} out of range 1..{len(self.index)}")
+		self.frameNum = frameNumber - 1
+
+	def frameLocation(self, frameNumber):
+		"""Return (path, offset, length) of a frame's data in the file, or None if out of range (1-based)."""
+		if frameNumber < 1 or frameNumber > len(self.index):
+			return None
+		offset, framelength = self.index.frameAt(frameNumber)
+		return self.cacheKey[0], offset, framelength
+
 	def frameNbr(self):
 		"""Get frame number."""
 		return self.frameNum
-	
+
+	def getTotalFrames(self):
+		"""Get the exact number of frames in the video."""
+		return len(self.index)
+
+	def getDuration(self, frameRate=DEFAULT_FRAME_RATE):
+		"""Get the video duration in seconds at the given frame rate."""
+		return len(self.index) / frameRate
+
 	def getLastFrameSize(self):
 		"""Get the size of the last frame read."""
 		return self.lastFrameSize
-	
+
 	def getTotalBytesRead(self):
 		"""Get total bytes read from the video file."""
 		return self.totalBytesRead
-	
+
 	def reset(self):
 		"""Reset the video stream to the beginning."""
-		self.file.seek(0)
 		self.frameNum = 0
 		self.totalBytesRead = 0
 		self.lastFrameSize = 0
-	
-	
\ No newline at end of file
+
+	def isMapped(self):
+		"""Check if frames are served from the shared memory mapping."""
+		return self.view is not None
+
+	def close(self):
+		"""Close the video file or release the shared mapping."""
+		if self.view is not None:
+			self.view.release()
+			self.view = None
+			self.mapping = None
+			releaseMapping(self.fileKey)
+		else:
+			self.file.close()